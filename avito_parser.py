@@ -2,51 +2,65 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import random
+import argparse
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from dataset_cube import DatasetCube
+from dataset_storage import PARQUET_DATASET, save_parquet_dataset, write_parquet_chunk
+from etl_metrics import METRICS_FILE, PipelineMetrics
+from rollup_cube import ROLLUP_CUBE_FILE, RollupCube
+
+# Районы Москвы с разной ценовой категорией
+DISTRICTS = {
+    'ЦАО': {'price_multiplier': 1.8, 'count': 400},
+    'ЗАО': {'price_multiplier': 1.4, 'count': 350},
+    'СЗАО': {'price_multiplier': 1.2, 'count': 280},
+    'САО': {'price_multiplier': 1.1, 'count': 320},
+    'СВАО': {'price_multiplier': 1.0, 'count': 300},
+    'ВАО': {'price_multiplier': 0.9, 'count': 290},
+    'ЮВАО': {'price_multiplier': 0.85, 'count': 310},
+    'ЮАО': {'price_multiplier': 0.9, 'count': 280},
+    'ЮЗАО': {'price_multiplier': 1.1, 'count': 320},
+    'НАО': {'price_multiplier': 0.7, 'count': 250}
+}
+
+# Категории недвижимости с их параметрами
+PROPERTY_CATEGORIES = {
+    'жилая': {
+        'квартира': {'base_price_sqm': 150000, 'count': 1200, 'area_range': (30, 120)},
+        'апартаменты': {'base_price_sqm': 180000, 'count': 300, 'area_range': (25, 80)},
+        'комната': {'base_price_sqm': 120000, 'count': 200, 'area_range': (10, 25)},
+        'дом': {'base_price_sqm': 200000, 'count': 150, 'area_range': (80, 300)},
+        'таунхаус': {'base_price_sqm': 170000, 'count': 100, 'area_range': (60, 150)}
+    },
+    'коммерческая': {
+        'офис': {'base_price_sqm': 80000, 'count': 200, 'area_range': (50, 500)},
+        'торговое помещение': {'base_price_sqm': 120000, 'count': 150, 'area_range': (30, 300)},
+        'склад': {'base_price_sqm': 40000, 'count': 100, 'area_range': (100, 2000)},
+        'производственное помещение': {'base_price_sqm': 50000, 'count': 80, 'area_range': (200, 1500)},
+        'готовый бизнес': {'base_price_sqm': 0, 'count': 70, 'area_range': (0, 0)}  # цена за бизнес
+    },
+    'земля': {
+        'участок': {'base_price_sqm': 5000, 'count': 100, 'area_range': (100, 1500)}
+    },
+    'прочая': {
+        'гараж': {'base_price_sqm': 0, 'count': 80, 'area_range': (15, 30)},
+        'машиноместо': {'base_price_sqm': 0, 'count': 70, 'area_range': (0, 0)}
+    }
+}
 
 def create_comprehensive_real_estate_dataset():
     """Создание комплексного датасета всех видов недвижимости Москвы"""
     
     np.random.seed(42)
+    random.seed(42)
     n_samples = 3000  # Увеличили объем данных
     
-    # Районы Москвы с разной ценовой категорией
-    districts = {
-        'ЦАО': {'price_multiplier': 1.8, 'count': 400},
-        'ЗАО': {'price_multiplier': 1.4, 'count': 350},
-        'СЗАО': {'price_multiplier': 1.2, 'count': 280},
-        'САО': {'price_multiplier': 1.1, 'count': 320},
-        'СВАО': {'price_multiplier': 1.0, 'count': 300},
-        'ВАО': {'price_multiplier': 0.9, 'count': 290},
-        'ЮВАО': {'price_multiplier': 0.85, 'count': 310},
-        'ЮАО': {'price_multiplier': 0.9, 'count': 280},
-        'ЮЗАО': {'price_multiplier': 1.1, 'count': 320},
-        'НАО': {'price_multiplier': 0.7, 'count': 250}
-    }
-    
-    # Категории недвижимости с их параметрами
-    property_categories = {
-        'жилая': {
-            'квартира': {'base_price_sqm': 150000, 'count': 1200, 'area_range': (30, 120)},
-            'апартаменты': {'base_price_sqm': 180000, 'count': 300, 'area_range': (25, 80)},
-            'комната': {'base_price_sqm': 120000, 'count': 200, 'area_range': (10, 25)},
-            'дом': {'base_price_sqm': 200000, 'count': 150, 'area_range': (80, 300)},
-            'таунхаус': {'base_price_sqm': 170000, 'count': 100, 'area_range': (60, 150)}
-        },
-        'коммерческая': {
-            'офис': {'base_price_sqm': 80000, 'count': 200, 'area_range': (50, 500)},
-            'торговое помещение': {'base_price_sqm': 120000, 'count': 150, 'area_range': (30, 300)},
-            'склад': {'base_price_sqm': 40000, 'count': 100, 'area_range': (100, 2000)},
-            'производственное помещение': {'base_price_sqm': 50000, 'count': 80, 'area_range': (200, 1500)},
-            'готовый бизнес': {'base_price_sqm': 0, 'count': 70, 'area_range': (0, 0)}  # цена за бизнес
-        },
-        'земля': {
-            'участок': {'base_price_sqm': 5000, 'count': 100, 'area_range': (100, 1500)}
-        },
-        'прочая': {
-            'гараж': {'base_price_sqm': 0, 'count': 80, 'area_range': (15, 30)},
-            'машиноместо': {'base_price_sqm': 0, 'count': 70, 'area_range': (0, 0)}
-        }
-    }
+    districts = DISTRICTS
+    property_categories = PROPERTY_CATEGORIES
     
     data = []
     id_counter = 1
@@ -263,36 +277,481 @@ def generate_other_url(prop_type):
     else:
         return f"https://www.avito.ru/moskva/garazhi_i_mashinomesta/mashinomesto.{random.randint(1000000, 9999999)}"
 
-def analyze_comprehensive_dataset(df):
-    """Расширенный анализ комплексного датасета"""
+# ============================================
+# КОЛОНОЧНЫЙ ГЕНЕРАТОР (векторизованная генерация больших датасетов)
+# ============================================
+
+# Порядок колонок совпадает с датасетом, который строит построчный генератор
+DATASET_COLUMNS = [
+    'district', 'publish_date', 'rooms', 'area', 'price', 'price_per_sqm', 'floor', 'total_floors',
+    'year_built', 'house_type', 'metro_time', 'address', 'url', 'ceiling_height', 'has_elevator',
+    'is_renovated', 'id', 'property_category', 'property_type', 'has_ventilation',
+    'has_air_conditioning', 'parking_spaces', 'commercial_purpose', 'land_area', 'has_utilities',
+    'purpose', 'has_security', 'has_electricity'
+]
+
+# Способ хранения колонок: строки с малым числом значений - category, флаги - nullable boolean
+COLUMN_KINDS = {
+    'district': 'category', 'publish_date': 'category', 'rooms': 'float', 'area': 'float',
+    'price': 'int', 'price_per_sqm': 'int', 'floor': 'float', 'total_floors': 'float',
+    'year_built': 'float', 'house_type': 'category', 'metro_time': 'int', 'address': 'object',
+    'url': 'object', 'ceiling_height': 'float', 'has_elevator': 'bool', 'is_renovated': 'bool',
+    'id': 'object', 'property_category': 'category', 'property_type': 'category',
+    'has_ventilation': 'bool', 'has_air_conditioning': 'bool', 'parking_spaces': 'float',
+    'commercial_purpose': 'category', 'land_area': 'float', 'has_utilities': 'bool',
+    'purpose': 'category', 'has_security': 'bool', 'has_electricity': 'bool'
+}
+
+# Категориальные колонки, для которых имеет смысл порядок (min/max по дате)
+ORDERED_CATEGORY_COLUMNS = {'publish_date'}
+
+COMMERCIAL_TYPES_EN = {
+    'офис': 'ofis',
+    'торговое помещение': 'torgovoe_pomeschenie',
+    'склад': 'sklad',
+    'производственное помещение': 'proizvodstvennoe_pomeschenie',
+    'готовый бизнес': 'gotovyy_biznes'
+}
+
+# Базовый объем, к которому привязаны количества в DISTRICTS/PROPERTY_CATEGORIES
+BASE_SAMPLES = 3000
+
+def build_generation_plan(scale=1.0):
+    """Распределение объявлений по районам и типам: список (район, категория, тип, количество).
+    
+    scale масштабирует объем датасета: 1.0 - исходные ~2 850 объявлений,
+    3500 - около 10 млн, 17500 - около 50 млн при тех же пропорциях.
+    """
+    plan = []
+    for district, district_params in DISTRICTS.items():
+        district_limit = int(district_params['count'] * scale)
+        district_count = 0
+        for category, types in PROPERTY_CATEGORIES.items():
+            for prop_type, type_params in types.items():
+                # Та же пропорция, что и в create_comprehensive_real_estate_dataset
+                type_count = max(1, int(type_params['count'] * district_limit / BASE_SAMPLES))
+                type_count = max(0, min(type_count, district_limit - district_count))
+                plan.append((district, category, prop_type, type_count))
+                district_count += type_count
+    return plan
+
+def split_plan_into_chunks(plan, chunk_size):
+    """Нарезка плана генерации на куски не более chunk_size объявлений"""
+    chunk, chunk_rows = [], 0
+    for district, category, prop_type, count in plan:
+        while count > 0:
+            take = min(count, chunk_size - chunk_rows)
+            chunk.append((district, category, prop_type, take))
+            chunk_rows += take
+            count -= take
+            if chunk_rows == chunk_size:
+                yield chunk
+                chunk, chunk_rows = [], 0
+    if chunk:
+        yield chunk
+
+def _concat_str(*parts):
+    """Поэлементная склейка строковых массивов и констант"""
+    result = parts[0]
+    for part in parts[1:]:
+        result = np.char.add(result, part)
+    return result
+
+def _int_str(values):
+    """Целая часть числа в виде строки (как int(x) в f-строке)"""
+    return np.trunc(values).astype(np.int64).astype(str)
+
+def _to_int(values):
+    """Отбрасывание дробной части, как int() для скаляров"""
+    return np.trunc(values).astype(np.int64)
+
+def _price_per_sqm(price, area):
+    safe_area = np.where(area > 0, area, 1.0)
+    return np.where(area > 0, _to_int(price / safe_area), 0)
+
+def _random_flag(rng, n):
+    return rng.random(n) < 0.5
+
+def _random_url_ids(rng, n):
+    return rng.integers(1000000, 10000000, n).astype(str)
+
+def _draw_area(rng, type_params, n):
+    area_min, area_max = type_params['area_range']
+    return np.maximum(area_min, rng.normal((area_min + area_max) / 2, (area_max - area_min) / 6, n))
+
+def generate_residential_columns(rng, prop_type, type_params, multipliers, district_names):
+    """Колонки жилой недвижимости для n объявлений одного типа"""
+    n = len(multipliers)
+    area = _draw_area(rng, type_params, n)
+    
+    if prop_type == 'комната':
+        rooms = np.zeros(n, dtype=np.int64)
+    elif prop_type == 'дом' or prop_type == 'таунхаус':
+        rooms = rng.integers(3, 7, n)
+    else:  # квартира, апартаменты
+        rooms = rng.integers(1, 5, n)
+    base_price = area * type_params['base_price_sqm']
+    
+    price = _to_int(base_price * multipliers * (1 + (rooms - 1) * 0.15) * rng.uniform(0.8, 1.2, n))
+    
+    if prop_type in ['квартира', 'апартаменты', 'комната']:
+        floor = rng.integers(1, 26, n)
+        total_floors = np.maximum(floor, rng.integers(5, 26, n))
+    else:
+        floor = np.ones(n, dtype=np.int64)
+        total_floors = rng.integers(1, 4, n)
+    
+    url_ids = _random_url_ids(rng, n)
+    area_text = _int_str(area)
+    if prop_type == 'комната':
+        url = _concat_str("https://www.avito.ru/moskva/komnaty/komnata_", area_text, "_m_",
+                          floor.astype(str), "_", total_floors.astype(str), "_et.", url_ids)
+    elif prop_type == 'дом':
+        url = _concat_str("https://www.avito.ru/moskva/doma_dachi_kottedzhi/dom_", area_text, "_m.", url_ids)
+    elif prop_type == 'таунхаус':
+        url = _concat_str("https://www.avito.ru/moskva/doma_dachi_kottedzhi/taunhaus_", area_text, "_m.", url_ids)
+    else:
+        room_text = 'kvartira' if prop_type == 'квартира' else 'apartamenty'
+        url = _concat_str(f"https://www.avito.ru/moskva/{room_text}/", rooms.astype(str), "_k._", area_text,
+                          "_m_", floor.astype(str), "_", total_floors.astype(str), "_et.", url_ids)
+    
+    columns = {
+        'rooms': rooms,
+        'area': np.round(area, 1),
+        'price': price,
+        'price_per_sqm': _price_per_sqm(price, area),
+        'floor': floor,
+        'total_floors': total_floors,
+        'year_built': rng.integers(1960, 2024, n),
+        'house_type': np.array(['панельный', 'кирпичный', 'монолитный', 'блочный'])[rng.integers(0, 4, n)],
+        'metro_time': rng.integers(5, 31, n),
+        'address': _concat_str("г. Москва, ", district_names, ", ул. Примерная, д. ",
+                               rng.integers(1, 101, n).astype(str)),
+        'url': url,
+        'has_elevator': np.where(total_floors > 5, _random_flag(rng, n), True),
+        'is_renovated': _random_flag(rng, n)
+    }
+    if prop_type != 'комната':
+        columns['ceiling_height'] = np.round(rng.normal(2.7, 0.2, n), 1)
+    return columns
+
+def generate_commercial_columns(rng, prop_type, type_params, multipliers, district_names):
+    """Колонки коммерческой недвижимости для n объявлений одного типа"""
+    n = len(multipliers)
+    area = _draw_area(rng, type_params, n)
+    
+    if prop_type == 'готовый бизнес':
+        # Для готового бизнеса цена не привязана к площади
+        base_price = rng.normal(5000000, 2000000, n)
+        price_per_sqm = np.zeros(n, dtype=np.int64)
+    else:
+        base_price = area * type_params['base_price_sqm']
+        price_per_sqm = _price_per_sqm(base_price, area)
+    
+    price = _to_int(base_price * multipliers * rng.uniform(0.7, 1.3, n))
+    
+    is_warehouse = prop_type == 'склад'
+    has_customers = prop_type in ['офис', 'торговое помещение']
+    if prop_type in ['склад', 'производственное помещение']:
+        ceiling_height = np.round(rng.normal(3.5, 0.5, n), 1)
+    else:
+        ceiling_height = np.round(rng.normal(2.8, 0.2, n), 1)
+    
+    return {
+        'area': np.round(area, 1),
+        'price': price,
+        'price_per_sqm': price_per_sqm,
+        'floor': np.ones(n, dtype=np.int64) if is_warehouse else rng.integers(1, 11, n),
+        'total_floors': np.ones(n, dtype=np.int64) if is_warehouse else rng.integers(1, 11, n),
+        'year_built': rng.integers(1970, 2024, n),
+        'house_type': 'коммерческий',
+        'metro_time': rng.integers(3, 26, n),
+        'address': _concat_str("г. Москва, ", district_names, ", ул. Коммерческая, д. ",
+                               rng.integers(1, 51, n).astype(str)),
+        'url': _concat_str(f"https://www.avito.ru/moskva/kommercheskaya_nedvizhimost/{COMMERCIAL_TYPES_EN[prop_type]}_",
+                           _int_str(area), "_m.", _random_url_ids(rng, n)),
+        'ceiling_height': ceiling_height,
+        'has_ventilation': _random_flag(rng, n),
+        'has_air_conditioning': _random_flag(rng, n) if has_customers else False,
+        'parking_spaces': rng.integers(0, 21, n) if has_customers else np.zeros(n, dtype=np.int64),
+        'commercial_purpose': prop_type
+    }
+
+def generate_land_columns(rng, prop_type, type_params, multipliers, district_names):
+    """Колонки земельных участков для n объявлений"""
+    n = len(multipliers)
+    area = _draw_area(rng, type_params, n)
+    
+    base_price = area * type_params['base_price_sqm']
+    price = _to_int(base_price * multipliers * rng.uniform(0.8, 1.4, n))
+    
+    return {
+        'area': np.round(area, 1),
+        'price': price,
+        'price_per_sqm': _price_per_sqm(price, area),
+        'metro_time': rng.integers(10, 46, n),
+        'address': _concat_str("г. Москва, ", district_names, ", земельный участок №",
+                               rng.integers(1, 1001, n).astype(str)),
+        'url': _concat_str("https://www.avito.ru/moskva/zemelnye_uchastki/uchastok_", _int_str(area),
+                           "_sot.", _random_url_ids(rng, n)),
+        'land_area': np.round(area, 1),
+        'has_utilities': _random_flag(rng, n),
+        'purpose': np.array(['ИЖС', 'коммерческое', 'сельскохозяйственное'])[rng.integers(0, 3, n)]
+    }
+
+def generate_other_columns(rng, prop_type, type_params, multipliers, district_names):
+    """Колонки прочей недвижимости для n объявлений одного типа"""
+    n = len(multipliers)
+    
+    if prop_type == 'гараж':
+        area = rng.uniform(15, 30, n)
+        base_price = 1000000  # фиксированная базовая цена
+        place, url_slug = 'гаражный кооператив', 'garazh'
+    else:  # машиноместо
+        area = np.zeros(n)
+        base_price = 500000  # фиксированная базовая цена
+        place, url_slug = 'паркинг', 'mashinomesto'
+    
+    price = _to_int(base_price * multipliers * rng.uniform(0.9, 1.1, n))
+    
+    return {
+        'area': np.where(area > 0, np.round(area, 1), np.nan),
+        'price': price,
+        'price_per_sqm': _price_per_sqm(price, area),
+        'floor': rng.integers(-3, 4, n),
+        'total_floors': rng.integers(1, 6, n),
+        'year_built': rng.integers(1980, 2024, n),
+        'house_type': 'гаражный комплекс' if prop_type == 'гараж' else 'паркинг',
+        'metro_time': rng.integers(5, 21, n),
+        'address': _concat_str("г. Москва, ", district_names, f", {place} №", rng.integers(1, 51, n).astype(str)),
+        'url': _concat_str(f"https://www.avito.ru/moskva/garazhi_i_mashinomesta/{url_slug}.", _random_url_ids(rng, n)),
+        'has_security': _random_flag(rng, n),
+        'has_electricity': True
+    }
+
+COLUMNAR_GENERATORS = {
+    'жилая': generate_residential_columns,
+    'коммерческая': generate_commercial_columns,
+    'земля': generate_land_columns,
+    'прочая': generate_other_columns
+}
+
+def _allocate_columns(total):
+    """Пустые колонки датасета: NaN/None/NA там, где значение не задано"""
+    columns = {}
+    for name in DATASET_COLUMNS:
+        kind = COLUMN_KINDS[name]
+        if kind == 'float':
+            columns[name] = np.full(total, np.nan)
+        elif kind == 'int':
+            columns[name] = np.zeros(total, dtype=np.int64)
+        elif kind == 'bool':
+            columns[name] = (np.zeros(total, dtype=bool), np.ones(total, dtype=bool))
+        elif kind == 'category':
+            columns[name] = (np.full(total, -1, dtype=np.int32), [])
+        else:
+            columns[name] = np.full(total, None, dtype=object)
+    return columns
+
+def _scatter_column(columns, name, positions, values):
+    """Запись значений (массив или константа) в позиции positions колонки name"""
+    kind = COLUMN_KINDS[name]
+    if kind == 'bool':
+        flags, mask = columns[name]
+        flags[positions] = values
+        mask[positions] = False
+    elif kind == 'category':
+        codes, categories = columns[name]
+        if np.ndim(values) == 0:
+            uniques, inverse = np.array([values]), np.zeros(len(positions), dtype=np.int64)
+        else:
+            uniques, inverse = np.unique(values, return_inverse=True)
+        lookup = []
+        for value in uniques.tolist():
+            if value not in categories:
+                categories.append(value)
+            lookup.append(categories.index(value))
+        codes[positions] = np.asarray(lookup, dtype=np.int32)[inverse]
+    else:
+        columns[name][positions] = values
+
+def _finalize_columns(columns):
+    """Сборка DataFrame из заполненных колонок"""
+    data = {}
+    for name in DATASET_COLUMNS:
+        kind = COLUMN_KINDS[name]
+        if kind == 'bool':
+            flags, mask = columns[name]
+            data[name] = pd.arrays.BooleanArray(flags, mask)
+        elif kind == 'category':
+            codes, categories = columns[name]
+            data[name] = pd.Categorical.from_codes(codes, categories=categories)
+            if name in ORDERED_CATEGORY_COLUMNS:
+                data[name] = data[name].reorder_categories(sorted(categories), ordered=True)
+        else:
+            data[name] = columns[name]
+    return pd.DataFrame(data, columns=DATASET_COLUMNS)
+
+def build_columnar_frame(rng, segments, first_id=1, base_date=None):
+    """Генерация объявлений для списка сегментов (район, категория, тип, количество).
+    
+    Строки идут в порядке сегментов, атрибуты каждого типа разыгрываются
+    одним вызовом на все районы сразу.
+    """
+    base_date = base_date or datetime.now()
+    total = sum(count for *_, count in segments)
+    columns = _allocate_columns(total)
+    
+    offsets = np.cumsum([0] + [count for *_, count in segments])
+    district_names = np.array([district for district, *_ in segments])
+    multipliers = np.array([DISTRICTS[district]['price_multiplier'] for district, *_ in segments])
+    counts = np.array([count for *_, count in segments])
+    
+    # Общие колонки: район, категория, тип, дата публикации, id
+    positions = np.arange(total)
+    segment_of_row = np.repeat(np.arange(len(segments)), counts)
+    _scatter_column(columns, 'district', positions, district_names[segment_of_row])
+    _scatter_column(columns, 'property_category', positions,
+                    np.array([category for _, category, _, _ in segments])[segment_of_row])
+    _scatter_column(columns, 'property_type', positions,
+                    np.array([prop_type for _, _, prop_type, _ in segments])[segment_of_row])
+    days = rng.integers(1, 31, total)
+    dates = np.array([(base_date - timedelta(days=day)).strftime('%Y-%m-%d') for day in range(31)])
+    _scatter_column(columns, 'publish_date', positions, dates[days])
+    columns['id'][:] = _concat_str("avito_", np.char.zfill(np.arange(first_id, first_id + total).astype(str), 6))
+    
+    # Атрибуты: один векторный вызов на тип недвижимости
+    for category, types in PROPERTY_CATEGORIES.items():
+        for prop_type, type_params in types.items():
+            indexes = [i for i, (_, seg_category, seg_type, count) in enumerate(segments)
+                       if seg_category == category and seg_type == prop_type and count > 0]
+            if not indexes:
+                continue
+            type_positions = np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in indexes])
+            type_districts = np.repeat(district_names[indexes], counts[indexes])
+            type_multipliers = np.repeat(multipliers[indexes], counts[indexes])
+            
+            generated = COLUMNAR_GENERATORS[category](rng, prop_type, type_params, type_multipliers, type_districts)
+            for name, values in generated.items():
+                _scatter_column(columns, name, type_positions, values)
+    
+    return _finalize_columns(columns)
+
+def create_comprehensive_real_estate_dataset_columnar(seed=42, scale=1.0, base_date=None):
+    """Колоночная генерация комплексного датасета (та же схема и пропорции, что и построчно)"""
+    rng = np.random.default_rng(seed)
+    return build_columnar_frame(rng, build_generation_plan(scale), base_date=base_date)
+
+def generate_dataset_chunks(chunk_size=100000, scale=1.0, seed=42, base_date=None):
+    """Потоковая генерация: DataFrame по chunk_size объявлений, сквозная нумерация id"""
+    rng = np.random.default_rng(seed)
+    base_date = base_date or datetime.now()
+    next_id = 1
+    for segments in split_plan_into_chunks(build_generation_plan(scale), chunk_size):
+        chunk = build_columnar_frame(rng, segments, first_id=next_id, base_date=base_date)
+        next_id += len(chunk)
+        yield chunk
+
+# ============================================
+# ПАРАЛЛЕЛЬНАЯ ГЕНЕРАЦИЯ (шарды район x тип, детерминированные seed)
+# ============================================
+
+def build_generation_shards(scale=1.0, shard_size=1000000):
+    """Шарды генерации: (ключ seed, сегмент, первый id).
+    
+    Каждая ячейка плана район x тип - отдельный шард (крупные ячейки делятся
+    на части по shard_size). Ключ seed и диапазон id зависят только от
+    положения шарда в плане, но не от числа процессов.
+    """
+    shards = []
+    next_id = 1
+    for cell_index, (district, category, prop_type, count) in enumerate(build_generation_plan(scale)):
+        for part, start in enumerate(range(0, count, shard_size)):
+            part_count = min(shard_size, count - start)
+            shards.append(((cell_index, part), (district, category, prop_type, part_count), next_id))
+            next_id += part_count
+    return shards
+
+def generate_shard(seed, spawn_key, segment, first_id, base_date):
+    """Генерация одного шарда в собственном потоке случайных чисел"""
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=spawn_key))
+    return build_columnar_frame(rng, [segment], first_id=first_id, base_date=base_date)
+
+def generate_dataset_parallel(scale=1.0, seed=42, workers=None, shard_size=1000000, base_date=None):
+    """Параллельная генерация в пуле процессов: шарды отдаются строго в порядке плана.
+    
+    Одновременно в работе не более 2 * workers шардов, поэтому память
+    ограничена размером шарда, а не объемом датасета.
+    """
+    base_date = base_date or datetime.now()
+    shards = build_generation_shards(scale, shard_size)
+    workers = workers or os.cpu_count() or 1
+    
+    if workers == 1:
+        for spawn_key, segment, first_id in shards:
+            yield generate_shard(seed, spawn_key, segment, first_id, base_date)
+        return
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for spawn_key, segment, first_id in shards:
+            pending.append(executor.submit(generate_shard, seed, spawn_key, segment, first_id, base_date))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def concat_dataset_frames(frames):
+    """Склейка кусков датасета с приведением категориальных колонок к общему словарю"""
+    frames = list(frames)
+    for name in DATASET_COLUMNS:
+        if COLUMN_KINDS[name] != 'category':
+            continue
+        categories = []
+        for frame in frames:
+            categories.extend(c for c in frame[name].cat.categories if c not in categories)
+        if name in ORDERED_CATEGORY_COLUMNS:
+            categories.sort()
+        for frame in frames:
+            frame[name] = frame[name].cat.set_categories(categories, ordered=name in ORDERED_CATEGORY_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+def create_comprehensive_real_estate_dataset_parallel(seed=42, scale=1.0, workers=None, base_date=None):
+    """Параллельная генерация датасета; результат не зависит от числа процессов"""
+    return concat_dataset_frames(generate_dataset_parallel(scale, seed, workers, base_date=base_date))
+
+def analyze_comprehensive_dataset(df, cube=None):
+    """Расширенный анализ комплексного датасета (агрегаты считает DatasetCube)"""
+    cube = cube if cube is not None else DatasetCube(df)
     
     print("КОМПЛЕКСНАЯ СТАТИСТИКА ДАТАСЕТА:")
     print(f"Всего объявлений: {len(df):,}")
     print(f"Период: с {df['publish_date'].min()} по {df['publish_date'].max()}")
     
     print(f"\nРАСПРЕДЕЛЕНИЕ ПО КАТЕГОРИЯМ НЕДВИЖИМОСТИ:")
-    category_stats = df['property_category'].value_counts()
-    for category, count in category_stats.items():
-        print(f"  • {category}: {count} объявлений ({count/len(df)*100:.1f}%)")
+    category_stats = cube.share('property_category')
+    for category, row in category_stats.iterrows():
+        print(f"  • {category}: {row['rows']:.0f} объявлений ({row['percent']:.1f}%)")
     
     print(f"\n💰 СТАТИСТИКА ПО ЦЕНАМ ПО КАТЕГОРИЯМ:")
+    avg_prices = cube.query(('property_category',), (('price', 'mean'),))['price_mean']
+    avg_prices_sqm = cube.query(('property_category',), (('price_per_sqm', 'mean'),),
+                                positive=('price_per_sqm',))['price_per_sqm_mean']
     for category in df['property_category'].unique():
-        category_data = df[df['property_category'] == category]
-        avg_price = category_data['price'].mean()
-        avg_price_sqm = category_data[category_data['price_per_sqm'] > 0]['price_per_sqm'].mean()
+        avg_price = avg_prices[category]
+        avg_price_sqm = avg_prices_sqm.get(category, np.nan)
         print(f"  • {category}: {avg_price:,.0f} руб. | {avg_price_sqm:,.0f} руб./м²")
     
     print(f"\n🏠 ДЕТАЛИЗАЦИЯ ПО ТИПАМ НЕДВИЖИМОСТИ:")
-    type_stats = df.groupby(['property_category', 'property_type']).agg({
-        'price': ['count', 'mean'],
-        'area': 'mean'
-    }).round(0)
+    type_stats = cube.query(('property_category', 'property_type'),
+                            (('price', 'count'), ('price', 'mean'), ('area', 'mean'))).round(0)
     
     for (category, prop_type), row in type_stats.iterrows():
-        print(f"  • {category}/{prop_type}: {row[('price', 'count')]} объявлений, "
-            f"ср. цена {row[('price', 'mean')]:,.0f} руб., ср. площадь {row[('area', 'mean')]:.0f} м²")
+        print(f"  • {category}/{prop_type}: {row['price_count']:.0f} объявлений, "
+            f"ср. цена {row['price_mean']:,.0f} руб., ср. площадь {row['area_mean']:.0f} м²")
+    return cube
 
-def save_comprehensive_data(df):
+def save_comprehensive_data(df, parquet=False):
     """Сохранение комплексных данных для курсовой работы"""
     
     # Основной файл
@@ -307,33 +766,133 @@ def save_comprehensive_data(df):
     analytical_columns = ['property_category', 'property_type', 'district', 'price', 'area', 'price_per_sqm']
     df[analytical_columns].to_csv('comprehensive_analysis_data.csv', index=False)
     
-    # Статистика по районам и категориям
-    stats_df = df.groupby(['district', 'property_category']).agg({
-        'price': ['count', 'mean', 'median'],
-        'price_per_sqm': 'mean',
-        'area': 'mean'
-    }).round(0)
+    # Куб статистики со всеми промежуточными итогами
+    cube = RollupCube().update(df)
+    cube.save(ROLLUP_CUBE_FILE)
+    
+    # Колоночная копия с партициями по категориям и районам
+    if parquet:
+        save_parquet_dataset(df)
+    
+    print("Файлы сохранены:")
+    print("  - comprehensive_real_estate_dataset.csv (полные данные)")
+    print("  - real_estate_жилая.csv, real_estate_коммерческая.csv, ... (по категориям)")
+    print("  - comprehensive_analysis_data.csv (данные для анализа)")
+    print(f"  - {ROLLUP_CUBE_FILE} (куб статистики: район x категория x тип x комнаты x месяц)")
+    if parquet:
+        print(f"  - {PARQUET_DATASET}/ (parquet, партиции property_category/district)")
+    return cube
+
+def district_category_report(cube):
+    """Сводка по районам и категориям из куба (медиана цены - по скетчу)"""
+    report = cube.breakdown(('district', 'property_category'))
+    return report[['count', 'price_mean', 'price_median', 'price_per_sqm_mean', 'area_mean']].round(0)
+
+def save_comprehensive_data_streaming(chunks, parquet=False):
+    """Потоковое сохранение: каждый кусок сразу дописывается во все выходные файлы"""
+    
+    analytical_columns = ['property_category', 'property_type', 'district', 'price', 'area', 'price_per_sqm']
+    cube = RollupCube()
+    written_categories = set()
+    total = 0
+    
+    for chunk_index, chunk in enumerate(chunks):
+        first = total == 0
+        mode = 'w' if first else 'a'
+        
+        # Основной файл и аналитические данные
+        chunk.to_csv('comprehensive_real_estate_dataset.csv', mode=mode, header=first, index=False, encoding='utf-8')
+        chunk[analytical_columns].to_csv('comprehensive_analysis_data.csv', mode=mode, header=first, index=False)
+        
+        # Файлы по категориям
+        for category in chunk['property_category'].unique():
+            category_first = category not in written_categories
+            chunk[chunk['property_category'] == category].to_csv(
+                f'real_estate_{category}.csv', mode='w' if category_first else 'a',
+                header=category_first, index=False, encoding='utf-8'
+            )
+            written_categories.add(category)
+        
+        # Колоночная копия: каждый кусок - отдельные файлы в партициях
+        if parquet:
+            if first and os.path.isdir(PARQUET_DATASET):
+                shutil.rmtree(PARQUET_DATASET)
+            write_parquet_chunk(chunk, chunk_index=chunk_index)
+        
+        cube.update(chunk)
+        total += len(chunk)
+        print(f"Записано {total:,} объявлений")
     
-    stats_df.to_csv('district_category_statistics.csv')
+    # Куб статистики со всеми промежуточными итогами
+    cube.save(ROLLUP_CUBE_FILE)
     
     print("Файлы сохранены:")
     print("  - comprehensive_real_estate_dataset.csv (полные данные)")
     print("  - real_estate_жилая.csv, real_estate_коммерческая.csv, ... (по категориям)")
     print("  - comprehensive_analysis_data.csv (данные для анализа)")
-    print("  - district_category_statistics.csv (статистика по районам и категориям)")
+    print(f"  - {ROLLUP_CUBE_FILE} (куб статистики: район x категория x тип x комнаты x месяц)")
+    if parquet:
+        print(f"  - {PARQUET_DATASET}/ (parquet, партиции property_category/district)")
+    return cube
+
+# Стадии генерации (имена для метрик и --profile-stage); в потоковом режиме
+# генерация и запись идут кусками вперемешку и меряются одной стадией
+GENERATION_STAGES = ('generate', 'analyze', 'save', 'generate_and_save')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Генерация комплексного датасета недвижимости Москвы")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="масштаб объема датасета (1.0 - около 2 850 объявлений)")
+    parser.add_argument('--seed', type=int, default=42, help="seed генератора случайных чисел")
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help="потоковая генерация кусками указанного размера (память не растет с объемом)")
+    parser.add_argument('--parquet', action='store_true',
+                        help="дополнительно сохранить датасет в parquet с партициями по категориям и районам")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="параллельная генерация в указанном числе процессов (шарды район x тип)")
+    parser.add_argument('--metrics-file', default=METRICS_FILE,
+                        help="файл метрик стадий (JSON-строки; пустая строка - не записывать)")
+    parser.add_argument('--profile-stage', choices=GENERATION_STAGES, default=None,
+                        help="профилировать стадию cProfile (профиль сохраняется в .prof)")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+    metrics = PipelineMetrics('generate', metrics_file=args.metrics_file or None, profile_stage=args.profile_stage)
+    
     print("СОЗДАНИЕ КОМПЛЕКСНОГО ДАТАСЕТА НЕДВИЖИМОСТИ")
     print("=" * 60)
     
-    # Создаем комплексный датасет
-    df = create_comprehensive_real_estate_dataset()
+    if args.chunk_size:
+        # Потоковый режим: датасет целиком в памяти не хранится
+        with metrics.stage('generate_and_save') as stage:
+            if args.workers:
+                chunks = generate_dataset_parallel(scale=args.scale, seed=args.seed, workers=args.workers,
+                                                   shard_size=args.chunk_size)
+            else:
+                chunks = generate_dataset_chunks(chunk_size=args.chunk_size, scale=args.scale, seed=args.seed)
+            cube = save_comprehensive_data_streaming(chunks, parquet=args.parquet)
+            stage.rows_out = int(cube.cell()['count'])
+        print("\nСТАТИСТИКА ПО РАЙОНАМ И КАТЕГОРИЯМ:")
+        print(district_category_report(cube).to_string())
+        metrics.summary()
+        return
+    
+    # Создаем комплексный датасет (колоночный генератор, воспроизводим по seed)
+    with metrics.stage('generate') as stage:
+        if args.workers:
+            df = create_comprehensive_real_estate_dataset_parallel(seed=args.seed, scale=args.scale, workers=args.workers)
+        else:
+            df = create_comprehensive_real_estate_dataset_columnar(seed=args.seed, scale=args.scale)
+        stage.rows_out = len(df)
     
     # Анализируем
-    analyze_comprehensive_dataset(df)
+    with metrics.stage('analyze', rows_in=len(df)):
+        analyze_comprehensive_dataset(df)
     
     # Сохраняем
-    save_comprehensive_data(df)
+    with metrics.stage('save', rows_in=len(df)):
+        save_comprehensive_data(df, parquet=args.parquet)
     
     # Покажем примеры данных из разных категорий
     print("\n ПРИМЕРЫ ДАННЫХ ИЗ РАЗНЫХ КАТЕГОРИЙ:")
@@ -341,6 +900,7 @@ def main():
         category_sample = df[df['property_category'] == category].head(2)
         print(f"\n{category.upper()}:")
         print(category_sample[['property_type', 'district', 'price', 'area', 'price_per_sqm']].to_string(index=False))
+    metrics.summary()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,246 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Результаты последнего запуска и сохраненный эталон для сравнения
+RESULTS_FILE = 'benchmark_results.json'
+BASELINE_FILE = 'benchmark_baseline.json'
+
+# Объемы по умолчанию (строк); до 10 млн задаются через --rows
+DEFAULT_ROWS = [10000, 100000, 1000000]
+
+# Замедление стадии относительно эталона, после которого она считается регрессией
+REGRESSION_THRESHOLD = 0.2
+# Короткие стадии шумят: медленнее эталона меньше чем на столько секунд - не регрессия
+REGRESSION_MIN_SECONDS = 0.05
+
+# Построчная вставка execute_batch слишком медленная для больших объемов
+BATCH_INSERT_MAX_ROWS = 20000
+
+def _peak_rss_mb():
+    # ru_maxrss в Linux - килобайты, в macOS - байты
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+class StageTimer:
+    """Замер стадий: время, строк в секунду и пиковая память процесса после стадии"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        # Фактическое число строк на входе стадии (генератор дает объем приблизительно)
+        self.count = rows
+        self.results = []
+
+    def run(self, stage, function, *args, rows=None, **kwargs):
+        rows = self.count if rows is None else rows
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - started
+        self.results.append({
+            'rows': self.rows,
+            'stage': stage,
+            'stage_rows': rows,
+            'seconds': round(seconds, 4),
+            'rows_per_sec': round(rows / seconds) if seconds else None,
+            'peak_rss_mb': round(_peak_rss_mb(), 1)
+        })
+        print(f"  {stage:<22} {seconds:8.3f} с  {rows / seconds if seconds else 0:>14,.0f} строк/с  "
+              f"пик {_peak_rss_mb():,.0f} МБ", flush=True)
+        return result
+
+    def skip(self, stage, reason):
+        self.results.append({'rows': self.rows, 'stage': stage, 'skipped': reason})
+        print(f"  {stage:<22} пропущено: {reason}", flush=True)
+
+def _dimension_maps(df):
+    """Ключи справочников для преобразования без БД (как их выдал бы DimensionManager)"""
+    return {
+        'districts': {name: i for i, name in enumerate(sorted(df['district'].dropna().unique()), 1)},
+        'property_types': {name: i for i, name in enumerate(sorted(df['property_type'].dropna().unique()), 1)},
+        'house_types': {name: i for i, name in enumerate(sorted(df['house_type'].dropna().unique()), 1)},
+        'dates': {day: i for i, day in enumerate(sorted(pd.to_datetime(df['publish_date']).dt.date.unique()), 1)}
+    }
+
+def _benchmark_database(timer, facts, schema):
+    """Вставка в отдельную схему (копия структуры fact_real_estate без внешних ключей), схема удаляется"""
+    import db_loader
+
+    with db_loader.pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE SCHEMA {schema}")
+        cursor.execute(f"CREATE TABLE {schema}.fact_real_estate (LIKE public.fact_real_estate INCLUDING DEFAULTS)")
+        cursor.execute(f"SET search_path TO {schema}, public")
+        conn.commit()
+        try:
+            timer.run('insert_copy', db_loader.bulk_load_rows, conn, facts)
+            cursor.execute("TRUNCATE fact_real_estate")
+            conn.commit()
+            batch = facts.iloc[:BATCH_INSERT_MAX_ROWS]
+            timer.run('insert_execute_batch', db_loader.batch_load_rows, conn, batch, rows=len(batch))
+        finally:
+            conn.rollback()
+            cursor.execute("RESET search_path")
+            cursor.execute(f"DROP SCHEMA {schema} CASCADE")
+            conn.commit()
+            cursor.close()
+    db_loader.close_connection_pool()
+
+def run_scale(rows, seed=42, database=False, workers=None):
+    """Все стадии для одного объема (выполняется в отдельном процессе, чтобы пик памяти был своим)"""
+    import avito_parser
+    import dataset_storage
+    import db_loader
+    from data_validation import IntegrityValidator
+    from deduplication import find_duplicates
+
+    print(f"\n{rows:,} строк:", flush=True)
+    timer = StageTimer(rows)
+    scale = rows / sum(count for *_, count in avito_parser.build_generation_plan(1.0))
+    workdir = tempfile.mkdtemp(prefix='real_estate_bench_')
+    try:
+        # Исходный построчный генератор имеет фиксированный объем, меряем его один раз на малом масштабе
+        if rows <= 10000:
+            legacy_rows = sum(count for *_, count in avito_parser.build_generation_plan(1.0))
+            timer.run('generate_legacy', avito_parser.create_comprehensive_real_estate_dataset, rows=legacy_rows)
+
+        if workers:
+            df = timer.run('generate_parallel', avito_parser.create_comprehensive_real_estate_dataset_parallel,
+                           seed=seed, scale=scale, workers=workers)
+        else:
+            df = timer.run('generate_columnar', avito_parser.create_comprehensive_real_estate_dataset_columnar,
+                           seed=seed, scale=scale)
+        timer.count = len(df)
+
+        csv_file = os.path.join(workdir, 'dataset.csv')
+        timer.run('write_csv', df.to_csv, csv_file, index=False, encoding='utf-8')
+        source = timer.run('read_csv', dataset_storage.read_dataset, csv_file)
+
+        if dataset_storage.pa is not None:
+            parquet_dir = os.path.join(workdir, 'dataset.parquet')
+            timer.run('write_parquet', dataset_storage.save_parquet_dataset, df, parquet_dir)
+            timer.run('read_parquet', dataset_storage.read_dataset, parquet_dir)
+        else:
+            timer.skip('write_parquet', 'нет pyarrow')
+            timer.skip('read_parquet', 'нет pyarrow')
+        del df
+
+        # Проверки и поправки данных (заменили fix_csv_data), поиск дубликатов, преобразование
+        maps = _dimension_maps(source)
+        validator = IntegrityValidator()
+        source = timer.run('validate_source', validator.check_source, source, maps)
+        duplicates = timer.run('deduplicate', find_duplicates, source)
+        source = source.drop(index=duplicates.index)
+        timer.count = len(source)
+        facts = timer.run('transform', db_loader.transform_fact_frame, source, maps['districts'],
+                          maps['property_types'], maps['house_types'], maps['dates'])
+        facts = timer.run('validate_facts', validator.check_facts, facts)
+        timer.count = len(facts)
+
+        # Клиентская часть вставки: сериализация для COPY и кортежи для execute_batch
+        timer.run('serialize_copy', db_loader.rows_to_copy_buffer, facts)
+        batch = facts.iloc[:BATCH_INSERT_MAX_ROWS]
+        timer.run('serialize_batch', db_loader.frame_to_rows, batch, rows=len(batch))
+
+        if database:
+            _benchmark_database(timer, facts, f"benchmark_{os.getpid()}")
+        else:
+            timer.skip('insert_copy', 'без --database')
+            timer.skip('insert_execute_batch', 'без --database')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return timer.results
+
+def environment_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+def compare_with_baseline(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Сравнение времени стадий с эталоном. Возвращает список регрессий"""
+    reference = {(row['rows'], row['stage']): row for row in baseline['results'] if 'seconds' in row}
+    regressions = []
+    print(f"\nСРАВНЕНИЕ С ЭТАЛОНОМ ({baseline['environment'].get('timestamp')}, "
+          f"коммит {baseline['environment'].get('commit')}):")
+    for row in results:
+        base = reference.get((row['rows'], row['stage']))
+        if base is None or 'seconds' not in row or not base['seconds']:
+            continue
+        ratio = row['seconds'] / base['seconds']
+        regression = ratio > 1 + threshold and row['seconds'] - base['seconds'] > REGRESSION_MIN_SECONDS
+        mark = 'РЕГРЕССИЯ' if regression else ('быстрее' if ratio < 1 - threshold else 'ок')
+        print(f"  {row['rows']:>10,} {row['stage']:<22} {base['seconds']:8.3f} -> {row['seconds']:8.3f} с "
+              f"(x{ratio:.2f}) {mark}")
+        if regression:
+            regressions.append({**row, 'baseline_seconds': base['seconds'], 'ratio': round(ratio, 3)})
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Замер производительности генерации, преобразования и загрузки")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS,
+                        help="объемы датасета в строках (например 10000 100000 1000000 10000000)")
+    parser.add_argument('--seed', type=int, default=42, help="seed генератора")
+    parser.add_argument('--workers', type=int, default=None, help="параллельная генерация в N процессах")
+    parser.add_argument('--database', action='store_true',
+                        help="замерить вставку в PostgreSQL из DB_CONFIG (во временную схему)")
+    parser.add_argument('--output', default=RESULTS_FILE, help="файл результатов (JSON)")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="эталон для сравнения (JSON)")
+    parser.add_argument('--save-baseline', action='store_true', help="сохранить результаты как новый эталон")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="допустимое замедление стадии относительно эталона (0.2 = 20%%)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    print("ЗАМЕР ПРОИЗВОДИТЕЛЬНОСТИ")
+    print("=" * 60)
+
+    # Каждый объем - в новом процессе: пик памяти не наследуется от предыдущего
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for rows in sorted(args.rows):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results += executor.submit(run_scale, rows, args.seed, args.database, args.workers).result()
+
+    report = {'environment': environment_info(), 'results': results}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report['regressions'] = compare_with_baseline(results, json.load(f), args.threshold)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"\nРезультаты сохранены в {args.output}")
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Эталон сохранен в {args.baseline}")
+
+    if report.get('regressions'):
+        print(f"Регрессий: {len(report['regressions'])}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import argparse
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset_storage import read_dataset
+
+# Индекс аналогов между запусками (обновляется загрузчиком, если файл есть)
+COMPARABLES_FILE = 'comparables_index.pkl'
+
+# Группа индекса: аналоги ищутся только в том же районе и типе недвижимости
+GROUP_COLUMNS = ['district', 'property_type']
+
+# Числовые признаки сходства и их веса; площадь сравнивается в логарифме
+# (разница 50 и 60 м² важнее, чем 500 и 510 м²)
+FEATURE_WEIGHTS = {
+    'rooms': 1.0,
+    'area': 1.5,
+    'floor': 0.5,
+    'total_floors': 0.5,
+    'year_built': 0.7,
+    'metro_time': 0.7
+}
+LOG_FEATURES = ('area',)
+
+# Несовпадение типа дома добавляет к расстоянию HOUSE_TYPE_WEIGHT
+HOUSE_TYPE_WEIGHT = 1.0
+
+# Колонки объявлений, которые хранит индекс (и возвращает в результатах)
+LISTING_COLUMNS = ['id'] + GROUP_COLUMNS + list(FEATURE_WEIGHTS) + ['house_type', 'price', 'price_per_sqm', 'address']
+
+# Точек в листе KD-дерева и элементов (запросы x листья x признаки) в одном шаге запроса
+LEAF_SIZE = 32
+QUERY_CHUNK_ELEMENTS = 4000000
+
+# Граница поиска считается по ближайшим листьям, в которых набирается во столько раз
+# больше точек, чем нужно аналогов: граница точнее, и дальних листьев проверяется меньше
+BOUND_POINTS_FACTOR = 4
+
+def kd_leaves(points, leaf_size=LEAF_SIZE):
+    """KD-разбиение: отрезки длиннее leaf_size делятся пополам по медиане признака
+    с наибольшим разбросом (все отрезки уровня - одной сортировкой).
+    Возвращает перестановку точек и границы листьев (starts, ends)"""
+    n = len(points)
+    perm = np.arange(n)
+    starts, ends = np.array([0]), np.array([n])
+    while True:
+        sizes = ends - starts
+        split = sizes > leaf_size
+        if not split.any():
+            return perm, starts, ends
+        segment = np.repeat(np.arange(len(starts)), sizes)
+        ordered = points[perm]
+        spread = np.maximum.reduceat(ordered, starts) - np.minimum.reduceat(ordered, starts)
+        dims = spread.argmax(axis=1)
+        rows = np.flatnonzero(split[segment])
+        key = ordered[rows, dims[segment[rows]]]
+        perm[rows] = perm[rows[np.lexsort((key, segment[rows]))]]
+
+        mids = starts + sizes // 2
+        new_starts = np.concatenate([starts, mids[split]])
+        new_ends = np.concatenate([np.where(split, mids, ends), ends[split]])
+        order = np.argsort(new_starts, kind='stable')
+        starts, ends = new_starts[order], new_ends[order]
+
+def _expand_leaves(query_rows, leaves, starts, sizes):
+    """Пары (запрос, точка) для всех точек перечисленных листьев"""
+    counts = sizes[leaves]
+    offsets = np.cumsum(counts) - counts
+    points = np.repeat(starts[leaves] - offsets, counts) + np.arange(counts.sum())
+    return np.repeat(query_rows, counts), points
+
+def _top_k(query_rows, points, distances, k):
+    """k ближайших на запрос: пары отсортированы по (запрос, расстояние), ранг с 0"""
+    order = np.lexsort((distances, query_rows))
+    query_rows, points, distances = query_rows[order], points[order], distances[order]
+    first = np.r_[0, np.flatnonzero(np.diff(query_rows)) + 1]
+    rank = np.arange(len(query_rows)) - np.repeat(first, np.diff(np.r_[first, len(query_rows)]))
+    keep = rank < k
+    return query_rows[keep], points[keep], distances[keep], rank[keep]
+
+class GroupTree:
+    """KD-дерево одной группы (район, тип): нормированные точки в порядке листьев,
+    границы листьев и их описывающие прямоугольники"""
+
+    def __init__(self, listings):
+        features = listings[list(FEATURE_WEIGHTS)].apply(pd.to_numeric, errors='coerce').astype(float)
+        for column in LOG_FEATURES:
+            features[column] = np.log1p(features[column].clip(lower=0))
+        # Центр и масштаб группы (устойчивые: медиана и межквартильный размах)
+        self.center = features.median().fillna(0.0).to_numpy()
+        spread = (features.quantile(0.75) - features.quantile(0.25)).to_numpy() / 1.349
+        spread = np.where(np.isfinite(spread) & (spread > 0), spread, features.std().fillna(0).to_numpy())
+        self.scale = np.where(spread > 0, spread, 1.0)
+        self.house_types = sorted(listings['house_type'].dropna().unique())
+
+        points = self.transform(listings)
+        perm, self.starts, self.ends = kd_leaves(points)
+        self.points = points[perm]
+        self.listings = listings.iloc[perm].reset_index(drop=True)
+        self.position = pd.Series(np.arange(len(perm)), index=self.listings['id'].astype(str))
+        self.box_min = np.minimum.reduceat(self.points, self.starts)
+        self.box_max = np.maximum.reduceat(self.points, self.starts)
+
+    def transform(self, listings):
+        """Признаки объявлений в пространстве группы; пропуски - медиана группы"""
+        features = np.column_stack([
+            pd.to_numeric(listings[column], errors='coerce').to_numpy(dtype=float) if column in listings.columns
+            else np.full(len(listings), np.nan) for column in FEATURE_WEIGHTS
+        ])
+        for column in LOG_FEATURES:
+            position = list(FEATURE_WEIGHTS).index(column)
+            features[:, position] = np.log1p(np.clip(features[:, position], 0, None))
+        features = np.where(np.isnan(features), self.center, features)
+        features = (features - self.center) / self.scale * np.array(list(FEATURE_WEIGHTS.values()))
+        # Тип дома: one-hot со стороной HOUSE_TYPE_WEIGHT / sqrt(2), у разных типов расстояние = вес
+        house_type = listings['house_type'] if 'house_type' in listings.columns else pd.Series(None, index=listings.index)
+        one_hot = (house_type.to_numpy(dtype=object)[:, None] == np.array(self.house_types, dtype=object)[None, :])
+        return np.hstack([features, one_hot * (HOUSE_TYPE_WEIGHT / np.sqrt(2))])
+
+    def knn(self, queries, k, exclude=None):
+        """k ближайших точек для нормированных запросов.
+
+        Для каждого запроса сначала берутся ближайшие по прямоугольникам
+        листья с запасом точек (BOUND_POINTS_FACTOR), k-е расстояние до их
+        точек ограничивает поиск; затем проверяются только листья, прямоугольник
+        которых ближе этой границы. exclude - позиции точек, которые нельзя
+        возвращать своим запросам (сам объект).
+        Возвращает (запрос, позиция точки, расстояние, ранг)."""
+        sizes = self.ends - self.starts
+        wanted = k + (exclude is not None)
+        results = []
+        chunk = max(1, QUERY_CHUNK_ELEMENTS // (len(self.starts) * self.points.shape[1]))
+        for first in range(0, len(queries), chunk):
+            block = queries[first:first + chunk]
+            gap = np.maximum(np.maximum(self.box_min[None] - block[:, None], block[:, None] - self.box_max[None]), 0)
+            box_distance = np.einsum('qld,qld->ql', gap, gap)
+
+            # Граница поиска по ближайшим листьям, в которых не меньше BOUND_POINTS_FACTOR * wanted точек
+            leaf_order = np.argsort(box_distance, axis=1)
+            enough = np.cumsum(sizes[leaf_order], axis=1) < BOUND_POINTS_FACTOR * wanted
+            needed = np.minimum(enough.sum(axis=1) + 1, len(sizes))
+            rows, ranks = np.nonzero(np.arange(len(sizes))[None] < needed[:, None])
+            query_rows, _, distances, _ = self._search(block, rows, leaf_order[rows, ranks], exclude, first, k)
+            limit = np.zeros(len(block))
+            np.maximum.at(limit, query_rows, distances)
+
+            rows, leaves = np.nonzero(box_distance <= limit[:, None])
+            query_rows, points, distances, rank = self._search(block, rows, leaves, exclude, first, k, limit)
+            results.append((query_rows + first, points, np.sqrt(distances), rank))
+        return tuple(np.concatenate(parts) for parts in zip(*results)) if results else None
+
+    def _search(self, block, rows, leaves, exclude, first, k, limit=None):
+        """k ближайших среди точек листьев; точки дальше limit запроса отбрасываются до сортировки"""
+        sizes = self.ends - self.starts
+        query_rows, points = _expand_leaves(rows, leaves, self.starts, sizes)
+        difference = self.points[points] - block[query_rows]
+        distances = np.einsum('nd,nd->n', difference, difference)
+        if exclude is not None:
+            allowed = points != exclude[query_rows + first]
+            query_rows, points, distances = query_rows[allowed], points[allowed], distances[allowed]
+        if limit is not None:
+            near = distances <= limit[query_rows]
+            query_rows, points, distances = query_rows[near], points[near], distances[near]
+        return _top_k(query_rows, points, distances, k)
+
+class ComparablesIndex:
+    """Поиск аналогов объявления: k ближайших по признакам FEATURE_WEIGHTS
+    и типу дома среди объявлений того же района и типа недвижимости.
+
+    На каждую группу (район, тип) строится свое KD-дерево по нормированным
+    признакам (масштаб - межквартильный размах группы). Запросы
+    обрабатываются пачками и векторно; update перестраивает только группы,
+    в которые пришли новые объявления.
+    """
+
+    def __init__(self):
+        self.groups = {}
+
+    @classmethod
+    def from_dataset(cls, path, categories=None, districts=None):
+        listings = read_dataset(path, columns=LISTING_COLUMNS, categories=categories, districts=districts)
+        return cls().update(listings)
+
+    def update(self, listings):
+        """Добавляет (и заменяет по id) объявления; перестраиваются только затронутые группы"""
+        listings = listings.reindex(columns=LISTING_COLUMNS)
+        listings = listings[listings['id'].notna()]
+        for key, rows in listings.groupby(GROUP_COLUMNS, sort=False, observed=True):
+            if key in self.groups:
+                rows = pd.concat([self.groups[key].listings, rows], ignore_index=True)
+            rows = rows.drop_duplicates(subset='id', keep='last', ignore_index=True)
+            self.groups[key] = GroupTree(rows)
+        return self
+
+    def __len__(self):
+        return sum(len(tree.listings) for tree in self.groups.values())
+
+    def _result(self, tree, labels, match):
+        query_rows, points, distances, rank = match
+        found = tree.listings.iloc[points].reset_index(drop=True)
+        found.insert(0, 'query', np.asarray(labels, dtype=object)[query_rows])
+        found.insert(1, 'rank', rank + 1)
+        found.insert(2, 'distance', distances.round(4))
+        return found
+
+    def query(self, listings, k=20):
+        """Аналоги для произвольных объектов (колонки district, property_type и признаки;
+        пропущенные признаки не влияют на сходство). query в результате - индекс объекта"""
+        results = []
+        for key, rows in listings.groupby(GROUP_COLUMNS, sort=False, observed=True):
+            tree = self.groups.get(key)
+            if tree is None:
+                continue
+            match = tree.knn(tree.transform(rows), k)
+            results.append(self._result(tree, rows.index, match))
+        return self._combine(results)
+
+    def comparables(self, ids, k=20):
+        """Аналоги объявлений из индекса (сам объект в результат не входит)"""
+        ids = pd.Index(pd.Series(ids).astype(str))
+        results = []
+        for tree in self.groups.values():
+            positions = tree.position.reindex(ids).dropna().astype(np.int64)
+            if not len(positions):
+                continue
+            exclude = positions.to_numpy()
+            match = tree.knn(tree.points[exclude], k, exclude=exclude)
+            results.append(self._result(tree, positions.index, match))
+        return self._combine(results)
+
+    @staticmethod
+    def _combine(results):
+        if not results:
+            return pd.DataFrame(columns=['query', 'rank', 'distance'] + LISTING_COLUMNS)
+        return pd.concat(results, ignore_index=True)
+
+    def save(self, path=COMPARABLES_FILE):
+        """Атомарная запись индекса на диск"""
+        tmp_file = f"{path}.tmp"
+        with open(tmp_file, 'wb') as f:
+            # Состояние деревьев без ссылки на класс: файл читается и из скрипта, и из модуля
+            pickle.dump({key: vars(tree) for key, tree in self.groups.items()}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path=COMPARABLES_FILE):
+        index = cls()
+        with open(path, 'rb') as f:
+            states = pickle.load(f)
+        for key, state in states.items():
+            tree = GroupTree.__new__(GroupTree)
+            tree.__dict__.update(state)
+            index.groups[key] = tree
+        return index
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Поиск аналогов объявлений (k ближайших)")
+    parser.add_argument('--source', default='comprehensive_real_estate_dataset.csv',
+                        help="CSV-файл или parquet-каталог датасета для построения индекса")
+    parser.add_argument('--index', default=COMPARABLES_FILE, help="файл индекса")
+    parser.add_argument('--rebuild', action='store_true', help="построить индекс заново из --source")
+    parser.add_argument('--id', nargs='*', default=[], help="id объявлений, для которых показать аналоги")
+    parser.add_argument('--k', type=int, default=20, help="число аналогов")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    if args.rebuild or not os.path.exists(args.index):
+        started = time.perf_counter()
+        index = ComparablesIndex.from_dataset(args.source)
+        index.save(args.index)
+        print(f"Индекс построен: {len(index):,} объявлений, {len(index.groups)} групп "
+              f"за {time.perf_counter() - started:.2f} с ({args.index})")
+    else:
+        index = ComparablesIndex.load(args.index)
+        print(f"Индекс загружен: {len(index):,} объявлений, {len(index.groups)} групп")
+
+    if args.id:
+        started = time.perf_counter()
+        found = index.comparables(args.id, k=args.k)
+        print(f"Поиск: {time.perf_counter() - started:.3f} с")
+        for query, rows in found.groupby('query', sort=False):
+            print(f"\nАналоги объявления {query}:")
+            print(rows.drop(columns='query').to_string(index=False))
+
+if __name__ == "__main__":
+    main()
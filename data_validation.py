@@ -0,0 +1,222 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+# Таблицы хранилища: накопительные счетчики проверок и отбракованные строки
+COUNTERS_TABLE = 'etl_integrity_counters'
+QUARANTINE_TABLE = 'etl_quarantine'
+
+# Проверка -> (уровень, описание). error - строка уходит в карантин,
+# warning - строка загружается, но учитывается в счетчиках (этаж выше
+# этажности встречается в объявлениях коммерческой недвижимости и гаражей)
+CHECKS = {
+    'unknown_district': ('error', 'Район не найден в dim_districts'),
+    'unknown_property_type': ('error', 'Тип недвижимости не найден в dim_property_types'),
+    'unknown_date': ('error', 'Дата публикации не найдена в dim_time'),
+    'missing_external_id': ('error', 'Нет external_id'),
+    'duplicate_external_id': ('error', 'Повтор external_id в пачке (загружается последняя строка)'),
+    'rooms_out_of_range': ('error', 'Число комнат вне диапазона 0-20'),
+    'year_built_out_of_range': ('error', 'Год постройки вне диапазона 1800 - текущий + 5'),
+    'negative_metro_time': ('error', 'Отрицательное время до метро'),
+    'floor_above_total': ('warning', 'Этаж выше этажности дома'),
+    'price_not_positive': ('warning', 'Записей с нулевой ценой'),
+    'area_not_positive': ('warning', 'Записей с нулевой площадью'),
+    'price_per_sqm_mismatch': ('warning', 'price_per_sqm расходится с price/area больше допуска'),
+    'unknown_house_type': ('warning', 'Тип дома не найден в dim_house_types')
+}
+
+# Допустимое относительное расхождение price_per_sqm и price/area
+PRICE_PER_SQM_TOLERANCE = 0.05
+
+# Накопительное обновление счетчиков одним запросом
+UPSERT_COUNTERS_QUERY = f"""
+    INSERT INTO {COUNTERS_TABLE} AS c (check_name, severity, description, checked_rows, failed_rows, last_failed_rows)
+    SELECT name, severity, description, checked, failed, failed
+    FROM unnest(%s::text[], %s::text[], %s::text[], %s::bigint[], %s::bigint[])
+        AS t(name, severity, description, checked, failed)
+    ON CONFLICT (check_name) DO UPDATE SET
+        severity = EXCLUDED.severity,
+        description = EXCLUDED.description,
+        checked_rows = c.checked_rows + EXCLUDED.checked_rows,
+        failed_rows = c.failed_rows + EXCLUDED.failed_rows,
+        last_failed_rows = EXCLUDED.last_failed_rows,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+# Повторно отбракованная строка (та же проверка и external_id) заменяет прежнюю
+INSERT_QUARANTINE_QUERY = f"""
+    INSERT INTO {QUARANTINE_TABLE} (check_name, external_id, row_data)
+    SELECT name, external_id, row_data
+    FROM unnest(%s::text[], %s::text[], %s::jsonb[]) AS t(name, external_id, row_data)
+    ON CONFLICT (check_name, external_id) DO UPDATE SET
+        row_data = EXCLUDED.row_data,
+        quarantined_at = CURRENT_TIMESTAMP
+"""
+
+def ensure_validation_objects(cursor):
+    """Таблицы счетчиков и карантина (для баз, созданных до их появления в скрипте восстановления)"""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {COUNTERS_TABLE} (
+            check_name VARCHAR(50) PRIMARY KEY,
+            severity VARCHAR(10) NOT NULL,
+            description TEXT,
+            checked_rows BIGINT NOT NULL DEFAULT 0,
+            failed_rows BIGINT NOT NULL DEFAULT 0,
+            last_failed_rows BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {QUARANTINE_TABLE} (
+            quarantine_id BIGSERIAL PRIMARY KEY,
+            check_name VARCHAR(50) NOT NULL,
+            external_id VARCHAR(100),
+            row_data JSONB NOT NULL,
+            quarantined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_quarantine_check_external_id
+        ON {QUARANTINE_TABLE}(check_name, external_id)
+    """)
+
+def _numeric(df, column):
+    if column not in df.columns:
+        return pd.Series(np.nan, index=df.index)
+    return pd.to_numeric(df[column], errors='coerce')
+
+class IntegrityValidator:
+    """Векторные проверки пачек при загрузке.
+
+    check_source проверяет строки датасета до преобразования (покрытие
+    справочниками, пропуски по колонкам), check_facts - готовые строки
+    fact_real_estate (диапазоны, согласованность цены, дубликаты).
+    Строки с ошибками (error) убираются из пачки в карантин, счетчики
+    копятся по всем пачкам и в конце загрузки сохраняются в хранилище.
+    """
+
+    def __init__(self):
+        self.checked = dict.fromkeys(CHECKS, 0)
+        self.failed = dict.fromkeys(CHECKS, 0)
+        self.missing_values = {}
+        self.quarantine = []
+
+    def _apply(self, frame, failures, id_column):
+        """Учитывает маски проверок и отделяет строки с ошибками. Возвращает чистые строки"""
+        rejected = pd.Series(False, index=frame.index)
+        reason = pd.Series(None, index=frame.index, dtype=object)
+        for name, mask in failures.items():
+            mask = mask.fillna(False).astype(bool)
+            self.checked[name] += len(frame)
+            self.failed[name] += int(mask.sum())
+            if CHECKS[name][0] == 'error':
+                # В карантине строка числится за первой не пройденной проверкой
+                reason = reason.mask(mask & ~rejected, name)
+                rejected |= mask
+        if rejected.any():
+            bad = frame[rejected]
+            self.quarantine.append(pd.DataFrame({
+                'check_name': reason[rejected].to_numpy(),
+                'external_id': bad[id_column].astype(str).where(bad[id_column].notna(), None).to_numpy()
+                    if id_column in bad.columns else None,
+                'row_data': bad.to_json(orient='records', lines=True, force_ascii=False,
+                                        date_format='iso').splitlines()
+            }))
+        return frame[~rejected]
+
+    def check_source(self, df, dimension_maps):
+        """Проверки строк датасета до преобразования; dimension_maps - ключи справочников (DimensionManager.maps)"""
+        for column, count in df.isna().sum().items():
+            self.missing_values[column] = self.missing_values.get(column, 0) + int(count)
+
+        publish_date = pd.to_datetime(df['publish_date']).dt.date
+        failures = {
+            'unknown_district': ~df['district'].isin(list(dimension_maps['districts'])),
+            'unknown_property_type': ~df['property_type'].isin(list(dimension_maps['property_types'])),
+            'unknown_date': ~publish_date.isin(list(dimension_maps['dates']))
+        }
+        if 'house_type' in df.columns:
+            failures['unknown_house_type'] = df['house_type'].notna() & \
+                ~df['house_type'].isin(list(dimension_maps['house_types']))
+        return self._apply(df, failures, 'id')
+
+    def check_facts(self, facts):
+        """Проверки готовых строк fact_real_estate (колонки db_loader.FACT_COLUMNS)"""
+        price, area, price_per_sqm = _numeric(facts, 'price'), _numeric(facts, 'area'), _numeric(facts, 'price_per_sqm')
+        floor, total_floors = _numeric(facts, 'floor'), _numeric(facts, 'total_floors')
+        rooms, year_built = _numeric(facts, 'rooms'), _numeric(facts, 'year_built')
+        expected = price / area.where(area > 0)
+        comparable = (price > 0) & (area > 0) & (price_per_sqm > 0)
+
+        failures = {
+            'missing_external_id': facts['external_id'].isna(),
+            # external_id уникален во всем хранилище: повтор с другой датой - тоже дубликат
+            'duplicate_external_id': facts['external_id'].notna() & facts.duplicated('external_id', keep='last'),
+            'floor_above_total': floor > total_floors,
+            'rooms_out_of_range': (rooms < 0) | (rooms > 20),
+            'year_built_out_of_range': (year_built < 1800) | (year_built > date.today().year + 5),
+            'negative_metro_time': _numeric(facts, 'metro_time') < 0,
+            'price_not_positive': price <= 0,
+            'area_not_positive': area <= 0,
+            'price_per_sqm_mismatch': comparable &
+                ((price_per_sqm - expected).abs() > PRICE_PER_SQM_TOLERANCE * expected)
+        }
+        return self._apply(facts, failures, 'external_id')
+
+    def merge(self, other):
+        """Добавляет счетчики и карантин другого экземпляра (кусок, проверенный в другом процессе)"""
+        for name in CHECKS:
+            self.checked[name] += other.checked[name]
+            self.failed[name] += other.failed[name]
+        for column, count in other.missing_values.items():
+            self.missing_values[column] = self.missing_values.get(column, 0) + count
+        self.quarantine.extend(other.quarantine)
+        return self
+
+    @property
+    def quarantined(self):
+        return sum(len(frame) for frame in self.quarantine)
+
+    def report(self):
+        """Результаты проверок текущей загрузки"""
+        rows = [(name, CHECKS[name][0], CHECKS[name][1], self.checked[name], self.failed[name])
+                for name in CHECKS if self.checked[name]]
+        return pd.DataFrame(rows, columns=['check_name', 'severity', 'description', 'checked_rows', 'failed_rows'])
+
+    def print_report(self):
+        missing = {column: count for column, count in self.missing_values.items() if count}
+        if missing:
+            print("Пропущенные значения:")
+            for column, count in missing.items():
+                print(f"  {column}: {count} пропущенных")
+        print("Проверки целостности:")
+        for row in self.report().itertuples(index=False):
+            status = 'OK' if row.failed_rows == 0 else row.severity.upper()
+            print(f"  [{status}] {row.description}: {row.failed_rows} из {row.checked_rows}")
+        if self.quarantined:
+            print(f"В карантин ({QUARANTINE_TABLE}): {self.quarantined} строк")
+
+    def save(self, cursor):
+        """Запись карантина и накопительных счетчиков в хранилище (в транзакции загрузки)"""
+        ensure_validation_objects(cursor)
+        if self.quarantine:
+            quarantine = pd.concat(self.quarantine, ignore_index=True)
+            # Один INSERT ... ON CONFLICT не может обновить строку дважды: из повторов
+            # (check_name, external_id) остается последний, строки без external_id не конфликтуют
+            quarantine = quarantine[quarantine['external_id'].isna() |
+                                    ~quarantine.duplicated(['check_name', 'external_id'], keep='last')]
+            cursor.execute(INSERT_QUARANTINE_QUERY, (
+                quarantine['check_name'].tolist(),
+                quarantine['external_id'].astype(object).where(quarantine['external_id'].notna(), None).tolist(),
+                quarantine['row_data'].tolist()
+            ))
+        report = self.report()
+        cursor.execute(UPSERT_COUNTERS_QUERY, (
+            report['check_name'].tolist(),
+            report['severity'].tolist(),
+            report['description'].tolist(),
+            report['checked_rows'].tolist(),
+            report['failed_rows'].tolist()
+        ))
+        self.quarantine = []
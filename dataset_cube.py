@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+
+from dataset_storage import read_dataset
+
+# Измерения куба (колонки датасета, по которым группируем и фильтруем)
+CUBE_DIMENSIONS = ['district', 'property_category', 'property_type', 'rooms']
+
+# Меры (числовые колонки) и поддерживаемые агрегаты
+CUBE_MEASURES = ['price', 'area', 'price_per_sqm']
+CUBE_AGGREGATES = ('count', 'sum', 'mean', 'min', 'max')
+
+# Выше этого числа комбинаций группы нумеруются через np.unique вместо плотного bincount
+DENSE_GROUPS_LIMIT = 1000000
+
+class DatasetCube:
+    """Колоночный куб датасета в памяти для аналитических запросов без БД.
+
+    Измерения хранятся кодами категорий (int32, -1 - пропуск), меры -
+    массивами float64. Запрос (группировка, фильтр по измерениям, top-k)
+    выполняется одним векторным проходом через bincount, результат
+    кэшируется по параметрам запроса.
+    """
+
+    def __init__(self, df):
+        self.size = len(df)
+        self.codes = {}
+        self.labels = {}
+        for dimension in CUBE_DIMENSIONS:
+            if dimension in df.columns:
+                self.codes[dimension], self.labels[dimension] = self._encode(df[dimension])
+        self.values = {measure: pd.to_numeric(df[measure], errors='coerce').to_numpy(dtype=float)
+                       for measure in CUBE_MEASURES if measure in df.columns}
+        self._cache = {}
+
+    @classmethod
+    def from_dataset(cls, path, categories=None, districts=None):
+        """Куб из CSV или parquet-каталога (читаются только колонки куба)"""
+        return cls(read_dataset(path, columns=CUBE_DIMENSIONS + CUBE_MEASURES,
+                                categories=categories, districts=districts))
+
+    @staticmethod
+    def _encode(series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return series.cat.codes.to_numpy(dtype=np.int32), pd.Index(series.cat.categories)
+        if pd.api.types.is_numeric_dtype(series.dtype):
+            # Целочисленные измерения (комнаты) приводим к Int64, чтобы метки были 1, 2, ... а не 1.0
+            series = series.astype('Int64')
+        codes, labels = pd.factorize(series, sort=True)
+        return codes.astype(np.int32), pd.Index(labels)
+
+    def _row_mask(self, where, positive):
+        mask = np.ones(self.size, dtype=bool)
+        for dimension, values in where:
+            allowed = np.zeros(len(self.labels[dimension]) + 1, dtype=bool)
+            positions = self.labels[dimension].get_indexer(list(values))
+            allowed[positions[positions >= 0]] = True
+            # Код -1 (пропуск) попадает в последний элемент allowed, он всегда False
+            mask &= allowed[self.codes[dimension]]
+        for measure in positive:
+            mask &= self.values[measure] > 0
+        return mask
+
+    def _group_keys(self, group_by, mask):
+        """Номер группы для каждой строки и число возможных групп"""
+        keys = np.zeros(self.size, dtype=np.int64)
+        n_groups = 1
+        for dimension in group_by:
+            codes = self.codes[dimension]
+            mask &= codes >= 0
+            keys = keys * len(self.labels[dimension]) + codes
+            n_groups *= len(self.labels[dimension])
+        return keys[mask], n_groups
+
+    def _aggregate(self, keys, n_groups, measures, mask):
+        result = {'rows': np.bincount(keys, minlength=n_groups)}
+        for measure, aggregate in measures:
+            values = self.values[measure][mask]
+            present = ~np.isnan(values)
+            name = f"{measure}_{aggregate}"
+            if aggregate in ('count', 'mean'):
+                counts = np.bincount(keys[present], minlength=n_groups)
+            if aggregate in ('sum', 'mean'):
+                sums = np.bincount(keys[present], weights=values[present], minlength=n_groups)
+            if aggregate == 'count':
+                result[name] = counts
+            elif aggregate == 'sum':
+                result[name] = sums
+            elif aggregate == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    result[name] = sums / counts
+            else:
+                extreme = np.full(n_groups, np.inf if aggregate == 'min' else -np.inf)
+                ufunc = np.minimum if aggregate == 'min' else np.maximum
+                ufunc.at(extreme, keys[present], values[present])
+                result[name] = np.where(np.isfinite(extreme), extreme, np.nan)
+        return result
+
+    def query(self, group_by=(), measures=(('price', 'mean'),), where=None, positive=(),
+              order_by=None, ascending=False, top=None):
+        """Группировка с фильтрами и top-k.
+
+        group_by - измерения группировки; measures - пары (мера, агрегат)
+        из CUBE_AGGREGATES, колонки результата называются <мера>_<агрегат>,
+        плюс rows - число строк группы; where - {измерение: допустимые значения};
+        positive - меры, по которым берутся только строки со значением > 0;
+        order_by/ascending/top - сортировка и первые top групп.
+        Группы без строк и строки с пропуском в измерении группировки не выводятся.
+        """
+        group_by = tuple(group_by)
+        measures = tuple(tuple(measure) for measure in measures)
+        where = tuple(sorted((dimension, tuple(values)) for dimension, values in (where or {}).items()))
+        positive = tuple(sorted(positive))
+        cache_key = (group_by, measures, where, positive, order_by, ascending, top)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached.copy()
+
+        for _, aggregate in measures:
+            if aggregate not in CUBE_AGGREGATES:
+                raise ValueError(f"Неизвестный агрегат {aggregate}, допустимы: {', '.join(CUBE_AGGREGATES)}")
+
+        mask = self._row_mask(where, positive)
+        keys, n_groups = self._group_keys(group_by, mask)
+        if n_groups > DENSE_GROUPS_LIMIT:
+            # Разреженная нумерация: только встретившиеся комбинации
+            group_ids, keys = np.unique(keys, return_inverse=True)
+            aggregated = self._aggregate(keys, len(group_ids), measures, mask)
+        else:
+            group_ids = np.arange(n_groups)
+            aggregated = self._aggregate(keys, n_groups, measures, mask)
+
+        observed = aggregated['rows'] > 0
+        result = pd.DataFrame({name: values[observed] for name, values in aggregated.items()})
+
+        # Раскладываем номер группы обратно на коды измерений
+        if group_by:
+            remainder = group_ids[observed]
+            levels = []
+            for dimension in reversed(group_by):
+                size = len(self.labels[dimension])
+                levels.append(self.labels[dimension][remainder % size])
+                remainder = remainder // size
+            result.index = pd.MultiIndex.from_arrays(levels[::-1], names=group_by) if len(group_by) > 1 \
+                else pd.Index(levels[0], name=group_by[0])
+
+        if order_by is not None:
+            result = result.sort_values(order_by, ascending=ascending, kind='stable')
+        if top is not None:
+            result = result.head(top)
+
+        self._cache[cache_key] = result
+        return result.copy()
+
+    def top(self, dimension, measure='price_per_sqm', aggregate='mean', k=10, **filters):
+        """Первые k значений измерения по агрегату меры (например, самые дорогие районы)"""
+        column = f"{measure}_{aggregate}"
+        return self.query((dimension,), ((measure, aggregate),), order_by=column, top=k, **filters)[column]
+
+    def share(self, dimension, **filters):
+        """Число строк и доля (в %) по значениям измерения, по убыванию"""
+        counts = self.query((dimension,), (), order_by='rows', **filters)['rows']
+        return pd.DataFrame({'rows': counts, 'percent': counts / counts.sum() * 100})
+
+    def clear_cache(self):
+        self._cache.clear()
@@ -0,0 +1,136 @@
+import os
+import shutil
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # parquet - необязательная зависимость
+    pa = None
+    ds = None
+    pq = None
+
+# Колоночная копия датасета: каталог с партициями property_category=.../district=...
+PARQUET_DATASET = 'comprehensive_real_estate_dataset.parquet'
+PARTITION_COLUMNS = ['property_category', 'district']
+
+# Типы хранения колонок
+INT_COLUMNS = ['rooms', 'floor', 'total_floors', 'year_built', 'metro_time', 'parking_spaces', 'price', 'price_per_sqm']
+FLOAT_COLUMNS = ['area', 'ceiling_height', 'land_area']
+BOOL_COLUMNS = ['has_elevator', 'is_renovated', 'has_ventilation', 'has_air_conditioning',
+                'has_utilities', 'has_security', 'has_electricity']
+CATEGORY_COLUMNS = ['district', 'publish_date', 'house_type', 'property_category', 'property_type',
+                    'commercial_purpose', 'purpose']
+TEXT_COLUMNS = ['id', 'address', 'url']
+
+# Типы колонок при чтении CSV кусками: без вывода типов по файлу, целые с пропусками - float
+CSV_DTYPES = {
+    **dict.fromkeys(INT_COLUMNS + FLOAT_COLUMNS, 'float64'),
+    **dict.fromkeys(BOOL_COLUMNS, 'boolean'),
+    **dict.fromkeys(CATEGORY_COLUMNS, 'category'),
+    **dict.fromkeys(TEXT_COLUMNS, 'str')
+}
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("Для parquet нужен pyarrow: pip install pyarrow")
+
+def is_parquet_path(path):
+    return path.endswith('.parquet') or os.path.isdir(path)
+
+def to_storage_frame(df):
+    """Приведение колонок к типам хранения: nullable Int64/boolean, category для справочных строк"""
+    df = df.copy()
+    for column in INT_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce').round().astype('Int64')
+    for column in FLOAT_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+    for column in BOOL_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.BooleanDtype):
+            text = df[column].astype(str).str.lower()
+            values = pd.Series(pd.NA, index=df.index, dtype='boolean')
+            values[text == 'true'] = True
+            values[text == 'false'] = False
+            df[column] = values
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    for column in TEXT_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('string')
+    return df
+
+def write_parquet_chunk(df, root=PARQUET_DATASET, chunk_index=0):
+    """Дописывает кусок датасета в партиционированный parquet (файл part-<chunk>-N в каждой партиции)"""
+    _require_pyarrow()
+    table = pa.Table.from_pandas(to_storage_frame(df), preserve_index=False)
+    pq.write_to_dataset(
+        table, root,
+        partition_cols=PARTITION_COLUMNS,
+        basename_template=f"part-{chunk_index:05d}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+        use_dictionary=True,
+        compression='zstd'
+    )
+
+def save_parquet_dataset(df, root=PARQUET_DATASET):
+    """Полная перезапись колоночной копии датасета"""
+    _require_pyarrow()
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+    write_parquet_chunk(df, root)
+
+def read_dataset(path, columns=None, categories=None, districts=None):
+    """Чтение датасета из CSV или parquet.
+
+    Для parquet читаются только нужные колонки (columns), а фильтры по
+    categories/districts отсекают целые партиции без чтения файлов.
+    """
+    if not is_parquet_path(path):
+        usecols = None if columns is None else list(dict.fromkeys(list(columns) + PARTITION_COLUMNS))
+        df = pd.read_csv(path, encoding='utf-8', usecols=usecols, low_memory=False)
+        if categories is not None:
+            df = df[df['property_category'].isin(categories)]
+        if districts is not None:
+            df = df[df['district'].isin(districts)]
+        if columns is not None:
+            df = df[list(columns)]
+        return df.reset_index(drop=True)
+
+    _require_pyarrow()
+    filters = []
+    if categories is not None:
+        filters.append(('property_category', 'in', list(categories)))
+    if districts is not None:
+        filters.append(('district', 'in', list(districts)))
+    return pd.read_parquet(path, engine='pyarrow', columns=columns, filters=filters or None)
+
+def iter_dataset_chunks(path, chunk_rows, columns=None):
+    """Чтение датасета кусками по chunk_rows строк (в памяти - один кусок).
+
+    CSV разбирается C-парсером с явными типами CSV_DTYPES, parquet читается
+    пачками записей pyarrow. columns - нужные колонки; отсутствующие в
+    источнике пропускаются.
+    """
+    if not is_parquet_path(path):
+        usecols = None if columns is None else (lambda column: column in columns)
+        yield from pd.read_csv(path, encoding='utf-8', usecols=usecols, dtype=CSV_DTYPES, chunksize=chunk_rows)
+        return
+
+    _require_pyarrow()
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    names = None if columns is None else [name for name in dataset.schema.names if name in columns]
+    # Файлы партиций мелкие: пачки копим до chunk_rows строк
+    batches, rows = [], 0
+    for batch in dataset.to_batches(columns=names, batch_size=chunk_rows):
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= chunk_rows:
+            yield pa.Table.from_batches(batches).to_pandas()
+            batches, rows = [], 0
+    if batches:
+        yield pa.Table.from_batches(batches).to_pandas()
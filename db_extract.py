@@ -0,0 +1,244 @@
+import argparse
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from dataset_storage import write_parquet_chunk
+from db_loader import get_dimension_manager, pooled_connection
+
+# Колонки датасета (как у avito_parser) -> выражения над fact_real_estate; ключи справочников
+# декодируются по кэшу DimensionManager, булевы и числовые колонки приводятся на сервере
+# к типам, которые быстро разбираются из CSV
+EXTRACT_COLUMNS = {
+    'id': 'external_id',
+    'district': 'district_id',
+    'publish_date': 'date_id',
+    'property_type': 'property_type_id',
+    'house_type': 'house_type_id',
+    'price': 'price::float8',
+    'area': 'area::float8',
+    'price_per_sqm': 'price_per_sqm::float8',
+    'rooms': 'rooms',
+    'floor': 'floor',
+    'total_floors': 'total_floors',
+    'year_built': 'year_built',
+    'ceiling_height': 'ceiling_height::float8',
+    'has_ventilation': 'has_ventilation::int',
+    'has_air_conditioning': 'has_air_conditioning::int',
+    'parking_spaces': 'parking_spaces',
+    'land_area': 'land_area::float8',
+    'metro_time': 'metro_time',
+    'has_elevator': 'has_elevator::int',
+    'is_renovated': 'is_renovated::int',
+    'address': 'address',
+    'url': 'url'
+}
+
+# Колонка датасета -> справочник DimensionManager для декодирования ключа
+DECODED_COLUMNS = {'district': 'districts', 'property_type': 'property_types',
+                   'house_type': 'house_types', 'publish_date': 'dates'}
+INT_COLUMNS = ['rooms', 'floor', 'total_floors', 'year_built', 'parking_spaces', 'metro_time']
+BOOL_COLUMNS = ['has_ventilation', 'has_air_conditioning', 'has_elevator', 'is_renovated']
+TEXT_COLUMNS = ['id', 'address', 'url']
+
+# Строк в одном куске выгрузки и размер блока чтения COPY
+EXTRACT_CHUNK_ROWS = 500000
+COPY_BUFFER_BYTES = 1 << 20
+
+def build_extract_query(cursor, columns, date_from=None, date_to=None, districts=None, property_types=None,
+                        maps=None):
+    """SELECT для COPY: только нужные колонки, фильтры по created_date (отсекают секции)
+    и по ключам справочников. Параметры подставляются mogrify (COPY не принимает параметры)"""
+    select = [EXTRACT_COLUMNS[column] for column in columns]
+    conditions, params = [], []
+    if date_from is not None:
+        conditions.append("created_date >= %s")
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append("created_date < %s")
+        params.append(date_to)
+    if districts is not None:
+        conditions.append("district_id = ANY(%s)")
+        params.append([maps['districts'][name] for name in districts if name in maps['districts']])
+    if property_types is not None:
+        conditions.append("property_type_id = ANY(%s)")
+        params.append([maps['property_types'][name] for name in property_types if name in maps['property_types']])
+    query = f"SELECT {', '.join(select)} FROM fact_real_estate"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return cursor.mogrify(query, params).decode('utf-8')
+
+def _lookup(mapping, decode=None):
+    """Категории справочника и таблица id -> код категории (ключи id - небольшие целые)"""
+    names = sorted(mapping, key=mapping.get)
+    ids = np.array([mapping[name] for name in names], dtype=np.int64)
+    codes = np.full(int(ids.max(initial=0)) + 2, -1, dtype=np.int32)
+    codes[ids] = np.arange(len(ids), dtype=np.int32)
+    categories = pd.Index([decode(name) for name in names] if decode else names)
+    return categories, codes
+
+def _decode(ids, categories, codes):
+    """Ключи справочника -> категориальная колонка (неизвестный ключ и NULL - пропуск)"""
+    ids = np.asarray(pd.to_numeric(ids, errors='coerce'), dtype=float)
+    known = ~np.isnan(ids) & (ids >= 0) & (ids < len(codes))
+    positions = np.full(len(ids), -1, dtype=np.int32)
+    positions[known] = codes[ids[known].astype(np.int64)]
+    return pd.Categorical.from_codes(positions, categories)
+
+def _copy_stream(conn, query):
+    """COPY (query) TO STDOUT в фоновом потоке, чтение - из канала по мере поступления.
+    Память ограничена буфером канала и одним куском разбора"""
+    read_fd, write_fd = os.pipe()
+    reader, writer = os.fdopen(read_fd, 'rb'), os.fdopen(write_fd, 'wb')
+    errors = []
+
+    def copy():
+        cursor = conn.cursor()
+        try:
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", writer,
+                               size=COPY_BUFFER_BYTES)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            cursor.close()
+            try:
+                writer.close()
+            except OSError:
+                pass
+
+    thread = threading.Thread(target=copy, daemon=True)
+    thread.start()
+    return reader, thread, errors
+
+def iter_extract(columns=None, date_from=None, date_to=None, districts=None, property_types=None,
+                 chunk_rows=EXTRACT_CHUNK_ROWS):
+    """Выгрузка фактов кусками по chunk_rows строк (DataFrame в колонках датасета).
+
+    Данные идут одним COPY ... TO STDOUT (CSV) и разбираются C-парсером
+    pandas по мере поступления; ключи справочников декодируются в
+    категориальные колонки по кэшу DimensionManager без JOIN в запросе,
+    property_category берется из dim_property_types.
+    """
+    columns = list(EXTRACT_COLUMNS) + ['property_category'] if columns is None else list(columns)
+    with_category = 'property_category' in columns
+    columns = [column for column in columns if column != 'property_category']
+    if with_category and 'property_type' not in columns:
+        columns.append('property_type')
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        dimensions = get_dimension_manager()
+        dimensions.refresh(cursor)
+        dimensions.save()
+        maps = dimensions.maps
+        lookups = {column: _lookup(maps[name], pd.Timestamp if name == 'dates' else None)
+                   for column, name in DECODED_COLUMNS.items() if column in columns}
+        if with_category:
+            cursor.execute("SELECT property_type_name, property_category FROM dim_property_types")
+            type_categories = dict(cursor.fetchall())
+        query = build_extract_query(cursor, columns, date_from, date_to, districts, property_types, maps)
+        conn.commit()
+        cursor.close()
+
+        dtypes = {column: 'string' if column in TEXT_COLUMNS else 'float64' for column in columns}
+        reader, thread, errors = _copy_stream(conn, query)
+        completed = False
+        try:
+            try:
+                chunks = pd.read_csv(reader, chunksize=chunk_rows, names=columns, header=0, dtype=dtypes)
+            except pd.errors.EmptyDataError:
+                # COPY не начался (ошибка запроса) - причина в errors
+                chunks = []
+            for chunk in chunks:
+                for column, (categories, codes) in lookups.items():
+                    chunk[column] = _decode(chunk[column], categories, codes)
+                for column in INT_COLUMNS:
+                    if column in chunk.columns:
+                        chunk[column] = chunk[column].astype('Int64')
+                for column in BOOL_COLUMNS:
+                    if column in chunk.columns:
+                        chunk[column] = chunk[column].astype('Int8').astype('boolean')
+                if with_category:
+                    chunk['property_category'] = chunk['property_type'].map(type_categories).astype('category')
+                yield chunk
+            completed = True
+        finally:
+            # Потребитель остановился раньше: запрос на сервере отменяем, COPY прерывается
+            if thread.is_alive():
+                conn.cancel()
+            reader.close()
+            thread.join()
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                conn.close()
+        if completed and errors:
+            raise errors[0]
+
+def extract_frame(columns=None, date_from=None, date_to=None, districts=None, property_types=None,
+                  chunk_rows=EXTRACT_CHUNK_ROWS):
+    """Выгрузка фактов одним DataFrame (категории кусков объединяются)"""
+    chunks = list(iter_extract(columns, date_from, date_to, districts, property_types, chunk_rows))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+def extract_to_parquet(path, columns=None, date_from=None, date_to=None, districts=None, property_types=None,
+                       chunk_rows=EXTRACT_CHUNK_ROWS):
+    """Потоковая выгрузка в parquet-каталог с партициями как у колоночной копии датасета
+    (читается read_dataset, DatasetCube и ComparablesIndex). Возвращает число строк"""
+    columns = list(EXTRACT_COLUMNS) + ['property_category'] if columns is None else list(columns)
+    # Партиции требуют категорию и район
+    columns += [column for column in ('property_category', 'district') if column not in columns]
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    total = 0
+    for chunk_index, chunk in enumerate(iter_extract(columns, date_from, date_to, districts, property_types,
+                                                     chunk_rows)):
+        write_parquet_chunk(chunk, path, chunk_index)
+        total += len(chunk)
+        print(f"Выгружено {total:,} записей")
+    return total
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Выгрузка таблицы фактов через COPY TO STDOUT")
+    parser.add_argument('--output', default='fact_real_estate_extract.parquet',
+                        help="parquet-каталог (партиции property_category/district) или .csv-файл")
+    parser.add_argument('--columns', nargs='*', default=None,
+                        help=f"колонки выгрузки (по умолчанию все): {', '.join(EXTRACT_COLUMNS)}, property_category")
+    parser.add_argument('--date-from', type=_parse_date, default=None, help="created_date от (ГГГГ-ММ-ДД)")
+    parser.add_argument('--date-to', type=_parse_date, default=None, help="created_date до, не включая (ГГГГ-ММ-ДД)")
+    parser.add_argument('--district', nargs='*', default=None, help="районы")
+    parser.add_argument('--property-type', nargs='*', default=None, help="типы недвижимости")
+    parser.add_argument('--chunk-rows', type=int, default=EXTRACT_CHUNK_ROWS, help="строк в куске выгрузки")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+    if args.output.endswith('.csv'):
+        total = 0
+        for chunk in iter_extract(args.columns, args.date_from, args.date_to, args.district, args.property_type,
+                                  args.chunk_rows):
+            chunk.to_csv(args.output, mode='w' if total == 0 else 'a', header=total == 0, index=False,
+                         encoding='utf-8')
+            total += len(chunk)
+            print(f"Выгружено {total:,} записей")
+    else:
+        total = extract_to_parquet(args.output, args.columns, args.date_from, args.date_to, args.district,
+                                   args.property_type, args.chunk_rows)
+    elapsed = time.perf_counter() - started
+    print(f"Выгрузка в {args.output}: {total:,} записей за {elapsed:.2f} с "
+          f"({total / elapsed if elapsed else 0:,.0f} строк/с)")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,32 @@
 import pandas as pd
 import psycopg2
 from psycopg2.extras import execute_batch
+from psycopg2.pool import ThreadedConnectionPool
 from datetime import datetime
 import numpy as np
+import argparse
+import io
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from comparables import COMPARABLES_FILE, LISTING_COLUMNS, ComparablesIndex
+from data_validation import IntegrityValidator
+from deduplication import find_duplicates, save_duplicate_links
+from dataset_storage import is_parquet_path, iter_dataset_chunks, read_dataset
+from dimension_manager import DimensionManager
+from etl_metrics import METRICS_FILE, PipelineMetrics, path_size, record_round_trip
+from load_journal import (MAX_RETRIES, RETRY_BACKOFF_SECONDS, TRANSIENT_ERRORS, record_checkpoint, record_completed,
+                          record_failure, retry_delay, source_fingerprint, start_or_resume_load)
+from price_index import PRICE_INDEX_FILE, PriceIndex
+from query_cache import bump_load_generation, database_key, read_load_generation
+from sketches import GroupSketches
 
 # Конфигурация подключения к БД
 DB_CONFIG = {
@@ -13,164 +37,1274 @@ DB_CONFIG = {
     'port': '5432'
 }
 
-def load_csv_to_db(csv_file='comprehensive_real_estate_dataset.csv'):
-    """Загружает данные из CSV в базу данных"""
+# Колонки fact_real_estate в порядке кортежей, которые готовит load_csv_to_db
+FACT_COLUMNS = [
+    'district_id', 'date_id', 'property_type_id', 'house_type_id', 'commercial_purpose_id',
+    'price', 'area', 'price_per_sqm', 'rooms', 'floor', 'total_floors', 'year_built',
+    'ceiling_height', 'has_ventilation', 'has_air_conditioning', 'parking_spaces', 'land_area',
+    'metro_time', 'has_elevator', 'is_renovated', 'data_source', 'external_id', 'address', 'url', 'created_date'
+]
+
+# Колонки, которые upsert перезаписывает в существующей строке (все, кроме ключа
+# конфликта); строка обновляется, только если хотя бы одна из них изменилась
+UPSERT_COLUMNS = [column for column in FACT_COLUMNS if column not in ('external_id', 'created_date')]
+UPSERT_SET_CLAUSE = f"""
+    ON CONFLICT (external_id, created_date) DO UPDATE SET
+        ({', '.join(UPSERT_COLUMNS)}) = ROW({', '.join(f'EXCLUDED.{column}' for column in UPSERT_COLUMNS)}),
+        updated_date = CURRENT_TIMESTAMP
+    WHERE ({', '.join(f'fact_real_estate.{column}' for column in UPSERT_COLUMNS)})
+        IS DISTINCT FROM ({', '.join(f'EXCLUDED.{column}' for column in UPSERT_COLUMNS)})
+"""
+
+# Колонки ключей объявления для claim_external_ids (позиции в кортежах frame_to_rows)
+KEY_COLUMNS = ['external_id', 'created_date', 'district_id', 'property_type_id']
+KEY_POSITIONS = [FACT_COLUMNS.index(column) for column in KEY_COLUMNS]
+
+# Промежуточная таблица для COPY (UNLOGGED - без записи в WAL)
+STAGING_TABLE = 'stg_fact_real_estate'
+
+# Текущая дата публикации каждого объявления: уникальный индекс секционированной
+# fact_real_estate обязан содержать created_date, поэтому уникальность external_id
+# по всей таблице держится на этой таблице ключей
+EXTERNAL_KEYS_TABLE = 'fact_external_keys'
+
+# Группы агрегатов, из которых перенесены объявления (пересчитываются в post_load)
+MOVED_GROUPS_TABLE = 'etl_moved_fact_groups'
+
+# Источник ключей пачки execute_batch для claim_external_ids (колонки KEY_COLUMNS)
+UNNEST_KEYS_SOURCE = ("unnest(%s::text[], %s::date[], %s::int[], %s::int[]) "
+                      "AS keys(external_id, created_date, district_id, property_type_id)")
+
+# Стадии загрузки (имена для метрик и --profile-stage)
+LOAD_STAGES = ('extract', 'dimensions', 'validate_source', 'deduplicate', 'transform', 'validate_facts',
+               'incremental_diff', 'insert', 'pipeline', 'post_load', 'sketches', 'comparables', 'price_index',
+               'statistics')
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Курсор, считающий обращения к БД (execute_batch - по одному на страницу) для метрик стадий"""
+
+    def execute(self, query, vars=None):
+        record_round_trip()
+        return super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        record_round_trip()
+        return super().copy_expert(sql, file, size)
+
+# Пул соединений, общий для проверки подключения, справочников и загрузчиков
+POOL_MAX_CONNECTIONS = 8
+_connection_pool = None
+
+def get_connection_pool():
+    """Ленивое создание пула соединений с БД"""
+    global _connection_pool
+    if _connection_pool is None:
+        _connection_pool = ThreadedConnectionPool(1, POOL_MAX_CONNECTIONS, cursor_factory=CountingCursor, **DB_CONFIG)
+    return _connection_pool
+
+def close_connection_pool():
+    global _connection_pool
+    if _connection_pool is not None:
+        _connection_pool.closeall()
+        _connection_pool = None
+
+_dimension_manager = None
+
+def get_dimension_manager():
+    """Общий для всех загрузок кэш справочников (живет весь процесс и между запусками)"""
+    global _dimension_manager
+    if _dimension_manager is None:
+        database_key = f"{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
+        _dimension_manager = DimensionManager(database_key)
+    return _dimension_manager
+
+@contextmanager
+def pooled_connection():
+    """Соединение из пула; при ошибке незавершенная транзакция откатывается"""
+    pool = get_connection_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+# SQL запрос для построчной вставки
+INSERT_QUERY = """
+    INSERT INTO fact_real_estate (
+        district_id, date_id, property_type_id, house_type_id, commercial_purpose_id,
+        price, area, price_per_sqm, rooms, floor, total_floors, year_built,
+        ceiling_height, has_ventilation, has_air_conditioning, parking_spaces, land_area,
+        metro_time, has_elevator, is_renovated, data_source, external_id, address, url, created_date
+    ) VALUES (
+        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+    )
+""" + UPSERT_SET_CLAUSE
+
+def ensure_staging_table(cursor, staging_table=STAGING_TABLE):
+    cursor.execute(f"""
+        CREATE UNLOGGED TABLE IF NOT EXISTS {staging_table} AS
+        SELECT {', '.join(FACT_COLUMNS)} FROM fact_real_estate WITH NO DATA
+    """)
+
+def ensure_fact_key_objects(cursor):
+    """Таблицы ключей объявлений и перенесенных групп (для баз, созданных до их
+    появления в скрипте восстановления). Новая таблица ключей заполняется по
+    fact_real_estate: при повторах external_id ключом становится последняя дата,
+    прежние строки удалит следующая загрузка объявления"""
+    cursor.execute("SELECT to_regclass(%s) IS NULL", (EXTERNAL_KEYS_TABLE,))
+    created = cursor.fetchone()[0]
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {EXTERNAL_KEYS_TABLE} (
+            external_id VARCHAR(100) PRIMARY KEY,
+            created_date DATE NOT NULL
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MOVED_GROUPS_TABLE} (
+            district_id INTEGER NOT NULL,
+            property_type_id INTEGER NOT NULL,
+            date_id INTEGER NOT NULL,
+            created_date DATE NOT NULL
+        )
+    """)
+    if created:
+        cursor.execute(f"""
+            INSERT INTO {EXTERNAL_KEYS_TABLE} (external_id, created_date)
+            SELECT DISTINCT ON (external_id) external_id, created_date
+            FROM fact_real_estate
+            WHERE external_id IS NOT NULL
+            ORDER BY external_id, created_date DESC
+            ON CONFLICT (external_id) DO NOTHING
+        """)
+
+def ensure_bulk_load_objects(cursor, staging_table=STAGING_TABLE):
+    """Создает staging-таблицу, таблицы ключей и уникальный индекс (external_id, created_date),
+    нужный для ON CONFLICT.
     
-    print("Загрузка данных из CSV...")
-    df = pd.read_csv(csv_file, encoding='utf-8')
-    df['publish_date'] = pd.to_datetime(df['publish_date'])
-    print(f"Загружено {len(df)} строк")
+    created_date входит в индекс, потому что в секционированной таблице
+    уникальный индекс обязан содержать ключ секционирования.
+    """
+    ensure_staging_table(cursor, staging_table)
+    ensure_fact_key_objects(cursor)
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_fact_external_id
+        ON fact_real_estate(external_id, created_date)
+    """)
+
+def claim_external_ids(cursor, source, params=()):
+    """Закрепляет за объявлениями source (external_id, created_date) их дату публикации.
+    
+    Upsert в EXTERNAL_KEYS_TABLE блокирует ключи до commit (ON CONFLICT DO
+    UPDATE блокирует строку и при невыполненном WHERE), поэтому загрузки
+    одного объявления в параллельных транзакциях идут по очереди. Затем
+    отдельным запросом (он видит строки, зафиксированные за время ожидания)
+    из fact_real_estate удаляются строки этих объявлений с другой датой или
+    группой (район, тип) - upsert вставит их заново, а прежние группы
+    ставятся в очередь пересчета агрегатов. Из повторов external_id в source
+    остается строка с последней датой, как в merge_staging_into_fact.
+    """
+    cursor.execute(f"""
+        INSERT INTO {EXTERNAL_KEYS_TABLE} AS k (external_id, created_date)
+        SELECT DISTINCT ON (external_id) external_id, created_date
+        FROM {source}
+        WHERE external_id IS NOT NULL
+        ORDER BY external_id, created_date DESC
+        ON CONFLICT (external_id) DO UPDATE SET created_date = EXCLUDED.created_date
+        WHERE k.created_date <> EXCLUDED.created_date
+    """, params)
+    cursor.execute(f"""
+        WITH latest AS (
+            SELECT DISTINCT ON (external_id) {', '.join(KEY_COLUMNS)}
+            FROM {source}
+            WHERE external_id IS NOT NULL
+            ORDER BY external_id, created_date DESC
+        ), moved AS (
+            DELETE FROM fact_real_estate f
+            USING latest s
+            WHERE f.external_id = s.external_id
+              AND (f.created_date, f.district_id, f.property_type_id)
+                  IS DISTINCT FROM (s.created_date, s.district_id, s.property_type_id)
+            RETURNING f.district_id, f.property_type_id, f.date_id, f.created_date
+        )
+        INSERT INTO {MOVED_GROUPS_TABLE} (district_id, property_type_id, date_id, created_date)
+        SELECT DISTINCT district_id, property_type_id, date_id, created_date FROM moved
+    """, params)
+
+def upsert_rows(cursor, rows):
+    """Построчный upsert пачки (кортежи frame_to_rows) через execute_batch"""
+    claim_external_ids(cursor, UNNEST_KEYS_SOURCE, [[row[position] for row in rows] for position in KEY_POSITIONS])
+    execute_batch(cursor, INSERT_QUERY, rows)
+
+def rows_to_copy_buffer(facts):
+    """Сериализует подготовленные строки фактов в CSV для COPY (NULL - пустое поле)"""
+    buffer = io.StringIO()
+    facts.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    return buffer
+
+def merge_staging_into_fact(cursor, staging_table=STAGING_TABLE):
+    """Один set-based upsert из staging в fact_real_estate: измененная строка
+    перезаписывается целиком (UPSERT_SET_CLAUSE), объявление с новой датой
+    публикации или группой заменяет свою прежнюю строку (claim_external_ids)"""
+    columns = ', '.join(FACT_COLUMNS)
+    claim_external_ids(cursor, staging_table)
+    cursor.execute(f"""
+        INSERT INTO fact_real_estate ({columns})
+        SELECT DISTINCT ON (external_id) {columns}
+        FROM {staging_table}
+        ORDER BY external_id, created_date DESC
+        {UPSERT_SET_CLAUSE}
+    """)
+    merged = cursor.rowcount
+    cursor.execute(f"TRUNCATE {staging_table}")
+    return merged
+
+def bulk_load_rows(conn, facts, commit_rows=None, staging_table=STAGING_TABLE, prepare=True):
+    """Загрузка через COPY FROM STDIN в staging и слияние в fact_real_estate.
     
-    # Подключаемся к БД
-    conn = psycopg2.connect(**DB_CONFIG)
+    commit_rows задает размер транзакции: None - вся загрузка одной транзакцией,
+    иначе COPY + слияние + commit на каждые commit_rows строк.
+    prepare=False - общие объекты (индекс fact_real_estate) уже созданы
+    вызывающим, создается только staging-таблица: CREATE INDEX берет
+    ShareLock на fact_real_estate, и параллельные потоки, держащие его до
+    commit, взаимно блокировали бы слияние друг друга.
+    """
     cursor = conn.cursor()
-    print("Подключено к базе данных")
+    if prepare:
+        ensure_bulk_load_objects(cursor, staging_table)
+    else:
+        ensure_staging_table(cursor, staging_table)
+    # DDL фиксируем отдельно, чтобы блокировки не держались до конца загрузки
+    conn.commit()
+    cursor.execute(f"TRUNCATE {staging_table}")
+    copy_sql = f"COPY {staging_table} ({', '.join(FACT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
     
-    # Загружаем справочники
-    print("Загрузка справочников...")
+    started = time.perf_counter()
+    step = commit_rows or len(facts) or 1
+    loaded = 0
+    for i in range(0, len(facts), step):
+        batch = facts.iloc[i:i + step]
+        cursor.copy_expert(copy_sql, rows_to_copy_buffer(batch))
+        merge_staging_into_fact(cursor, staging_table)
+        conn.commit()
+        loaded += len(batch)
+        elapsed = time.perf_counter() - started
+        print(f"Загружено {loaded} из {len(facts)} записей ({loaded / elapsed if elapsed else 0:,.0f} строк/с)")
     
-    # Районы
-    cursor.execute("SELECT district_name, district_id FROM dim_districts")
-    districts = {name: id for name, id in cursor.fetchall()}
+    elapsed = time.perf_counter() - started
+    print(f"COPY-загрузка: {loaded} записей за {elapsed:.2f} с ({loaded / elapsed if elapsed else 0:,.0f} строк/с)")
+    cursor.close()
+    return loaded
+
+def batch_load_rows(conn, facts, batch_size=100):
+    """Построчный upsert через execute_batch с commit после каждой пачки"""
+    cursor = conn.cursor()
+    data_to_insert = frame_to_rows(facts)
+    for i in range(0, len(data_to_insert), batch_size):
+        batch = data_to_insert[i:i + batch_size]
+        upsert_rows(cursor, batch)
+        conn.commit()
+        print(f"Вставлено {i + len(batch)} из {len(data_to_insert)} записей")
+    cursor.close()
+    return len(data_to_insert)
+
+# Размер пачки (и транзакции) в режиме загрузки с контрольными точками
+CHECKPOINT_ROWS = 10000
+
+def checkpointed_load_rows(facts, load_id, offset=0, batch_rows=CHECKPOINT_ROWS, bulk=False,
+                           max_retries=MAX_RETRIES, retry_backoff=RETRY_BACKOFF_SECONDS):
+    """Загрузка пачками с контрольной точкой в etl_load_journal после каждой.
     
-    # Типы недвижимости
-    cursor.execute("SELECT property_type_name, property_type_id FROM dim_property_types")
-    property_types = {name: id for name, id in cursor.fetchall()}
+    Пачка (COPY + слияние при bulk=True, иначе execute_batch) и новая позиция
+    в журнале фиксируются одной транзакцией, поэтому после падения загрузка
+    продолжается с offset = committed_rows без потерь и повторов. Обрыв
+    соединения или конфликт транзакций (TRANSIENT_ERRORS) повторяет только
+    текущую пачку на новом соединении с растущей задержкой; после max_retries
+    неудач или при другой ошибке загрузка помечается failed и ошибка
+    выбрасывается дальше. Возвращает число загруженных строк.
+    """
+    pool = get_connection_pool()
+    copy_sql = f"COPY {STAGING_TABLE} ({', '.join(FACT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    if offset:
+        print(f"Продолжение загрузки {load_id} с записи {offset} из {len(facts)}")
     
-    # Типы домов
-    cursor.execute("SELECT house_type_name, house_type_id FROM dim_house_types")
-    house_types = {name: id for name, id in cursor.fetchall()}
+    started = time.perf_counter()
+    resumed_from, conn, prepared = offset, None, False
+    try:
+        while offset < len(facts):
+            batch = facts.iloc[offset:offset + batch_rows]
+            attempt = 0
+            while True:
+                try:
+                    if conn is None:
+                        conn = pool.getconn()
+                        cursor = conn.cursor()
+                    if bulk and not prepared:
+                        ensure_bulk_load_objects(cursor)
+                        conn.commit()
+                        prepared = True
+                    if bulk:
+                        cursor.execute(f"TRUNCATE {STAGING_TABLE}")
+                        cursor.copy_expert(copy_sql, rows_to_copy_buffer(batch))
+                        merge_staging_into_fact(cursor)
+                    else:
+                        upsert_rows(cursor, frame_to_rows(batch))
+                    record_checkpoint(cursor, load_id, offset + len(batch), attempt)
+                    conn.commit()
+                    break
+                except TRANSIENT_ERRORS as e:
+                    attempt += 1
+                    if conn is not None:
+                        # Соединение после обрыва не переиспользуем
+                        pool.putconn(conn, close=True)
+                        conn = None
+                    if attempt > max_retries:
+                        raise
+                    delay = retry_delay(attempt, retry_backoff)
+                    print(f"Пачка с записи {offset}: {str(e).strip()}; повтор {attempt} из {max_retries} через {delay:.1f} с")
+                    time.sleep(delay)
+            offset += len(batch)
+            elapsed = time.perf_counter() - started
+            print(f"Загружено {offset} из {len(facts)} записей, контрольная точка сохранена "
+                  f"({(offset - resumed_from) / elapsed if elapsed else 0:,.0f} строк/с)")
+    except Exception as e:
+        if conn is not None:
+            conn.rollback()
+        # Отметка о неудаче - на отдельном соединении: текущее может быть разорвано
+        try:
+            with pooled_connection() as journal_conn:
+                journal_cursor = journal_conn.cursor()
+                record_failure(journal_cursor, load_id, e)
+                journal_conn.commit()
+                journal_cursor.close()
+        except TRANSIENT_ERRORS:
+            pass
+        print(f"Загрузка {load_id} остановлена на записи {offset}, повторный запуск продолжит с нее")
+        raise
+    finally:
+        if conn is not None:
+            cursor.close()
+            pool.putconn(conn)
+    return offset - resumed_from
+
+def month_starts(dates):
+    """Первое число месяца для каждой даты (ключ секции fact_real_estate)"""
+    return pd.to_datetime(dates).dt.to_period('M').dt.to_timestamp().dt.date
+
+def partition_table_name(month):
+    """Имя секции месяца, как в fact_partition_name() скрипта восстановления БД"""
+    return f"fact_real_estate_y{month:%Y}m{month:%m}"
+
+def is_fact_partitioned(cursor):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = 'fact_real_estate'::regclass")
+    return cursor.fetchone()[0]
+
+def missing_month_partitions(cursor, months):
+    """Месяцы из списка, для которых еще нет секции"""
+    cursor.execute("""
+        SELECT month FROM unnest(%s::date[]) AS month
+        WHERE to_regclass(fact_partition_name(month)) IS NULL
+        ORDER BY month
+    """, (list(months),))
+    return [month for month, in cursor.fetchall()]
+
+def ensure_month_partitions(cursor, dates):
+    """Создает секции fact_real_estate для всех месяцев в dates. Возвращает созданные месяцы"""
+    missing = missing_month_partitions(cursor, sorted(set(month_starts(dates))))
+    for month in missing:
+        cursor.execute("SELECT ensure_fact_partition(%s)", (month,))
+    return missing
+
+def load_new_month_partition(cursor, month, facts):
+    """Загрузка целого месяца в отдельную таблицу и подключение ее секцией.
     
-    # Даты
-    cursor.execute("SELECT full_date, date_id FROM dim_time")
-    dates = {date: id for date, id in cursor.fetchall()}
+    Строки пишутся COPY в таблицу без индексов, CHECK по диапазону дат
+    позволяет ATTACH PARTITION обойтись без полной проверки, а индексы
+    секции строятся один раз при подключении.
+    """
+    name = partition_table_name(month)
+    next_month = (pd.Timestamp(month) + pd.offsets.MonthBegin()).date()
+    cursor.execute(f"CREATE TABLE {name} (LIKE fact_real_estate INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(f"ALTER TABLE {name} ADD CONSTRAINT {name}_range CHECK (created_date >= %s AND created_date < %s)",
+                   (month, next_month))
     
-    # Подготавливаем данные для вставки
-    data_to_insert = []
+    # Как и merge_staging_into_fact, оставляем одну строку на external_id (с последней датой),
+    # прежние строки объявлений в других месяцах удаляются
+    facts = facts.sort_values('created_date', kind='stable').drop_duplicates('external_id', keep='last')
+    claim_external_ids(cursor, UNNEST_KEYS_SOURCE, (
+        facts['external_id'].tolist(), pd.to_datetime(facts['created_date']).dt.date.tolist(),
+        facts['district_id'].tolist(), facts['property_type_id'].tolist()
+    ))
+    copy_sql = f"COPY {name} ({', '.join(FACT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    cursor.copy_expert(copy_sql, rows_to_copy_buffer(facts))
     
-    for _, row in df.iterrows():
-        # Получаем ID справочников
-        district_id = districts.get(row['district'])
-        property_type_id = property_types.get(row['property_type'])
+    cursor.execute(f"ALTER TABLE fact_real_estate ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+                   (month, next_month))
+    cursor.execute(f"ALTER TABLE {name} DROP CONSTRAINT {name}_range")
+    return len(facts)
+
+def partitioned_bulk_load(conn, facts, commit_rows=None):
+    """Загрузка с учетом секций: месяцы без секции грузятся целиком и
+    подключаются через ATTACH PARTITION (каждый своей транзакцией),
+    строки существующих месяцев идут обычным COPY + слиянием.
+    """
+    cursor = conn.cursor()
+    months = month_starts(facts['created_date'])
+    missing = missing_month_partitions(cursor, sorted(set(months)))
+    is_new_month = months.isin(missing).to_numpy()
+    
+    loaded = 0
+    for month, rows in facts[is_new_month].groupby(months[is_new_month].to_numpy(), sort=True):
+        started = time.perf_counter()
+        count = load_new_month_partition(cursor, month, rows)
+        conn.commit()
+        loaded += count
+        print(f"Секция {partition_table_name(month)}: {count} записей подключено за {time.perf_counter() - started:.2f} с")
+    cursor.close()
+    
+    if not is_new_month.all():
+        loaded += bulk_load_rows(conn, facts[~is_new_month], commit_rows)
+    return loaded
+
+def detach_old_partitions(cursor, before, archive_schema=None):
+    """Отсоединяет секции месяцев раньше before (с переносом в archive_schema, если задана)"""
+    cursor.execute("SELECT detach_fact_partitions(%s, %s)", (before, archive_schema))
+    return [name for name, in cursor.fetchall()]
+
+_worker_slots = threading.local()
+_worker_slot_counter = itertools.count()
+
+def _load_partition(key, partition, bulk, commit_rows):
+    """Загрузка одной партиции на своем соединении из пула; ошибка не прерывает остальные"""
+    if not hasattr(_worker_slots, 'slot'):
+        _worker_slots.slot = next(_worker_slot_counter)
+    try:
+        with pooled_connection() as conn:
+            if bulk:
+                # У каждого потока своя staging-таблица; индекс создан в load_partitions_parallel
+                loaded = bulk_load_rows(conn, partition, commit_rows, f"{STAGING_TABLE}_{_worker_slots.slot}",
+                                        prepare=False)
+            else:
+                loaded = batch_load_rows(conn, partition)
+        return key, loaded, None
+    except Exception as e:
+        return key, 0, e
+
+def load_partitions_parallel(conn, facts, partition_by='district_id', workers=4, bulk=False, commit_rows=None):
+    """Параллельная загрузка: строки делятся по partition_by (district_id или date_id)
+    и грузятся одновременно на нескольких соединениях пула.
+    
+    Ошибка в партиции откатывает только ее транзакцию; после завершения
+    остальных партиций выбрасывается исключение со списком неудачных.
+    """
+    # Общие объекты создаем заранее, чтобы потоки не гонялись за DDL
+    if bulk:
+        cursor = conn.cursor()
+        ensure_bulk_load_objects(cursor)
+        conn.commit()
+        cursor.close()
+    
+    workers = max(1, min(workers, POOL_MAX_CONNECTIONS - 1))
+    partitions = [(key, part) for key, part in facts.groupby(partition_by, sort=True)]
+    print(f"Параллельная загрузка: {len(partitions)} партиций по {partition_by}, потоков: {workers}")
+    
+    started = time.perf_counter()
+    loaded, failed = 0, []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_load_partition, key, part, bulk, commit_rows) for key, part in partitions]
+        for future in as_completed(futures):
+            key, count, error = future.result()
+            if error is None:
+                loaded += count
+                print(f"Партиция {partition_by}={key}: загружено {count} записей")
+            else:
+                failed.append(key)
+                print(f"Партиция {partition_by}={key}: ошибка, транзакция откатена - {error}")
+    
+    elapsed = time.perf_counter() - started
+    print(f"Параллельная загрузка: {loaded} записей за {elapsed:.2f} с ({loaded / elapsed if elapsed else 0:,.0f} строк/с)")
+    if failed:
+        raise RuntimeError(f"Не загружены партиции {partition_by}: {', '.join(map(str, failed))}")
+    return loaded
+
+def _column(df, name):
+    """Колонка датасета или пустая колонка, если ее нет в CSV"""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(np.nan, index=df.index, dtype=object)
+
+def _to_int_column(series):
+    return pd.to_numeric(series, errors='coerce').round().astype('Int64')
+
+def _to_float_column(series):
+    return pd.to_numeric(series, errors='coerce').astype(float)
+
+def _to_bool_column(series):
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return series.astype('boolean')
+    # Из CSV флаги приходят как True/False вперемешку с пропусками
+    text = series.astype(str).str.lower()
+    values = pd.Series(pd.NA, index=series.index, dtype='boolean')
+    values[text == 'true'] = True
+    values[text == 'false'] = False
+    return values
+
+def _to_text_column(series):
+    return series.astype(object).where(series.notna(), None)
+
+def transform_fact_frame(df, districts, property_types, house_types, dates):
+    """Колоночное преобразование датасета в строки fact_real_estate.
+    
+    Ключи справочников подставляются через map по всей колонке, NULL и типы
+    обрабатываются поколоночно, поправки area/price_per_sqm (как в fix_csv_data)
+    накладываются масками. Возвращает DataFrame с колонками FACT_COLUMNS.
+    """
+    publish_date = pd.to_datetime(df['publish_date']).dt.normalize()
+    date_keys = pd.Series(dates)
+    date_keys.index = pd.to_datetime(date_keys.index)
+    
+    district_id = df['district'].map(districts)
+    property_type_id = df['property_type'].map(property_types)
+    date_id = publish_date.map(date_keys)
+    house_type_id = _column(df, 'house_type').map(house_types)
+    
+    # Пропускаем строки без обязательных справочников
+    missing = district_id.isna() | property_type_id.isna() | date_id.isna()
+    if missing.any():
+        skipped = pd.DataFrame({
+            'district': df['district'][missing],
+            'property_type': df['property_type'][missing],
+            'publish_date': publish_date[missing].dt.date
+        }).value_counts(dropna=False, sort=False)
+        for (district, prop_type, date), count in skipped.items():
+            print(f"Пропущено строк: {count} - нет справочника для {district}, {prop_type} или {date}")
+    keep = ~missing
+    df = df[keep]
+    publish_date = publish_date[keep]
+    
+    # area не может быть NULL в БД: для машиномест 0, для других 1
+    price = _to_float_column(df['price']).fillna(0.0)
+    area = _to_float_column(df['area'])
+    area = area.mask(area.isna() & (df['property_type'] == 'машиноместо'), 0.0).fillna(1.0)
+    
+    # price_per_sqm пересчитываем из цены и площади там, где его нет
+    price_per_sqm = _to_float_column(df['price_per_sqm'])
+    recalculated = (price / area.where(area > 0)).where((area > 0) & (price > 0), 0.0)
+    price_per_sqm = price_per_sqm.fillna(recalculated)
+    
+    facts = pd.DataFrame({
+        'district_id': district_id[keep].astype('Int64'),
+        'date_id': date_id[keep].astype('Int64'),
+        'property_type_id': property_type_id[keep].astype('Int64'),
+        'house_type_id': house_type_id[keep].astype('Int64'),
+        'commercial_purpose_id': pd.Series(pd.NA, index=df.index, dtype='Int64'),
         
-        # Тип дома (если есть)
-        house_type_id = house_types.get(row.get('house_type')) if 'house_type' in row and pd.notna(row.get('house_type')) else None
+        # Основные метрики
+        'price': price,
+        'area': area,
+        'price_per_sqm': price_per_sqm,
         
-        # Дата публикации
-        publish_date = row['publish_date'].date()
-        date_id = dates.get(publish_date)
+        # Параметры жилой недвижимости
+        'rooms': _to_int_column(_column(df, 'rooms')),
+        'floor': _to_int_column(_column(df, 'floor')),
+        'total_floors': _to_int_column(_column(df, 'total_floors')),
+        'year_built': _to_int_column(_column(df, 'year_built')),
         
-        # Пропускаем строку если нет обязательных данных
-        if not all([district_id, property_type_id, date_id]):
-            print(f"Пропущена строка: нет справочника для {row['district']}, {row['property_type']} или {publish_date}")
-            continue
+        # Параметры коммерческой недвижимости
+        'ceiling_height': _to_float_column(_column(df, 'ceiling_height')),
+        'has_ventilation': _to_bool_column(_column(df, 'has_ventilation')),
+        'has_air_conditioning': _to_bool_column(_column(df, 'has_air_conditioning')),
+        'parking_spaces': _to_int_column(_column(df, 'parking_spaces')),
+        'land_area': _to_float_column(_column(df, 'land_area')),
         
-        # Обрабатываем поле area - не может быть NULL в БД
-        area = row['area']
-        if pd.isna(area):
-            # Для машиномест ставим 0, для других - 1
-            if row['property_type'] == 'машиноместо':
-                area = 0.0
-            else:
-                area = 1.0
+        # Общие параметры
+        'metro_time': _to_int_column(_column(df, 'metro_time')),
+        'has_elevator': _to_bool_column(_column(df, 'has_elevator')),
+        'is_renovated': _to_bool_column(_column(df, 'is_renovated')),
         
-        # Обрабатываем price_per_sqm
-        price_per_sqm = row['price_per_sqm']
-        if pd.isna(price_per_sqm):
-            if area > 0:
-                price_per_sqm = float(row['price']) / area if row['price'] > 0 else 0
-            else:
-                price_per_sqm = 0
+        # Технические поля
+        'data_source': 'avito',
+        'external_id': _to_text_column(_column(df, 'id')),
+        'address': _to_text_column(_column(df, 'address')),
+        'url': _to_text_column(_column(df, 'url')),
+        'created_date': publish_date.dt.date
+    }, columns=FACT_COLUMNS)
+    return facts.reset_index(drop=True)
+
+def frame_to_rows(facts):
+    """Кортежи с типами Python (NULL -> None) для execute_batch"""
+    values = facts.astype(object).where(facts.notna(), None)
+    return list(values.itertuples(index=False, name=None))
+
+# Файл состояния инкрементальной загрузки: хэш содержимого по external_id
+FINGERPRINT_STATE_FILE = 'load_state_fingerprints.pkl'
+
+# Колонки, по которым считается хэш строки: все, что загрузка записывает в БД
+# (UPSERT_COLUMNS и дата публикации), иначе изменение, которое upsert не
+# применяет, навсегда считалось бы загруженным
+FINGERPRINT_COLUMNS = UPSERT_COLUMNS + ['created_date']
+
+def compute_row_fingerprints(facts):
+    """64-битный хэш содержимого каждой строки фактов, индекс - external_id"""
+    hashes = pd.util.hash_pandas_object(facts[FINGERPRINT_COLUMNS], index=False)
+    return pd.Series(hashes.to_numpy(), index=pd.Index(facts['external_id'], name='external_id'), name='row_hash')
+
+def load_fingerprint_state(database, generation, state_file=FINGERPRINT_STATE_FILE):
+    """Хэши последней инкрементальной загрузки в эту базу.
+    
+    Состояние действительно, только если оно записано для той же базы и
+    после него поколение данных (query_cache.GENERATION_TABLE) не менялось:
+    другая загрузка или восстановление базы могли изменить строки, и
+    пропуск "неизмененных" строк оставил бы их такими. Иначе возвращается
+    пустое состояние - отправляются все строки.
+    """
+    empty = pd.Series(dtype='uint64', index=pd.Index([], name='external_id'), name='row_hash')
+    if not os.path.exists(state_file):
+        return empty
+    state = pd.read_pickle(state_file)
+    if not isinstance(state, dict) or (state['database'], state['generation']) != (database, generation):
+        print(f"Состояние {state_file} записано для другой базы или до других загрузок, отправляются все строки")
+        return empty
+    return state['fingerprints']
+
+def save_fingerprint_state(state, database, generation, state_file=FINGERPRINT_STATE_FILE):
+    """Атомарная запись состояния (через временный файл) после фиксации загрузки,
+    generation - поколение данных, которое она зафиксировала"""
+    tmp_file = f"{state_file}.tmp"
+    pd.to_pickle({'database': database, 'generation': generation, 'fingerprints': state}, tmp_file)
+    os.replace(tmp_file, state_file)
+
+def diff_against_fingerprints(facts, state):
+    """Отбор новых и измененных строк по сравнению с сохраненными хэшами.
+    
+    Возвращает (строки для загрузки, новое состояние, счетчики). Новое
+    состояние - хэши всех строк источника: удаленные из источника external_id
+    из него выпадают (в БД строки остаются).
+    """
+    fingerprints = compute_row_fingerprints(facts)
+    fingerprints = fingerprints[~fingerprints.index.duplicated(keep='last')]
+    facts = facts.drop_duplicates('external_id', keep='last')
+    
+    positions = state.index.get_indexer(fingerprints.index)
+    is_new = positions == -1
+    previous = state.to_numpy()[np.where(is_new, 0, positions)] if len(state) else fingerprints.to_numpy()
+    is_changed = ~is_new & (previous != fingerprints.to_numpy())
+    deleted = ~state.index.isin(fingerprints.index)
+    
+    counts = {
+        'new': int(is_new.sum()),
+        'changed': int(is_changed.sum()),
+        'unchanged': int(len(fingerprints) - is_new.sum() - is_changed.sum()),
+        'deleted': int(deleted.sum())
+    }
+    send = facts['external_id'].isin(fingerprints.index[is_new | is_changed]).to_numpy()
+    return facts[send].reset_index(drop=True), fingerprints, counts
+
+# Скетчи цен и счетчики различных external_id/адресов по районам, копятся между запусками
+LOAD_SKETCH_FILE = 'load_sketches.npz'
+
+def update_load_sketches(facts, sketch_file=LOAD_SKETCH_FILE):
+    """Добавляет загруженные строки в сохраненные скетчи.
+    
+    Квантили считаются по всем загруженным версиям строк (в инкрементальном
+    режиме измененная строка попадает в скетч повторно), различные
+    external_id и адреса - по всем загрузкам.
+    """
+    sketches = GroupSketches.load(sketch_file) if os.path.exists(sketch_file) else GroupSketches()
+    sketches.update(facts, by='district_id')
+    sketches.save(sketch_file)
+    return sketches
+
+MOVED_GROUP_COLUMNS = ['district_id', 'property_type_id', 'date_id', 'created_date']
+
+def take_moved_groups(cursor):
+    """Группы, из которых загрузки перенесли объявления (очередь очищается в транзакции post_load)"""
+    cursor.execute(f"DELETE FROM {MOVED_GROUPS_TABLE} RETURNING {', '.join(MOVED_GROUP_COLUMNS)}")
+    return pd.DataFrame(cursor.fetchall(), columns=MOVED_GROUP_COLUMNS).drop_duplicates()
+
+def _moved_arrays(moved, columns):
+    if moved is None:
+        return [[] for _ in columns]
+    return [moved[column].tolist() for column in columns]
+
+def refresh_aggregates(cursor, external_ids, moved=None):
+    """Пересчет agg_real_estate_daily только для групп (район, тип, дата), затронутых загрузкой,
+    и групп moved (take_moved_groups), из которых объявления перенесены на другую дату"""
+    external_ids = list(external_ids)
+    if not external_ids and (moved is None or not len(moved)):
+        return 0
+    cursor.execute("""
+        SELECT refresh_real_estate_aggregates(
+            COALESCE(array_agg(district_id), '{}'),
+            COALESCE(array_agg(property_type_id), '{}'),
+            COALESCE(array_agg(date_id), '{}')
+        )
+        FROM (
+            SELECT DISTINCT district_id, property_type_id, date_id
+            FROM fact_real_estate
+            WHERE external_id = ANY(%s)
+            UNION
+            SELECT * FROM unnest(%s::int[], %s::int[], %s::int[])
+        ) affected
+    """, [external_ids] + _moved_arrays(moved, ['district_id', 'property_type_id', 'date_id']))
+    return cursor.fetchone()[0]
+
+def assert_unique_external_ids(cursor, external_ids):
+    """Проверка, что у загруженных объявлений по одной строке в fact_real_estate"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM (
+            SELECT external_id FROM fact_real_estate
+            WHERE external_id = ANY(%s)
+            GROUP BY external_id
+            HAVING COUNT(*) > 1
+        ) repeated
+    """, (list(external_ids),))
+    repeated = cursor.fetchone()[0]
+    if repeated:
+        raise RuntimeError(f"Нарушена уникальность external_id: {repeated} объявлений с несколькими строками "
+                           f"в fact_real_estate (см. {EXTERNAL_KEYS_TABLE})")
+
+def update_price_index(cursor, external_ids, maps, index_file=PRICE_INDEX_FILE, moved=None):
+    """Обновление индекса цен по дням, затронутым загрузкой (и дням moved, откуда
+    перенесены объявления).
+    
+    Все строки затронутых (район, тип, день) перечитываются из БД и заменяют
+    прежние данные этих дней в индексе; пересчитываются только даты рядов,
+    которые от них зависят. День без строк приходит одной строкой без цены
+    и очищается. Возвращает число перечитанных строк.
+    """
+    external_ids = list(external_ids)
+    if not external_ids and (moved is None or not len(moved)):
+        return 0
+    cursor.execute("""
+        SELECT district_id, property_type_id, created_date, f.price_per_sqm::float8
+        FROM (
+            SELECT DISTINCT district_id, property_type_id, created_date
+            FROM fact_real_estate
+            WHERE external_id = ANY(%s)
+            UNION
+            SELECT * FROM unnest(%s::int[], %s::int[], %s::date[])
+        ) affected
+        LEFT JOIN fact_real_estate f USING (district_id, property_type_id, created_date)
+    """, [external_ids] + _moved_arrays(moved, ['district_id', 'property_type_id', 'created_date']))
+    rows = pd.DataFrame(cursor.fetchall(), columns=['district_id', 'property_type_id', 'publish_date', 'price_per_sqm'])
+    rows['district'] = rows['district_id'].map({key: name for name, key in maps['districts'].items()})
+    rows['property_type'] = rows['property_type_id'].map({key: name for name, key in maps['property_types'].items()})
+    index = PriceIndex.load(index_file).update(rows)
+    index.save(index_file)
+    return len(rows)
+
+def _refresh_price_index(metrics, cursor, external_ids, maps, index_file, rows_in, moved=None):
+    """Стадия price_index: индекс обновляется, если уже построен (python price_index.py --from-db)"""
+    if not index_file:
+        return
+    if not os.path.exists(index_file):
+        print(f"Индекс цен {index_file} не построен (python price_index.py --from-db), обновление пропущено")
+        return
+    with metrics.stage('price_index', rows_in=rows_in) as stage:
+        stage.rows_out = update_price_index(cursor, external_ids, maps, index_file, moved)
+        print(f"Индекс цен обновлен: перечитано {stage.rows_out} строк затронутых дней")
+
+def _skip_quarantined(stage, validator, before):
+    """Причины отбраковки строк, ушедших в карантин на стадии (before - число пачек карантина до нее)"""
+    for frame in validator.quarantine[before:]:
+        for reason, count in frame['check_name'].value_counts().items():
+            stage.skip(reason, count)
+
+def print_load_statistics(cursor, sketches):
+    """Итоги после загрузки: число строк в БД, оценки по скетчам, распределение по типам"""
+    cursor.execute("SELECT COUNT(*) FROM fact_real_estate")
+    total = cursor.fetchone()[0]
+    print(f"Всего записей в БД: {total}")
+    if sketches.count('price'):
+        print(f"Различных external_id за все загрузки: ~{sketches.distinct('external_id'):,}, "
+              f"адресов: ~{sketches.distinct('address'):,} (HyperLogLog)")
+        print(f"Медиана цены: {sketches.quantile('price', 0.5):,.0f} руб., "
+              f"95-й перцентиль: {sketches.quantile('price', 0.95):,.0f} руб. (скетч)")
+    
+    # Статистика по типам
+    cursor.execute("""
+        SELECT pt.property_type_name, COUNT(*) 
+        FROM fact_real_estate f 
+        JOIN dim_property_types pt ON f.property_type_id = pt.property_type_id 
+        GROUP BY pt.property_type_name 
+        ORDER BY COUNT(*) DESC
+    """)
+    print("\nРаспределение по типам недвижимости:")
+    for prop_type, count in cursor.fetchall():
+        print(f"  {prop_type}: {count}")
+
+# Конвейерная загрузка: строк в куске (он же транзакция записи), готовых к записи кусков
+# в очереди, процессов преобразования и соединений записи
+PIPELINE_CHUNK_ROWS = 50000
+PIPELINE_QUEUE_DEPTH = 4
+PIPELINE_TRANSFORM_WORKERS = 2
+PIPELINE_WRITERS = 2
+
+# Как часто потоки, ждущие очередь, проверяют флаг остановки конвейера (секунды)
+PIPELINE_POLL_SECONDS = 0.2
+
+# Колонки источника, которые нужны загрузке (остальные конвейер не разбирает)
+LOAD_SOURCE_COLUMNS = {
+    'id', 'district', 'publish_date', 'property_category', 'property_type', 'house_type',
+    'price', 'area', 'price_per_sqm', 'rooms', 'floor', 'total_floors', 'year_built',
+    'ceiling_height', 'has_ventilation', 'has_air_conditioning', 'parking_spaces', 'land_area',
+    'metro_time', 'has_elevator', 'is_renovated', 'address', 'url'
+}
+
+def transform_chunk(df, maps, bulk=False, deduplicate=True, listings=False):
+    """Проверки, поиск дубликатов и преобразование одного куска источника
+    (выполняется в пуле процессов конвейерной загрузки).
+    
+    Возвращает словарь: данные для записи (CSV для COPY при bulk=True, иначе
+    кортежи для execute_batch), external_id загружаемых строк, месяцы
+    created_date, связи дубликатов, скетчи и IntegrityValidator куска,
+    при listings=True - объявления для индекса аналогов.
+    """
+    started = time.perf_counter()
+    validator = IntegrityValidator()
+    rows_in = len(df)
+    # Категориальная дата разбирается по категориям и разворачивается в datetime64
+    # (иначе каждая следующая pd.to_datetime обходит ее построчно)
+    publish_date = pd.to_datetime(df['publish_date'])
+    if isinstance(publish_date.dtype, pd.CategoricalDtype):
+        publish_date = publish_date.astype(publish_date.cat.categories.dtype)
+    df['publish_date'] = publish_date
+    df = validator.check_source(df, maps)
+    duplicates = find_duplicates(df) if deduplicate else find_duplicates(df.iloc[:0])
+    df = df.drop(index=duplicates.index)
+    facts = transform_fact_frame(df, maps['districts'], maps['property_types'], maps['house_types'], maps['dates'])
+    missing_dimension = len(df) - len(facts)
+    facts = validator.check_facts(facts)
+    loaded = None
+    if listings:
+        loaded = df[df['id'].astype(str).isin(facts['external_id'])]
+        loaded = loaded[[column for column in LISTING_COLUMNS if column in loaded.columns]]
+    return {
+        'rows_in': rows_in,
+        'rows_out': len(facts),
+        'missing_dimension': missing_dimension,
+        'validator': validator,
+        'duplicates': duplicates,
+        'external_ids': facts['external_id'].tolist(),
+        'months': set(month_starts(facts['created_date'])),
+        'sketches': GroupSketches().update(facts, by='district_id'),
+        'listings': loaded,
+        'payload': rows_to_copy_buffer(facts).getvalue() if bulk else frame_to_rows(facts),
+        'seconds': time.perf_counter() - started
+    }
+
+def _put_until_stopped(tasks, item, stop):
+    """put в ограниченную очередь, пока конвейер не остановлен. Возвращает время ожидания места"""
+    started = time.perf_counter()
+    while not stop.is_set():
+        try:
+            tasks.put(item, timeout=PIPELINE_POLL_SECONDS)
+            return time.perf_counter() - started
+        except queue.Full:
+            continue
+    raise RuntimeError("Конвейер остановлен: ошибка записи в БД")
+
+def _pipeline_writer(slot, tasks, stop, bulk, stats, max_retries, retry_backoff):
+    """Поток записи конвейера: куски из очереди, каждый - одна транзакция на своем соединении.
+    
+    Обрыв соединения (TRANSIENT_ERRORS) повторяет кусок на новом соединении,
+    другая ошибка или исчерпанные повторы останавливают весь конвейер.
+    """
+    pool = get_connection_pool()
+    staging_table = f"{STAGING_TABLE}_{slot}"
+    copy_sql = f"COPY {staging_table} ({', '.join(FACT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    conn, prepared = None, False
+    try:
+        while not stop.is_set():
+            try:
+                chunk = tasks.get(timeout=PIPELINE_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if chunk is None:
+                break
+            started = time.perf_counter()
+            attempt = 0
+            while True:
+                try:
+                    if conn is None:
+                        conn = pool.getconn()
+                        cursor = conn.cursor()
+                    if bulk:
+                        # У каждого потока своя staging-таблица
+                        if not prepared:
+                            ensure_staging_table(cursor, staging_table)
+                            cursor.execute(f"TRUNCATE {staging_table}")
+                            conn.commit()
+                            prepared = True
+                        cursor.copy_expert(copy_sql, io.StringIO(chunk['payload']))
+                        merge_staging_into_fact(cursor, staging_table)
+                    else:
+                        upsert_rows(cursor, chunk['payload'])
+                    conn.commit()
+                    break
+                except TRANSIENT_ERRORS as e:
+                    attempt += 1
+                    if conn is not None:
+                        # Соединение после обрыва не переиспользуем
+                        pool.putconn(conn, close=True)
+                        conn = None
+                    if attempt > max_retries:
+                        raise
+                    delay = retry_delay(attempt, retry_backoff)
+                    print(f"Запись куска (поток {slot}): {str(e).strip()}; повтор {attempt} из {max_retries} "
+                          f"через {delay:.1f} с")
+                    time.sleep(delay)
+            stats['loaded'] += chunk['rows']
+            stats['chunks'] += 1
+            stats['retries'] += attempt
+            stats['seconds'] += time.perf_counter() - started
+    except Exception as e:
+        stats['error'] = e
+        stop.set()
+        if conn is not None:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+    finally:
+        if conn is not None:
+            cursor.close()
+            pool.putconn(conn)
+
+def pipelined_load_rows(conn, csv_file, validator, stage, bulk=False, chunk_rows=PIPELINE_CHUNK_ROWS,
+                        transform_workers=PIPELINE_TRANSFORM_WORKERS, writers=PIPELINE_WRITERS,
+                        queue_depth=PIPELINE_QUEUE_DEPTH, auto_dimensions=True, deduplicate=True, listings=False,
+                        max_retries=MAX_RETRIES, retry_backoff=RETRY_BACKOFF_SECONDS):
+    """Конвейер: чтение кусков -> преобразование в пуле процессов -> очередь -> потоки записи.
+    
+    Основной поток читает источник кусками по chunk_rows строк, дополняет
+    справочники и отдает кусок в пул из transform_workers процессов
+    (проверки, дубликаты, преобразование и сериализация для COPY; 0 - в
+    основном потоке). Готовые куски в порядке источника кладутся в очередь
+    на queue_depth кусков, которую разбирают writers соединений; полная
+    очередь останавливает чтение, поэтому в памяти не больше
+    queue_depth + 2 * transform_workers + writers кусков. Ошибка записи
+    останавливает чтение, ошибка чтения - запись; уже записанные куски
+    зафиксированы (повторный запуск перезапишет их upsert'ом).
+    
+    Счетчики проверок копятся в validator, пропуски - в stage. Возвращает
+    (загружено строк, external_id, связи дубликатов, скетчи, объявления для
+    индекса аналогов или None).
+    """
+    cursor = conn.cursor()
+    dimensions = get_dimension_manager()
+    maps = {name: dict(values) for name, values in dimensions.maps.items()}
+    partitioned = is_fact_partitioned(cursor)
+    if bulk:
+        ensure_bulk_load_objects(cursor)
+    else:
+        ensure_fact_key_objects(cursor)
+    conn.commit()
+    
+    # Одно соединение пула занято основным потоком
+    writers = max(1, min(writers, POOL_MAX_CONNECTIONS - 1))
+    tasks = queue.Queue(maxsize=max(1, queue_depth))
+    stop = threading.Event()
+    stats = [{'loaded': 0, 'chunks': 0, 'retries': 0, 'seconds': 0.0, 'error': None} for _ in range(writers)]
+    threads = [threading.Thread(target=_pipeline_writer, daemon=True,
+                                args=(slot, tasks, stop, bulk, stats[slot], max_retries, retry_backoff))
+               for slot in range(writers)]
+    # spawn: рабочие процессы не наследуют потоки записи и их соединения
+    executor = ProcessPoolExecutor(max_workers=transform_workers, mp_context=multiprocessing.get_context('spawn')) \
+        if transform_workers else None
+    
+    timings = dict.fromkeys(['read', 'dimensions', 'transform', 'wait'], 0.0)
+    totals = {'read': 0, 'sent': 0, 'chunks': 0}
+    external_ids, links, loaded_listings, known_months = [], [], [], set()
+    sketches = GroupSketches()
+    
+    def collect(result):
+        """Учет результата куска и постановка его в очередь записи (в основном потоке)"""
+        validator.merge(result['validator'])
+        _skip_quarantined(stage, result['validator'], 0)
+        stage.skip('duplicate_listing', len(result['duplicates']))
+        stage.skip('missing_dimension', result['missing_dimension'])
+        if len(result['duplicates']):
+            links.append(result['duplicates'])
+        if result['listings'] is not None:
+            loaded_listings.append(result['listings'])
+        external_ids.extend(result['external_ids'])
+        sketches.merge(result['sketches'])
+        timings['transform'] += result['seconds']
         
-        # Подготавливаем кортеж для вставки
-        data = (
-            district_id,
-            date_id,
-            property_type_id,
-            house_type_id,
-            None,  # commercial_purpose_id
-            
-            # Основные метрики
-            float(row['price']) if pd.notna(row['price']) else 0.0,
-            float(area),  # Уже обработано выше
-            float(price_per_sqm),  # Уже обработано выше
-            
-            # Параметры жилой недвижимости
-            int(row['rooms']) if 'rooms' in row and pd.notna(row['rooms']) else None,
-            int(row['floor']) if 'floor' in row and pd.notna(row['floor']) else None,
-            int(row['total_floors']) if 'total_floors' in row and pd.notna(row['total_floors']) else None,
-            int(row['year_built']) if 'year_built' in row and pd.notna(row['year_built']) else None,
-            
-            # Параметры коммерческой недвижимости
-            float(row['ceiling_height']) if 'ceiling_height' in row and pd.notna(row['ceiling_height']) else None,
-            bool(row['has_ventilation']) if 'has_ventilation' in row and pd.notna(row['has_ventilation']) else None,
-            bool(row['has_air_conditioning']) if 'has_air_conditioning' in row and pd.notna(row['has_air_conditioning']) else None,
-            int(row['parking_spaces']) if 'parking_spaces' in row and pd.notna(row['parking_spaces']) else None,
-            float(row['land_area']) if 'land_area' in row and pd.notna(row['land_area']) else None,
+        # Секции новых месяцев создаются до записи куска
+        new_months = result['months'] - known_months
+        if partitioned and new_months:
+            created = ensure_month_partitions(cursor, pd.Series(sorted(new_months)))
+            conn.commit()
+            if created:
+                print("Созданы секции: " + ", ".join(partition_table_name(month) for month in created))
+        known_months.update(new_months)
+        
+        timings['wait'] += _put_until_stopped(tasks, {'payload': result['payload'], 'rows': result['rows_out']}, stop)
+        totals['sent'] += result['rows_out']
+        totals['chunks'] += 1
+        print(f"Кусок {totals['chunks']}: прочитано {totals['read']} строк, в очереди записи {totals['sent']} записей")
+    
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    pending = deque()
+    try:
+        source = iter_dataset_chunks(csv_file, chunk_rows, LOAD_SOURCE_COLUMNS)
+        while True:
+            read_started = time.perf_counter()
+            chunk = next(source, None)
+            timings['read'] += time.perf_counter() - read_started
+            if chunk is None:
+                break
+            totals['read'] += len(chunk)
             
-            # Общие параметры
-            int(row['metro_time']) if 'metro_time' in row and pd.notna(row['metro_time']) else None,
-            bool(row['has_elevator']) if 'has_elevator' in row and pd.notna(row['has_elevator']) else None,
-            bool(row['is_renovated']) if 'is_renovated' in row and pd.notna(row['is_renovated']) else None,
+            # Новые значения справочников добавляем до преобразования куска
+            if auto_dimensions:
+                dimensions_started = time.perf_counter()
+                added = dimensions.ensure_members(cursor, chunk)
+                conn.commit()
+                if any(added.values()):
+                    maps = {name: dict(values) for name, values in dimensions.maps.items()}
+                    print("Добавлено в справочники: " + ", ".join(f"{name} {count}" for name, count in added.items() if count))
+                timings['dimensions'] += time.perf_counter() - dimensions_started
             
-            # Технические поля
-            'avito',
-            row['id'] if 'id' in row else None,
-            row['address'] if 'address' in row and pd.notna(row['address']) else None,
-            row['url'] if 'url' in row and pd.notna(row['url']) else None,
-            row['publish_date'].date()
-        )
-        
-        data_to_insert.append(data)
-    
-    # SQL запрос для вставки
-    insert_query = """
-        INSERT INTO fact_real_estate (
-            district_id, date_id, property_type_id, house_type_id, commercial_purpose_id,
-            price, area, price_per_sqm, rooms, floor, total_floors, year_built,
-            ceiling_height, has_ventilation, has_air_conditioning, parking_spaces, land_area,
-            metro_time, has_elevator, is_renovated, data_source, external_id, address, url, created_date
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-        )
-        ON CONFLICT (external_id) DO UPDATE SET
-            price = EXCLUDED.price,
-            area = EXCLUDED.area,
-            price_per_sqm = EXCLUDED.price_per_sqm,
-            updated_date = CURRENT_TIMESTAMP
+            if executor is None:
+                collect(transform_chunk(chunk, maps, bulk, deduplicate, listings))
+                continue
+            pending.append(executor.submit(transform_chunk, chunk, maps, bulk, deduplicate, listings))
+            while len(pending) >= 2 * transform_workers:
+                collect(pending.popleft().result())
+        while pending:
+            collect(pending.popleft().result())
+        for _ in threads:
+            _put_until_stopped(tasks, None, stop)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        for thread in threads:
+            thread.join()
+        cursor.close()
+        # Причина остановки - ошибка записи, если она была
+        failed = next((writer['error'] for writer in stats if writer['error'] is not None), None)
+        if failed is not None:
+            raise failed
+    
+    elapsed = time.perf_counter() - started
+    loaded = sum(writer['loaded'] for writer in stats)
+    print(f"Конвейерная загрузка: {loaded} записей за {elapsed:.2f} с ({loaded / elapsed if elapsed else 0:,.0f} строк/с), "
+          f"кусков {totals['chunks']}")
+    print(f"  чтение {timings['read']:.2f} с, справочники {timings['dimensions']:.2f} с, "
+          f"преобразование {timings['transform']:.2f} с ({transform_workers or 'без'} процессов), "
+          f"запись {sum(writer['seconds'] for writer in stats):.2f} с ({writers} соединений), "
+          f"ожидание очереди записи {timings['wait']:.2f} с")
+    retries = sum(writer['retries'] for writer in stats)
+    if retries:
+        print(f"  повторов записи после сбоя соединения: {retries}")
+    stage.rows_in = totals['read']
+    stage.rows_out = loaded
+    duplicates = pd.concat(links) if links else find_duplicates(pd.DataFrame())
+    listings_frame = pd.concat(loaded_listings, ignore_index=True) if loaded_listings else None
+    return loaded, external_ids, duplicates, sketches, listings_frame
+
+def load_csv_to_db(csv_file='comprehensive_real_estate_dataset.csv', bulk=False, commit_rows=None,
+                   incremental=False, state_file=FINGERPRINT_STATE_FILE, parallel=0, partition_by='district_id',
+                   auto_dimensions=True, attach_partitions=False, sketch_file=LOAD_SKETCH_FILE, deduplicate=True,
+                   metrics=None, checkpoint=False, max_retries=MAX_RETRIES, retry_backoff=RETRY_BACKOFF_SECONDS,
+                   comparables_file=COMPARABLES_FILE, price_index_file=PRICE_INDEX_FILE):
+    """Загружает данные из CSV (или parquet-каталога) в базу данных.
+    
+    bulk=True включает загрузку через COPY в staging-таблицу с одним
+    set-based слиянием; commit_rows - размер транзакции в этом режиме.
+    incremental=True отправляет в БД только новые и измененные строки,
+    сравнивая хэши содержимого с файлом состояния state_file.
+    parallel=N грузит партиции по partition_by в N потоков на соединениях пула.
+    auto_dimensions=True добавляет в dim_* отсутствующие районы, типы и даты
+    вместо пропуска таких строк.
+    attach_partitions=True грузит месяцы без секции отдельными таблицами
+    и подключает их через ATTACH PARTITION (нужна секционированная fact_real_estate).
+    Загруженные строки добавляются в скетчи sketch_file (квантили цен и число
+    различных external_id/адресов без полного прохода по таблице).
+    deduplicate=True не загружает повторные публикации одного объекта
+    (связи с каноническим объявлением пишутся в fact_duplicate_links).
+    metrics - PipelineMetrics для стадий LOAD_STAGES; если не передан,
+    создается свой и сводка печатается в конце загрузки.
+    checkpoint=True грузит пачками по commit_rows (по умолчанию CHECKPOINT_ROWS)
+    с контрольными точками в etl_load_journal: повторный запуск на том же
+    файле продолжает с последней зафиксированной пачки, сбои соединения
+    повторяют только текущую пачку (до max_retries раз, задержка от retry_backoff).
+    Если индекс аналогов comparables_file уже построен, загруженные объявления
+    добавляются в него (перестраиваются только затронутые группы район x тип).
+    Построенный индекс цен price_index_file обновляется по затронутым дням.
     """
+    if checkpoint and (parallel or attach_partitions):
+        raise ValueError("Загрузка с контрольными точками несовместима с parallel и attach_partitions")
+    own_metrics = metrics is None
+    if own_metrics:
+        metrics = PipelineMetrics('load')
+    
+    with metrics.stage('extract') as stage:
+        print(f"Загрузка данных из {'parquet' if is_parquet_path(csv_file) else 'CSV'}...")
+        df = read_dataset(csv_file)
+        df['publish_date'] = pd.to_datetime(df['publish_date'])
+        print(f"Загружено {len(df)} строк")
+        stage.rows_out = len(df)
+        stage.bytes_read = path_size(csv_file)
+        fingerprint = source_fingerprint(csv_file) if checkpoint else None
     
-    # Вставляем данные пачками
-    print(f"Вставляем {len(data_to_insert)} записей в БД...")
+    # Подключаемся к БД (соединение из общего пула)
+    pool = get_connection_pool()
+    conn = pool.getconn()
+    cursor = conn.cursor()
+    print("Подключено к базе данных")
     
     try:
-        # Разбиваем на пачки по 100 записей
-        batch_size = 100
-        for i in range(0, len(data_to_insert), batch_size):
-            batch = data_to_insert[i:i + batch_size]
-            execute_batch(cursor, insert_query, batch)
+        # Загружаем справочники (из кэша; перечитываются только измененные)
+        with metrics.stage('dimensions', rows_in=len(df)) as stage:
+            print("Загрузка справочников...")
+            dimensions = get_dimension_manager()
+            reloaded = dimensions.refresh(cursor)
+            print(f"Перечитаны справочники: {', '.join(reloaded) if reloaded else 'нет, ключи взяты из кэша'}")
+            
+            # Новые районы, типы, типы домов и даты добавляем до загрузки фактов
+            if auto_dimensions:
+                added = dimensions.ensure_members(cursor, df)
+                conn.commit()
+                if any(added.values()):
+                    print("Добавлено в справочники: " + ", ".join(f"{name} {count}" for name, count in added.items() if count))
+            dimensions.save()
+            stage.rows_out = len(df)
+        
+        districts = dimensions.maps['districts']
+        property_types = dimensions.maps['property_types']
+        house_types = dimensions.maps['house_types']
+        dates = dimensions.maps['dates']
+        
+        # Проверки целостности по ходу загрузки: строки с ошибками уходят в карантин
+        validator = IntegrityValidator()
+        with metrics.stage('validate_source', rows_in=len(df)) as stage:
+            df = validator.check_source(df, dimensions.maps)
+            _skip_quarantined(stage, validator, 0)
+            stage.rows_out = len(df)
+        
+        # Повторные публикации объекта под новыми id связываем с каноническим объявлением
+        with metrics.stage('deduplicate', rows_in=len(df)) as stage:
+            duplicates = find_duplicates(df) if deduplicate else find_duplicates(df.iloc[:0])
+            if len(duplicates):
+                df = df.drop(index=duplicates.index)
+                print(f"Найдено дубликатов объявлений: {len(duplicates)} (загружаются только канонические)")
+            stage.skip('duplicate_listing', len(duplicates))
+            stage.rows_out = len(df)
+        
+        # Подготавливаем данные для вставки (колоночное преобразование)
+        with metrics.stage('transform', rows_in=len(df)) as stage:
+            facts = transform_fact_frame(df, districts, property_types, house_types, dates)
+            stage.skip('missing_dimension', len(df) - len(facts))
+            stage.rows_out = len(facts)
+        
+        with metrics.stage('validate_facts', rows_in=len(facts)) as stage:
+            quarantine_before = len(validator.quarantine)
+            facts = validator.check_facts(facts)
+            _skip_quarantined(stage, validator, quarantine_before)
+            stage.rows_out = len(facts)
+        validator.print_report()
+        
+        # Инкрементальный режим: неизмененные строки в БД не отправляем
+        if incremental:
+            with metrics.stage('incremental_diff', rows_in=len(facts)) as stage:
+                state_database, state_generation = database_key(conn), read_load_generation(conn)
+                state = load_fingerprint_state(state_database, state_generation, state_file)
+                facts, fingerprints, counts = diff_against_fingerprints(facts, state)
+                print(f"Изменения: новых {counts['new']}, измененных {counts['changed']}, "
+                      f"без изменений {counts['unchanged']}, удаленных {counts['deleted']}")
+                stage.skip('unchanged', counts['unchanged'])
+                stage.rows_out = len(facts)
+        
+        # Вставляем данные пачками
+        print(f"Вставляем {len(facts)} записей в БД...")
+        
+        with metrics.stage('insert', rows_in=len(facts)) as stage:
+            # Секции для новых месяцев создаем до вставки (в режиме attach_partitions
+            # их создает сама загрузка)
+            partitioned = is_fact_partitioned(cursor)
+            if attach_partitions and not partitioned:
+                raise RuntimeError("fact_real_estate не секционирована, загрузка с ATTACH PARTITION невозможна")
+            if partitioned and not attach_partitions:
+                created = ensure_month_partitions(cursor, facts['created_date'])
+                conn.commit()
+                if created:
+                    print("Созданы секции: " + ", ".join(partition_table_name(month) for month in created))
+            ensure_fact_key_objects(cursor)
+            conn.commit()
+            
+            if checkpoint:
+                batch_rows = commit_rows or CHECKPOINT_ROWS
+                load_options = f"{'bulk' if bulk else 'batch'};incremental={incremental};dedup={deduplicate}"
+                load_id, offset = start_or_resume_load(cursor, os.path.abspath(csv_file), fingerprint,
+                                                       load_options, len(facts), batch_rows)
+                conn.commit()
+                print(f"Загрузка {load_id} в журнале etl_load_journal, пачки по {batch_rows} записей")
+                checkpointed_load_rows(facts, load_id, offset, batch_rows, bulk, max_retries, retry_backoff)
+            elif attach_partitions:
+                partitioned_bulk_load(conn, facts, commit_rows)
+            elif parallel:
+                load_partitions_parallel(conn, facts, partition_by, parallel, bulk, commit_rows)
+            elif bulk:
+                bulk_load_rows(conn, facts, commit_rows)
+            else:
+                # Разбиваем на пачки по 100 записей
+                batch_load_rows(conn, facts, batch_size=100)
+            stage.rows_out = len(facts)
+        
+        # Обновляем агрегаты аналитических представлений, карантин и счетчики проверок
+        with metrics.stage('post_load', rows_in=len(facts)) as stage:
+            assert_unique_external_ids(cursor, facts['external_id'])
+            moved = take_moved_groups(cursor)
+            refreshed = refresh_aggregates(cursor, facts['external_id'], moved)
+            validator.save(cursor)
+            save_duplicate_links(cursor, duplicates)
+            if checkpoint:
+                record_completed(cursor, load_id)
+            generation = bump_load_generation(cursor)
             conn.commit()
-            print(f"Вставлено {i + len(batch)} из {len(data_to_insert)} записей")
+            print(f"Обновлено строк агрегатов: {refreshed} (поколение данных {generation})")
+            stage.rows_out = refreshed
+        
+        # Состояние сохраняем только после фиксации загрузки и только если между
+        # сравнением и фиксацией в базу не загружалось ничего другого
+        if incremental and generation == state_generation + 1:
+            save_fingerprint_state(fingerprints, state_database, generation, state_file)
+        elif incremental:
+            print(f"Во время загрузки базу меняли другие загрузки, состояние {state_file} не обновлено")
+        
+        with metrics.stage('sketches', rows_in=len(facts)):
+            sketches = update_load_sketches(facts, sketch_file)
+        
+        if comparables_file and os.path.exists(comparables_file):
+            with metrics.stage('comparables', rows_in=len(facts)) as stage:
+                loaded = df[df['id'].astype(str).isin(facts['external_id'])]
+                comparables = ComparablesIndex.load(comparables_file).update(loaded)
+                comparables.save(comparables_file)
+                stage.rows_out = len(comparables)
+                print(f"Индекс аналогов обновлен: {len(comparables):,} объявлений")
+        
+        _refresh_price_index(metrics, cursor, facts['external_id'], dimensions.maps, price_index_file, len(facts),
+                             moved)
         
         print("Данные успешно загружены!")
         
         # Показываем статистику
-        cursor.execute("SELECT COUNT(*) FROM fact_real_estate")
-        total = cursor.fetchone()[0]
-        print(f"Всего записей в БД: {total}")
-        
-        # Статистика по типам
-        cursor.execute("""
-            SELECT pt.property_type_name, COUNT(*) 
-            FROM fact_real_estate f 
-            JOIN dim_property_types pt ON f.property_type_id = pt.property_type_id 
-            GROUP BY pt.property_type_name 
-            ORDER BY COUNT(*) DESC
-        """)
-        print("\nРаспределение по типам недвижимости:")
-        for prop_type, count in cursor.fetchall():
-            print(f"  {prop_type}: {count}")
-            
+        with metrics.stage('statistics'):
+            print_load_statistics(cursor, sketches)
+    
     except Exception as e:
         conn.rollback()
         print(f"Ошибка при вставке данных: {e}")
@@ -178,72 +1312,172 @@ def load_csv_to_db(csv_file='comprehensive_real_estate_dataset.csv'):
     
     finally:
         cursor.close()
-        conn.close()
+        pool.putconn(conn)
+        if own_metrics:
+            metrics.summary()
 
-def check_db_connection():
-    """Проверяет подключение к БД"""
+def pipelined_load_csv_to_db(csv_file='comprehensive_real_estate_dataset.csv', bulk=False,
+                             chunk_rows=PIPELINE_CHUNK_ROWS, transform_workers=PIPELINE_TRANSFORM_WORKERS,
+                             writers=PIPELINE_WRITERS, queue_depth=PIPELINE_QUEUE_DEPTH, auto_dimensions=True,
+                             deduplicate=True, sketch_file=LOAD_SKETCH_FILE, metrics=None, max_retries=MAX_RETRIES,
+                             retry_backoff=RETRY_BACKOFF_SECONDS, comparables_file=COMPARABLES_FILE,
+                             price_index_file=PRICE_INDEX_FILE):
+    """Конвейерная загрузка CSV (или parquet-каталога): разбор, преобразование
+    и запись в БД идут одновременно (см. pipelined_load_rows), время загрузки
+    близко к самой медленной из стадий, а не к их сумме.
+    
+    Справочники, проверки целостности, агрегаты, скетчи, индексы аналогов
+    и цен обновляются как в load_csv_to_db. Дубликаты объявлений ищутся внутри
+    куска: повторные публикации, попавшие в разные куски, загружаются обе.
+    Инкрементальный режим, контрольные точки и загрузка секциями в
+    конвейере не поддерживаются.
+    """
+    own_metrics = metrics is None
+    if own_metrics:
+        metrics = PipelineMetrics('load')
+    
+    pool = get_connection_pool()
+    conn = pool.getconn()
+    cursor = conn.cursor()
+    print("Подключено к базе данных")
+    
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        cursor.execute("SELECT version()")
-        version = cursor.fetchone()
-        print(f"PostgreSQL версия: {version[0]}")
+        with metrics.stage('dimensions'):
+            dimensions = get_dimension_manager()
+            reloaded = dimensions.refresh(cursor)
+            print(f"Перечитаны справочники: {', '.join(reloaded) if reloaded else 'нет, ключи взяты из кэша'}")
         
-        # Проверяем, что таблица fact_real_estate существует
-        cursor.execute("""
-            SELECT column_name, data_type, is_nullable 
-            FROM information_schema.columns 
-            WHERE table_name = 'fact_real_estate'
-            ORDER BY ordinal_position
-        """)
+        print(f"Конвейерная загрузка из {'parquet' if is_parquet_path(csv_file) else 'CSV'} кусками по {chunk_rows} строк...")
+        validator = IntegrityValidator()
+        update_comparables = bool(comparables_file) and os.path.exists(comparables_file)
+        with metrics.stage('pipeline') as stage:
+            stage.bytes_read = path_size(csv_file)
+            loaded, external_ids, duplicates, sketches, listings = pipelined_load_rows(
+                conn, csv_file, validator, stage, bulk, chunk_rows, transform_workers, writers, queue_depth,
+                auto_dimensions, deduplicate, update_comparables, max_retries, retry_backoff)
+        dimensions.save()
+        validator.print_report()
+        if len(duplicates):
+            print(f"Найдено дубликатов объявлений: {len(duplicates)} (загружаются только канонические)")
+        
+        with metrics.stage('post_load', rows_in=loaded) as stage:
+            assert_unique_external_ids(cursor, external_ids)
+            moved = take_moved_groups(cursor)
+            refreshed = refresh_aggregates(cursor, external_ids, moved)
+            validator.save(cursor)
+            save_duplicate_links(cursor, duplicates)
+            generation = bump_load_generation(cursor)
+            conn.commit()
+            print(f"Обновлено строк агрегатов: {refreshed} (поколение данных {generation})")
+            stage.rows_out = refreshed
+        
+        with metrics.stage('sketches', rows_in=loaded):
+            stored = GroupSketches.load(sketch_file) if os.path.exists(sketch_file) else GroupSketches()
+            sketches = stored.merge(sketches)
+            sketches.save(sketch_file)
         
-        print("\nСтруктура таблицы fact_real_estate:")
-        for col_name, data_type, is_nullable in cursor.fetchall():
-            print(f"  {col_name}: {data_type} ({'NULL' if is_nullable == 'YES' else 'NOT NULL'})")
+        if update_comparables and listings is not None:
+            with metrics.stage('comparables', rows_in=len(listings)) as stage:
+                comparables = ComparablesIndex.load(comparables_file).update(listings)
+                comparables.save(comparables_file)
+                stage.rows_out = len(comparables)
+                print(f"Индекс аналогов обновлен: {len(comparables):,} объявлений")
         
+        _refresh_price_index(metrics, cursor, external_ids, dimensions.maps, price_index_file, loaded, moved)
+        
+        print("Данные успешно загружены!")
+        
+        with metrics.stage('statistics'):
+            print_load_statistics(cursor, sketches)
+    
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при загрузке данных: {e}")
+        raise
+    
+    finally:
         cursor.close()
-        conn.close()
+        pool.putconn(conn)
+        if own_metrics:
+            metrics.summary()
+
+def check_db_connection():
+    """Проверяет подключение к БД"""
+    try:
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT version()")
+            version = cursor.fetchone()
+            print(f"PostgreSQL версия: {version[0]}")
+            
+            # Проверяем, что таблица fact_real_estate существует
+            cursor.execute("""
+                SELECT column_name, data_type, is_nullable 
+                FROM information_schema.columns 
+                WHERE table_name = 'fact_real_estate'
+                ORDER BY ordinal_position
+            """)
+            
+            print("\nСтруктура таблицы fact_real_estate:")
+            for col_name, data_type, is_nullable in cursor.fetchall():
+                print(f"  {col_name}: {data_type} ({'NULL' if is_nullable == 'YES' else 'NOT NULL'})")
+            
+            cursor.close()
         return True
     except Exception as e:
         print(f"Ошибка подключения: {e}")
         return False
 
-def fix_csv_data(csv_file='comprehensive_real_estate_dataset.csv'):
-    """Исправляет данные в CSV перед загрузкой"""
-    print("Проверка и исправление данных в CSV...")
-    
-    df = pd.read_csv(csv_file, encoding='utf-8')
-    
-    # Статистика по пропущенным значениям
-    print("\nПропущенные значения:")
-    for col in df.columns:
-        missing = df[col].isna().sum()
-        if missing > 0:
-            print(f"  {col}: {missing} пропущенных")
-    
-    # Исправляем area для машиномест
-    mask = (df['property_type'] == 'машиноместо') & (df['area'].isna())
-    df.loc[mask, 'area'] = 0.0
-    
-    # Исправляем area для других типов с NaN
-    mask = df['area'].isna()
-    df.loc[mask, 'area'] = 1.0
-    
-    # Пересчитываем price_per_sqm если нужно
-    mask = df['price_per_sqm'].isna() & (df['area'] > 0) & (df['price'] > 0)
-    df.loc[mask, 'price_per_sqm'] = df.loc[mask, 'price'] / df.loc[mask, 'area']
-    
-    # Заменяем оставшиеся NaN в price_per_sqm на 0
-    df['price_per_sqm'] = df['price_per_sqm'].fillna(0)
-    
-    # Сохраняем исправленный файл
-    fixed_file = 'comprehensive_real_estate_dataset_fixed.csv'
-    df.to_csv(fixed_file, index=False, encoding='utf-8')
-    print(f"\nИсправленные данные сохранены в {fixed_file}")
-    
-    return fixed_file
+def parse_args():
+    parser = argparse.ArgumentParser(description="Загрузка данных недвижимости в базу данных")
+    parser.add_argument('--source', default='comprehensive_real_estate_dataset.csv',
+                        help="CSV-файл или parquet-каталог датасета")
+    parser.add_argument('--bulk', action='store_true',
+                        help="загрузка через COPY в staging-таблицу с одним слиянием в fact_real_estate")
+    parser.add_argument('--commit-rows', type=int, default=None,
+                        help="размер транзакции в режиме --bulk (по умолчанию вся загрузка одной транзакцией) "
+                             "и размер пачки в режиме --checkpoint")
+    parser.add_argument('--parallel', type=int, default=0,
+                        help="число потоков параллельной загрузки партиций (соединения из пула)")
+    parser.add_argument('--partition-by', choices=['district_id', 'date_id'], default='district_id',
+                        help="ключ разбиения строк для --parallel")
+    parser.add_argument('--no-auto-dimensions', action='store_true',
+                        help="не добавлять новые значения в справочники (строки без справочника пропускаются)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="загружать только новые и измененные строки (хэши в load_state_fingerprints.pkl)")
+    parser.add_argument('--no-dedup', action='store_true',
+                        help="не искать дубликаты объявлений (повторные публикации под новыми id)")
+    parser.add_argument('--attach-partitions', action='store_true',
+                        help="новые месяцы грузить отдельными таблицами и подключать секциями fact_real_estate")
+    parser.add_argument('--detach-before', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(), default=None,
+                        help="после загрузки отсоединить секции месяцев раньше даты (ГГГГ-ММ-ДД)")
+    parser.add_argument('--archive-schema', default=None,
+                        help="схема, в которую переносятся отсоединенные секции (см. --detach-before)")
+    parser.add_argument('--checkpoint', action='store_true',
+                        help="загрузка с контрольными точками в etl_load_journal: после сбоя продолжается с последней пачки")
+    parser.add_argument('--max-retries', type=int, default=MAX_RETRIES,
+                        help="повторы пачки (куска) при обрыве соединения в режимах --checkpoint и --pipeline")
+    parser.add_argument('--retry-backoff', type=float, default=RETRY_BACKOFF_SECONDS,
+                        help="начальная задержка повтора в секундах (удваивается с каждой попыткой)")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="конвейерная загрузка: чтение кусками, преобразование и запись в БД одновременно")
+    parser.add_argument('--chunk-rows', type=int, default=PIPELINE_CHUNK_ROWS,
+                        help="строк в куске (и транзакции записи) в режиме --pipeline")
+    parser.add_argument('--transform-workers', type=int, default=PIPELINE_TRANSFORM_WORKERS,
+                        help="процессов преобразования в режиме --pipeline (0 - в основном процессе)")
+    parser.add_argument('--writers', type=int, default=PIPELINE_WRITERS,
+                        help="соединений записи в режиме --pipeline")
+    parser.add_argument('--queue-depth', type=int, default=PIPELINE_QUEUE_DEPTH,
+                        help="готовых к записи кусков в очереди в режиме --pipeline (ограничивает память)")
+    parser.add_argument('--metrics-file', default=METRICS_FILE,
+                        help="файл метрик стадий (JSON-строки; пустая строка - не записывать)")
+    parser.add_argument('--profile-stage', choices=LOAD_STAGES + ('detach',), default=None,
+                        help="профилировать стадию cProfile (профиль сохраняется в .prof)")
+    return parser.parse_args()
 
 if __name__ == "__main__":
+    args = parse_args()
+    
     print("=" * 50)
     print("ЗАГРУЗКА ДАННЫХ НЕДВИЖИМОСТИ В БАЗУ ДАННЫХ")
     print("=" * 50)
@@ -253,15 +1487,40 @@ if __name__ == "__main__":
         print("Не удалось подключиться к БД. Проверьте настройки.")
         exit(1)
     
-    # Исправляем данные в CSV
-    fixed_csv = fix_csv_data()
-    
-    # Загружаем данные
+    # Загружаем данные (поправки area/price_per_sqm делает transform_fact_frame,
+    # пропуски и ошибки показывает отчет проверок целостности)
+    metrics = PipelineMetrics('load', metrics_file=args.metrics_file or None, profile_stage=args.profile_stage)
     try:
-        load_csv_to_db(fixed_csv)
+        if args.pipeline:
+            if args.checkpoint or args.parallel or args.attach_partitions or args.incremental:
+                raise ValueError("--pipeline несовместим с --checkpoint, --parallel, --attach-partitions и --incremental")
+            pipelined_load_csv_to_db(args.source, bulk=args.bulk, chunk_rows=args.chunk_rows,
+                                     transform_workers=args.transform_workers, writers=args.writers,
+                                     queue_depth=args.queue_depth, auto_dimensions=not args.no_auto_dimensions,
+                                     deduplicate=not args.no_dedup, metrics=metrics, max_retries=args.max_retries,
+                                     retry_backoff=args.retry_backoff)
+        else:
+            load_csv_to_db(args.source, bulk=args.bulk, commit_rows=args.commit_rows, incremental=args.incremental,
+                           parallel=args.parallel, partition_by=args.partition_by,
+                           auto_dimensions=not args.no_auto_dimensions, attach_partitions=args.attach_partitions,
+                           deduplicate=not args.no_dedup, metrics=metrics, checkpoint=args.checkpoint,
+                           max_retries=args.max_retries, retry_backoff=args.retry_backoff)
+        
+        # Старые месяцы отсоединяем от таблицы фактов (и при необходимости архивируем)
+        if args.detach_before:
+            with metrics.stage('detach'), pooled_connection() as conn:
+                cursor = conn.cursor()
+                detached = detach_old_partitions(cursor, args.detach_before, args.archive_schema)
+                if detached:
+                    bump_load_generation(cursor)
+                conn.commit()
+                cursor.close()
+            print(f"Отсоединено секций: {len(detached)}" + (f" ({', '.join(detached)})" if detached else ""))
         print("\nГотово!")
     except FileNotFoundError:
         print("Ошибка: CSV файл не найден!")
         print("Сначала запустите скрипт создания датасета.")
     except Exception as e:
-        print(f"Ошибка: {e}")
\ No newline at end of file
+        print(f"Ошибка: {e}")
+    finally:
+        metrics.summary()
\ No newline at end of file
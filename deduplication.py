@@ -0,0 +1,166 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Связи дубликатов с каноническим объявлением
+DUPLICATE_LINKS_TABLE = 'fact_duplicate_links'
+
+# Колонки ключа блокировки: дубликаты ищутся только внутри блока
+BLOCKING_COLUMNS = ['district', 'address_key', 'property_type', 'area_key', 'floor_key']
+
+# Допустимое относительное расхождение цен и порог итоговой оценки сходства
+PRICE_TOLERANCE = 0.05
+DUPLICATE_THRESHOLD = 0.8
+
+# Веса признаков в оценке сходства
+PRICE_WEIGHT = 0.6
+URL_WEIGHT = 0.4
+
+# Сокращения в адресах приводятся к одному виду
+ADDRESS_REPLACEMENTS = [(re.compile(pattern), replacement) for pattern, replacement in [
+    (r'ё', 'е'),
+    (r'(\bг\.?\s*)?\bмосква\b', ''),
+    (r'\bулица\b|\bул\b\.?', 'ул '),
+    (r'\bпроспект\b|\bпр-т\b|\bпросп\b\.?', 'пр '),
+    (r'\bдом\b|\bд\b\.?', 'д '),
+    (r'\bкорпус\b|\bкорп\b\.?|\bк\b\.?', 'к '),
+    (r'[^\w\s]', ' '),
+    (r'(?<=[^\W\d_])(?=\d)', ' '),
+    (r'\s+', ' ')
+]]
+
+UPSERT_LINKS_QUERY = f"""
+    INSERT INTO {DUPLICATE_LINKS_TABLE} (external_id, canonical_external_id, similarity)
+    SELECT * FROM unnest(%s::text[], %s::text[], %s::numeric[])
+    ON CONFLICT (external_id) DO UPDATE SET
+        canonical_external_id = EXCLUDED.canonical_external_id,
+        similarity = EXCLUDED.similarity,
+        linked_at = CURRENT_TIMESTAMP
+"""
+
+def ensure_deduplication_objects(cursor):
+    """Таблица связей дубликатов (для баз, созданных до ее появления в скрипте восстановления)"""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DUPLICATE_LINKS_TABLE} (
+            external_id VARCHAR(100) PRIMARY KEY,
+            canonical_external_id VARCHAR(100) NOT NULL,
+            similarity DECIMAL(4,3) NOT NULL,
+            linked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def _normalize_one_address(address):
+    address = address.lower()
+    for pattern, replacement in ADDRESS_REPLACEMENTS:
+        address = pattern.sub(replacement, address)
+    return address.strip()
+
+def normalize_address(addresses):
+    """Адрес без регистра, пунктуации и различий в сокращениях.
+    Нормализуются только уникальные адреса (их намного меньше, чем строк)"""
+    codes, uniques = pd.factorize(addresses)
+    normalized = np.array([_normalize_one_address(str(address)) for address in uniques] + [None], dtype=object)
+    return pd.Series(normalized[codes], index=addresses.index)
+
+def url_slug(urls):
+    """Путь объявления без числового id в конце (тип, комнаты, площадь, этажи)"""
+    return urls.astype(object).str.replace(r'^https?://[^/]+/', '', regex=True).str.replace(r'\.\d+$', '', regex=True)
+
+def _blocking_keys(df):
+    """Целочисленные коды колонок ключа блокировки (порядок BLOCKING_COLUMNS);
+    строки без площади или адреса в блоки не попадают"""
+    area = pd.to_numeric(df['area'], errors='coerce')
+    floor = pd.to_numeric(df['floor'], errors='coerce') if 'floor' in df.columns else pd.Series(np.nan, index=df.index)
+    address = normalize_address(df['address'])
+    keys = [
+        pd.factorize(df['district'])[0],
+        pd.factorize(address)[0],
+        pd.factorize(df['property_type'])[0],
+        area.round().fillna(-1).to_numpy(dtype=np.int64),
+        floor.round().fillna(-1000).to_numpy(dtype=np.int64)
+    ]
+    blockable = area.notna().to_numpy() & address.notna().to_numpy() & (address != '').to_numpy()
+    return keys, blockable
+
+def find_duplicates(df, price_tolerance=PRICE_TOLERANCE, threshold=DUPLICATE_THRESHOLD):
+    """Поиск дубликатов объявлений за O(n log n).
+
+    Строки делятся на блоки по BLOCKING_COLUMNS и сортируются по цене внутри
+    блока; сравниваются только соседние строки (сортированное окрестное
+    окно), поэтому цепочка похожих соседей образует кластер. Оценка сходства:
+    близость цен (с весом PRICE_WEIGHT) и совпадение пути url без id
+    (URL_WEIGHT). Каноническое объявление кластера - самое раннее по
+    publish_date (при равенстве - первое в источнике).
+
+    Возвращает DataFrame дубликатов: external_id, canonical_external_id,
+    similarity (индекс - индекс строки дубликата в df).
+    """
+    empty = pd.DataFrame(columns=['external_id', 'canonical_external_id', 'similarity'])
+    if not len(df):
+        return empty
+    keys, blockable = _blocking_keys(df)
+    positions = np.flatnonzero(blockable)
+    if len(positions) < 2:
+        return empty
+
+    # Сортировка по ключу блока, внутри блока - по цене
+    price = pd.to_numeric(df['price'], errors='coerce').to_numpy(dtype=float)[positions]
+    keys = [key[positions] for key in keys]
+    order = np.lexsort([price] + keys[::-1])
+    positions, price, keys = positions[order], price[order], [key[order] for key in keys]
+    same_block = np.ones(len(positions), dtype=bool)
+    same_block[0] = False
+    for key in keys:
+        same_block[1:] &= key[1:] == key[:-1]
+
+    # Сходство каждой строки с предыдущей в порядке сортировки
+    previous_price = np.r_[np.nan, price[:-1]]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        price_gap = np.abs(price - previous_price) / np.maximum(price, previous_price)
+    price_score = np.clip(1 - price_gap / price_tolerance, 0, 1)
+    candidate = same_block & (price_gap <= price_tolerance)
+
+    # url сравниваем только у пар-кандидатов
+    same_slug = np.zeros(len(positions), dtype=bool)
+    if 'url' in df.columns and candidate.any():
+        pairs = np.flatnonzero(candidate)
+        slugs = url_slug(df['url'].iloc[positions[np.r_[pairs - 1, pairs]]]).to_numpy(dtype=object)
+        previous_slugs, slugs = slugs[:len(pairs)], slugs[len(pairs):]
+        same_slug[pairs] = pd.notna(slugs) & (slugs == previous_slugs)
+    similarity = PRICE_WEIGHT * np.nan_to_num(price_score) + URL_WEIGHT * same_slug
+    linked = candidate & (similarity >= threshold)
+
+    # Кластер - непрерывная цепочка связанных соседей
+    cluster = np.cumsum(~linked)
+    in_cluster = np.r_[linked[1:], False] | linked
+    if not in_cluster.any():
+        return empty
+    members = pd.DataFrame({
+        'row': positions[in_cluster],
+        'cluster': cluster[in_cluster],
+        'similarity': np.where(linked, similarity, 1.0)[in_cluster],
+        'publish_date': pd.to_datetime(df['publish_date']).to_numpy()[positions[in_cluster]]
+    }).sort_values(['cluster', 'publish_date', 'row'], kind='stable')
+
+    canonical_row = members.groupby('cluster')['row'].transform('first').to_numpy()
+    duplicates = members[members['row'].to_numpy() != canonical_row]
+    canonical_row = canonical_row[members['row'].to_numpy() != canonical_row]
+    external_ids = df['id'].astype(str).to_numpy()
+    return pd.DataFrame({
+        'external_id': external_ids[duplicates['row'].to_numpy()],
+        'canonical_external_id': external_ids[canonical_row],
+        'similarity': duplicates['similarity'].round(3).to_numpy()
+    }, index=df.index[duplicates['row'].to_numpy()])
+
+def save_duplicate_links(cursor, links):
+    """Запись связей дубликат -> каноническое объявление (в транзакции загрузки)"""
+    if not len(links):
+        return 0
+    ensure_deduplication_objects(cursor)
+    cursor.execute(UPSERT_LINKS_QUERY, (
+        links['external_id'].tolist(),
+        links['canonical_external_id'].tolist(),
+        links['similarity'].astype(float).tolist()
+    ))
+    return len(links)
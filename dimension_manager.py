@@ -0,0 +1,157 @@
+import os
+import pickle
+
+import pandas as pd
+
+# Файл кэша ключей справочников между запусками
+DIMENSION_CACHE_FILE = 'dimension_cache.pkl'
+
+# Допустимые значения district_type (CHECK в dim_districts)
+DISTRICT_TYPES = ('ЦАО', 'САО', 'СВАО', 'ВАО', 'ЮВАО', 'ЮАО', 'ЮЗАО', 'ЗАО', 'СЗАО', 'НАО')
+
+# Справочник -> (таблица, колонка ключа, колонка id)
+DIMENSIONS = {
+    'districts': ('dim_districts', 'district_name', 'district_id'),
+    'property_types': ('dim_property_types', 'property_type_name', 'property_type_id'),
+    'house_types': ('dim_house_types', 'house_type_name', 'house_type_id'),
+    'dates': ('dim_time', 'full_date', 'date_id')
+}
+
+# Set-based добавление новых членов справочников (по одному запросу на справочник)
+INSERT_QUERIES = {
+    'districts': """
+        INSERT INTO dim_districts (district_name, district_type)
+        SELECT name, name FROM unnest(%s::text[]) AS name
+        ON CONFLICT (district_name) DO NOTHING
+        RETURNING district_name, district_id
+    """,
+    'property_types': """
+        INSERT INTO dim_property_types (property_category, property_type_name)
+        SELECT category, name FROM unnest(%s::text[], %s::text[]) AS t(category, name)
+        ON CONFLICT (property_type_name) DO NOTHING
+        RETURNING property_type_name, property_type_id
+    """,
+    'house_types': """
+        INSERT INTO dim_house_types (house_type_name)
+        SELECT name FROM unnest(%s::text[]) AS name
+        ON CONFLICT (house_type_name) DO NOTHING
+        RETURNING house_type_name, house_type_id
+    """,
+    # Те же поля, что и при наполнении dim_time в скрипте восстановления БД
+    'dates': """
+        INSERT INTO dim_time (full_date, day, month, year, quarter, day_of_week, is_weekend)
+        SELECT
+            date,
+            EXTRACT(DAY FROM date),
+            EXTRACT(MONTH FROM date),
+            EXTRACT(YEAR FROM date),
+            EXTRACT(QUARTER FROM date),
+            TO_CHAR(date, 'Day'),
+            EXTRACT(ISODOW FROM date) IN (6,7)
+        FROM unnest(%s::date[]) AS date
+        ON CONFLICT (full_date) DO NOTHING
+        RETURNING full_date, date_id
+    """
+}
+
+class DimensionManager:
+    """Кэш ключей справочников dim_* с автоматическим добавлением новых значений.
+
+    Кэш версионируется парой (число строк, max id) по каждому справочнику:
+    таблица перечитывается только если версия в БД изменилась. Между
+    запусками кэш хранится в файле cache_file.
+    """
+
+    def __init__(self, database_key, cache_file=DIMENSION_CACHE_FILE):
+        self.database_key = database_key
+        self.cache_file = cache_file
+        self.maps = {name: {} for name in DIMENSIONS}
+        self.versions = {name: None for name in DIMENSIONS}
+        self._load_cache()
+
+    def _load_cache(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        with open(self.cache_file, 'rb') as f:
+            cached = pickle.load(f)
+        # Кэш другой базы данных не используем
+        if cached.get('database_key') == self.database_key:
+            self.maps = cached['maps']
+            self.versions = cached['versions']
+
+    def save(self):
+        """Атомарная запись кэша на диск"""
+        if not self.cache_file:
+            return
+        tmp_file = f"{self.cache_file}.tmp"
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({'database_key': self.database_key, 'maps': self.maps, 'versions': self.versions}, f)
+        os.replace(tmp_file, self.cache_file)
+
+    def _read_versions(self, cursor):
+        parts = [f"(SELECT COUNT(*) || ':' || COALESCE(MAX({id_column}), 0) FROM {table})"
+                 for table, _, id_column in DIMENSIONS.values()]
+        cursor.execute("SELECT " + ", ".join(parts))
+        return dict(zip(DIMENSIONS, cursor.fetchone()))
+
+    def refresh(self, cursor):
+        """Перечитывает только те справочники, версия которых изменилась. Возвращает их список"""
+        reloaded = []
+        for name, version in self._read_versions(cursor).items():
+            if self.versions[name] == version:
+                continue
+            table, key_column, id_column = DIMENSIONS[name]
+            cursor.execute(f"SELECT {key_column}, {id_column} FROM {table}")
+            self.maps[name] = {key: id for key, id in cursor.fetchall()}
+            self.versions[name] = version
+            reloaded.append(name)
+        return reloaded
+
+    def _insert_members(self, cursor, name, params, keys):
+        table, key_column, id_column = DIMENSIONS[name]
+        cursor.execute(INSERT_QUERIES[name], params)
+        self.maps[name].update({key: id for key, id in cursor.fetchall()})
+        # Значения, добавленные другим процессом после refresh, дочитываем отдельно
+        missing = [key for key in keys if key not in self.maps[name]]
+        if missing:
+            cursor.execute(f"SELECT {key_column}, {id_column} FROM {table} WHERE {key_column} = ANY(%s)", (missing,))
+            self.maps[name].update({key: id for key, id in cursor.fetchall()})
+
+    def ensure_members(self, cursor, df):
+        """Добавляет в справочники значения из датасета, которых там еще нет.
+
+        Районы вне списка DISTRICT_TYPES не добавляются (их не пропустит CHECK
+        в dim_districts). Возвращает число добавленных значений по справочникам.
+        """
+        added = {}
+
+        districts = [d for d in df['district'].dropna().unique() if d not in self.maps['districts'] and d in DISTRICT_TYPES]
+        if districts:
+            self._insert_members(cursor, 'districts', (districts,), districts)
+        added['districts'] = len(districts)
+
+        types = pd.DataFrame(columns=['property_category', 'property_type'])
+        if 'property_category' in df.columns:
+            types = df[['property_category', 'property_type']].dropna().drop_duplicates()
+            types = types[~types['property_type'].isin(list(self.maps['property_types']))]
+        if len(types):
+            self._insert_members(cursor, 'property_types',
+                                 (types['property_category'].tolist(), types['property_type'].tolist()),
+                                 types['property_type'].tolist())
+        added['property_types'] = len(types)
+
+        house_types = []
+        if 'house_type' in df.columns:
+            house_types = [h for h in df['house_type'].dropna().unique() if h not in self.maps['house_types']]
+        if house_types:
+            self._insert_members(cursor, 'house_types', (house_types,), house_types)
+        added['house_types'] = len(house_types)
+
+        dates = [d for d in pd.to_datetime(df['publish_date']).dt.date.dropna().unique() if d not in self.maps['dates']]
+        if dates:
+            self._insert_members(cursor, 'dates', (dates,), dates)
+        added['dates'] = len(dates)
+
+        if any(added.values()):
+            self.versions = self._read_versions(cursor)
+        return added
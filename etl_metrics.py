@@ -0,0 +1,154 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Структурный лог стадий: одна JSON-строка на стадию и итог по запуску
+METRICS_FILE = 'etl_metrics.jsonl'
+
+# Сколько функций показывать из профиля стадии
+PROFILE_TOP_FUNCTIONS = 20
+
+# Счетчик обращений к БД (execute/COPY), общий для всех потоков процесса
+_round_trips_lock = threading.Lock()
+_round_trips_value = 0
+
+def record_round_trip(count=1):
+    global _round_trips_value
+    with _round_trips_lock:
+        _round_trips_value += count
+
+def round_trips():
+    return _round_trips_value
+
+def peak_rss_mb():
+    """Пиковая память процесса (ru_maxrss: в Linux - килобайты, в macOS - байты)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def path_size(path):
+    """Размер файла или каталога (parquet-датасета) в байтах"""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+class StageRecord:
+    """Метрики одной стадии; rows_out, bytes_read и пропуски заполняет код стадии"""
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes_read = None
+        self.skipped = {}
+
+    def skip(self, reason, count):
+        """Учет пропущенных строк с причиной"""
+        count = int(count)
+        if count:
+            self.skipped[reason] = self.skipped.get(reason, 0) + count
+
+class PipelineMetrics:
+    """Инструментирование стадий ETL.
+
+    stage() оборачивает стадию: длительность, строки на входе и выходе,
+    пропуски по причинам, прочитанные байты, обращения к БД и рост пиковой
+    памяти процесса. Каждая стадия пишется строкой JSON в metrics_file
+    (None - только вывод на экран), summary() печатает таблицу стадий.
+    profile_stage - имя стадии, которую нужно профилировать cProfile:
+    профиль сохраняется в profile_<запуск>_<стадия>.prof, самые затратные
+    функции печатаются.
+    """
+
+    def __init__(self, pipeline, metrics_file=METRICS_FILE, profile_stage=None):
+        self.pipeline = pipeline
+        self.run_id = f"{pipeline}-{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+        self.metrics_file = metrics_file
+        self.profile_stage = profile_stage
+        self.stages = []
+        self.started = time.perf_counter()
+
+    def _write(self, entry):
+        if self.metrics_file:
+            with open(self.metrics_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        record = StageRecord(name, rows_in)
+        profiler = cProfile.Profile() if name == self.profile_stage else None
+        trips_before, peak_before = round_trips(), peak_rss_mb()
+        status = 'ok'
+        started_at, started = datetime.now().isoformat(timespec='seconds'), time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield record
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            if profiler:
+                profiler.disable()
+            seconds = time.perf_counter() - started
+            rows = record.rows_out if record.rows_out is not None else record.rows_in
+            entry = {
+                'run_id': self.run_id,
+                'pipeline': self.pipeline,
+                'stage': name,
+                'status': status,
+                'started_at': started_at,
+                'seconds': round(seconds, 4),
+                'rows_in': record.rows_in,
+                'rows_out': record.rows_out,
+                'rows_per_sec': round(rows / seconds) if rows and seconds else None,
+                'skipped': record.skipped,
+                'bytes_read': record.bytes_read,
+                'db_round_trips': round_trips() - trips_before,
+                'peak_rss_mb': round(peak_rss_mb(), 1),
+                'peak_rss_growth_mb': round(peak_rss_mb() - peak_before, 1)
+            }
+            self.stages.append(entry)
+            self._write(entry)
+            if profiler:
+                self._dump_profile(name, profiler)
+
+    def _dump_profile(self, name, profiler):
+        profile_file = f"profile_{self.run_id}_{name}.prof"
+        profiler.dump_stats(profile_file)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        print(f"\nПрофиль стадии {name} (сохранен в {profile_file}):")
+        print(output.getvalue())
+
+    def summary(self):
+        """Таблица стадий и итоговая строка запуска в metrics_file"""
+        total = time.perf_counter() - self.started
+        print(f"\nМЕТРИКИ СТАДИЙ ({self.run_id}):")
+        print(f"  {'стадия':<18} {'сек':>9} {'доля':>6} {'вход':>10} {'выход':>10} {'к БД':>7} {'пик, МБ':>9}")
+        for entry in self.stages:
+            share = entry['seconds'] / total * 100 if total else 0
+            print(f"  {entry['stage']:<18} {entry['seconds']:9.3f} {share:5.1f}% "
+                  f"{'' if entry['rows_in'] is None else entry['rows_in']:>10} "
+                  f"{'' if entry['rows_out'] is None else entry['rows_out']:>10} "
+                  f"{entry['db_round_trips']:>7} {entry['peak_rss_mb']:>9,.0f}"
+                  + (" ОШИБКА" if entry['status'] != 'ok' else ""))
+            for reason, count in entry['skipped'].items():
+                print(f"      пропущено {count}: {reason}")
+        print(f"  {'всего':<18} {total:9.3f}")
+        self._write({
+            'run_id': self.run_id,
+            'pipeline': self.pipeline,
+            'stage': 'total',
+            'status': 'error' if any(entry['status'] != 'ok' for entry in self.stages) else 'ok',
+            'seconds': round(total, 4),
+            'db_round_trips': sum(entry['db_round_trips'] for entry in self.stages),
+            'peak_rss_mb': round(peak_rss_mb(), 1)
+        })
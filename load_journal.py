@@ -0,0 +1,121 @@
+import hashlib
+import os
+import random
+
+import psycopg2
+
+# Журнал загрузок: источник, отпечаток файла и последняя зафиксированная позиция
+JOURNAL_TABLE = 'etl_load_journal'
+
+# Ошибки, после которых пачку имеет смысл повторить на новом соединении
+# (обрыв связи, рестарт сервера, взаимоблокировка, конфликт сериализации)
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+# Повторы пачки: число попыток и задержка (растет вдвое, не больше RETRY_BACKOFF_MAX_SECONDS)
+MAX_RETRIES = 5
+RETRY_BACKOFF_SECONDS = 1.0
+RETRY_BACKOFF_MAX_SECONDS = 60.0
+
+# Чтение источника для отпечатка
+FINGERPRINT_CHUNK_BYTES = 1 << 20
+
+def ensure_journal_objects(cursor):
+    """Таблица журнала (для баз, созданных до ее появления в скрипте восстановления)"""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {JOURNAL_TABLE} (
+            load_id BIGSERIAL PRIMARY KEY,
+            source_path TEXT NOT NULL,
+            source_fingerprint VARCHAR(64) NOT NULL,
+            load_options VARCHAR(200) NOT NULL,
+            total_rows BIGINT NOT NULL,
+            batch_rows INTEGER NOT NULL,
+            committed_rows BIGINT NOT NULL DEFAULT 0,
+            committed_batches INTEGER NOT NULL DEFAULT 0,
+            retries INTEGER NOT NULL DEFAULT 0,
+            status VARCHAR(20) NOT NULL DEFAULT 'running',
+            last_error TEXT,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_load_journal_fingerprint
+        ON {JOURNAL_TABLE}(source_fingerprint, status)
+    """)
+
+def source_fingerprint(path):
+    """blake2b содержимого файла или всех файлов parquet-каталога (с относительными путями)"""
+    digest = hashlib.blake2b(digest_size=32)
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+    for file_path in files:
+        if file_path != path:
+            digest.update(os.path.relpath(file_path, path).encode('utf-8'))
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(FINGERPRINT_CHUNK_BYTES), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def start_or_resume_load(cursor, source_path, fingerprint, load_options, total_rows, batch_rows):
+    """Незавершенная загрузка того же источника с теми же параметрами продолжается
+    с зафиксированной позиции, иначе заводится новая запись журнала.
+    Возвращает (load_id, committed_rows)"""
+    ensure_journal_objects(cursor)
+    cursor.execute(f"""
+        SELECT load_id, committed_rows FROM {JOURNAL_TABLE}
+        WHERE source_fingerprint = %s AND load_options = %s AND total_rows = %s AND batch_rows = %s
+            AND status IN ('running', 'failed')
+        ORDER BY load_id DESC
+        LIMIT 1
+    """, (fingerprint, load_options, total_rows, batch_rows))
+    found = cursor.fetchone()
+    if found:
+        cursor.execute(f"""
+            UPDATE {JOURNAL_TABLE} SET status = 'running', updated_at = CURRENT_TIMESTAMP
+            WHERE load_id = %s
+        """, (found[0],))
+        return found[0], found[1]
+
+    # Прежние незавершенные загрузки этого файла больше не продолжатся
+    cursor.execute(f"""
+        UPDATE {JOURNAL_TABLE} SET status = 'superseded', updated_at = CURRENT_TIMESTAMP
+        WHERE source_path = %s AND status IN ('running', 'failed')
+    """, (source_path,))
+    cursor.execute(f"""
+        INSERT INTO {JOURNAL_TABLE} (source_path, source_fingerprint, load_options, total_rows, batch_rows)
+        VALUES (%s, %s, %s, %s, %s)
+        RETURNING load_id
+    """, (source_path, fingerprint, load_options, total_rows, batch_rows))
+    return cursor.fetchone()[0], 0
+
+def record_checkpoint(cursor, load_id, committed_rows, retries=0):
+    """Позиция после пачки; фиксируется в одной транзакции с самой пачкой"""
+    cursor.execute(f"""
+        UPDATE {JOURNAL_TABLE} SET
+            committed_rows = %s,
+            committed_batches = committed_batches + 1,
+            retries = retries + %s,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE load_id = %s
+    """, (committed_rows, retries, load_id))
+
+def record_failure(cursor, load_id, error):
+    cursor.execute(f"""
+        UPDATE {JOURNAL_TABLE} SET status = 'failed', last_error = %s, updated_at = CURRENT_TIMESTAMP
+        WHERE load_id = %s
+    """, (str(error)[:2000], load_id))
+
+def record_completed(cursor, load_id):
+    cursor.execute(f"""
+        UPDATE {JOURNAL_TABLE} SET status = 'completed', last_error = NULL,
+            updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+        WHERE load_id = %s
+    """, (load_id,))
+
+def retry_delay(attempt, backoff=RETRY_BACKOFF_SECONDS):
+    """Экспоненциальная задержка перед попыткой attempt (1, 2, ...) со случайным разбросом,
+    чтобы параллельные загрузчики не повторяли одновременно"""
+    return min(backoff * 2 ** (attempt - 1), RETRY_BACKOFF_MAX_SECONDS) * random.uniform(0.5, 1.0)
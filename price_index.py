@@ -0,0 +1,367 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset_storage import iter_dataset_chunks
+from sketches import SKETCH_BINS, bin_values, sketch_bins
+
+# Файл индекса цен (сжатый npz)
+PRICE_INDEX_FILE = 'price_index.npz'
+
+# Ряды строятся по району x типу недвижимости, мера - цена за м² (только положительная)
+GROUP_COLUMNS = ('district', 'property_type')
+INDEX_COLUMNS = ['district', 'property_type', 'publish_date', 'price_per_sqm']
+
+# Скользящие окна (дней, включая день окончания) и все ряды индекса
+ROLLING_WINDOWS = (7, 30, 90)
+SERIES = ('day',) + tuple(f"rolling_{window}" for window in ROLLING_WINDOWS) + ('month',)
+SERIES_STATS = ('count', 'mean', 'median')
+
+# День упаковывается в ключ корзины как номер дня от 1970-01-01 (< 2^17, до 2328 года)
+DAY_SPAN = 1 << 17
+
+# Строк источника в одном куске при построении из датасета
+SOURCE_CHUNK_ROWS = 500000
+
+def _epoch_days(dates):
+    """Даты -> номер дня от 1970-01-01 (NaT -> -1)"""
+    dates = pd.to_datetime(pd.Series(dates), errors='coerce')
+    if isinstance(dates.dtype, pd.CategoricalDtype):
+        dates = dates.astype(dates.cat.categories.dtype)
+    days = dates.to_numpy(dtype='datetime64[D]')
+    return np.where(np.isnat(days), -1, days.astype(np.int64))
+
+def _month_of(days):
+    """Номер дня -> номер месяца от 1970-01"""
+    return np.asarray(days, dtype=np.int64).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+def _month_start(months):
+    """Номер месяца -> номер его первого дня"""
+    return np.asarray(months, dtype=np.int64).astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+
+def _histogram_stats(hist, bins, sums):
+    """count, mean, median по строкам гистограмм hist (колонки - корзины bins скетча).
+
+    Среднее точное (по суммам sums), медиана - представитель корзины
+    (погрешность около 1%, как у скетчей загрузки)."""
+    count = hist.sum(axis=1)
+    cumulative = np.cumsum(hist, axis=1)
+    rank = 0.5 * (count - 1)
+    median_bin = bins[(cumulative > rank[:, None]).argmax(axis=1)] if len(bins) else np.zeros(len(count), dtype=np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, sums / count, np.nan)
+    median = np.where(count > 0, bin_values(median_bin), np.nan)
+    return np.stack([count, mean, median], axis=1)
+
+class PriceIndex:
+    """Индекс цен за м² по району x типу: дневной и месячный ряд и скользящие
+    окна ROLLING_WINDOWS (count, mean, median на каждую дату окончания).
+
+    Основа индекса - дневные гистограммы цены за м² в логарифмических
+    корзинах скетчей (хранятся разреженно: ненулевые корзины) и точные
+    дневные суммы. Окна и месяцы складываются из дней, поэтому update
+    заменяет только переданные дни групп и пересчитывает лишь затронутые
+    даты рядов: сами дни, окна, которые их покрывают, и их месяцы (а при
+    росте оси дней - окна всех групп, доходящие до новых дат).
+    """
+
+    def __init__(self):
+        self.groups = []
+        self.group_index = {}
+        # Ненулевые корзины: ключ (группа, день, корзина) по возрастанию и счетчик
+        self.entry_keys = np.empty(0, dtype=np.int64)
+        self.entry_counts = np.empty(0, dtype=np.int64)
+        # Ось дней [first_day, first_day + n_days) и месяцев [first_month, ...)
+        self.first_day = None
+        self.first_month = None
+        self.day_count = np.zeros((0, 0), dtype=np.int64)
+        self.day_sum = np.zeros((0, 0))
+        self.series = {name: np.full((0, 0, len(SERIES_STATS)), np.nan) for name in SERIES}
+
+    def __len__(self):
+        return len(self.groups)
+
+    @property
+    def n_days(self):
+        return self.day_count.shape[1]
+
+    # --- Оси групп и дат ---
+
+    def _group_rows(self, labels):
+        """Номера групп (новые группы добавляются пустыми строками всех массивов)"""
+        rows = []
+        for label in labels:
+            if label not in self.group_index:
+                self.group_index[label] = len(self.groups)
+                self.groups.append(label)
+            rows.append(self.group_index[label])
+        added = len(self.groups) - len(self.day_count)
+        if added > 0:
+            self.day_count = np.vstack([self.day_count, np.zeros((added, self.n_days), dtype=np.int64)])
+            self.day_sum = np.vstack([self.day_sum, np.zeros((added, self.n_days))])
+            for name, values in self.series.items():
+                self.series[name] = np.concatenate([values, np.full((added,) + values.shape[1:], np.nan)])
+        return np.array(rows, dtype=np.int64)
+
+    def _extend_days(self, day_min, day_max):
+        """Расширяет оси дней и месяцев, чтобы они покрывали [day_min, day_max]"""
+        day_min, day_max = int(day_min), int(day_max)
+        if self.first_day is None:
+            self.first_day, self.first_month = day_min, int(_month_of(day_min))
+        before = max(0, self.first_day - day_min)
+        after = max(0, day_max - (self.first_day + self.n_days - 1))
+        if before or after:
+            self.day_count = np.pad(self.day_count, ((0, 0), (before, after)))
+            self.day_sum = np.pad(self.day_sum, ((0, 0), (before, after)))
+            for name in SERIES[:-1]:
+                self.series[name] = np.pad(self.series[name], ((0, 0), (before, after), (0, 0)),
+                                           constant_values=np.nan)
+            self.first_day -= before
+
+        n_months = self.series['month'].shape[1]
+        before = max(0, self.first_month - int(_month_of(day_min)))
+        after = max(0, int(_month_of(day_max)) - (self.first_month + n_months - 1))
+        if before or after:
+            self.series['month'] = np.pad(self.series['month'], ((0, 0), (before, after), (0, 0)),
+                                          constant_values=np.nan)
+            self.first_month -= before
+
+    def _rows(self, df):
+        """Группа, день и цена за м² строк df (строки без группы или даты отбрасываются)"""
+        district_codes, districts = pd.factorize(df[GROUP_COLUMNS[0]])
+        type_codes, types = pd.factorize(df[GROUP_COLUMNS[1]])
+        days = _epoch_days(df['publish_date'])
+        valid = (district_codes >= 0) & (type_codes >= 0) & (days >= 0)
+        pairs, inverse = np.unique(district_codes[valid] * len(types) + type_codes[valid], return_inverse=True)
+        labels = [(str(districts[pair // len(types)]), str(types[pair % len(types)])) for pair in pairs]
+        groups = self._group_rows(labels)[inverse.reshape(-1)]
+        values = pd.to_numeric(df['price_per_sqm'], errors='coerce').to_numpy(dtype=float)[valid]
+        return groups, days[valid], values
+
+    # --- Накопление ---
+
+    def _entry_positions(self, pairs):
+        """Позиции корзин дней pairs (ключи группа * DAY_SPAN + день, по возрастанию) в entry_keys"""
+        starts = np.searchsorted(self.entry_keys, pairs * SKETCH_BINS)
+        lengths = np.searchsorted(self.entry_keys, (pairs + 1) * SKETCH_BINS) - starts
+        # Подряд идущие диапазоны [start, start + length) одним массивом
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return np.repeat(starts, lengths) + offsets
+
+    def _add(self, groups, days, values):
+        """Добавляет строки в дневные гистограммы и суммы"""
+        if not len(groups):
+            return
+        self._extend_days(days.min(), days.max())
+        positive = np.isfinite(values) & (values > 0)
+        groups, days, values = groups[positive], days[positive], values[positive]
+        np.add.at(self.day_count, (groups, days - self.first_day), 1)
+        np.add.at(self.day_sum, (groups, days - self.first_day), values)
+        # Новые корзины вливаются в отсортированные entry_keys без пересортировки всей истории
+        keys, counts = np.unique((groups * DAY_SPAN + days) * SKETCH_BINS + sketch_bins(values), return_counts=True)
+        positions = np.searchsorted(self.entry_keys, keys)
+        found = positions < len(self.entry_keys)
+        found[found] = self.entry_keys[positions[found]] == keys[found]
+        self.entry_counts[positions[found]] += counts[found]
+        self.entry_keys = np.insert(self.entry_keys, positions[~found], keys[~found])
+        self.entry_counts = np.insert(self.entry_counts, positions[~found], counts[~found])
+
+    def _tail_pairs(self, end):
+        """Дни групп с данными, окна которых доходят до дней от end и позже"""
+        low = max(end - max(ROLLING_WINDOWS) + 1, self.first_day) - self.first_day
+        groups, positions = np.nonzero(self.day_count[:, low:end - self.first_day] > 0)
+        return groups * DAY_SPAN + self.first_day + low + positions
+
+    def update(self, df):
+        """Полные данные за дни df заменяют прежние данные этих дней по группам df
+        (повторная загрузка дня не задваивает его). Пересчитываются только
+        затронутые даты рядов"""
+        if not len(df):
+            return self
+        groups, days, values = self._rows(df)
+        if not len(groups):
+            return self
+        end = None if self.first_day is None else self.first_day + self.n_days
+        self._extend_days(days.min(), days.max())
+        pairs = np.unique(groups * DAY_SPAN + days)
+        positions = self._entry_positions(pairs)
+        self.entry_keys = np.delete(self.entry_keys, positions)
+        self.entry_counts = np.delete(self.entry_counts, positions)
+        self.day_count[pairs // DAY_SPAN, pairs % DAY_SPAN - self.first_day] = 0
+        self.day_sum[pairs // DAY_SPAN, pairs % DAY_SPAN - self.first_day] = 0.0
+        self._add(groups, days, values)
+        # Ось дней выросла вперед: окна остальных групп тоже доходят до новых дат окончания
+        if end is not None and self.first_day + self.n_days > end:
+            pairs = np.union1d(pairs, self._tail_pairs(end))
+        self._refresh(pairs)
+        return self
+
+    @classmethod
+    def from_frames(cls, frames):
+        """Построение с нуля по кускам (колонки INDEX_COLUMNS); один день может быть в разных кусках"""
+        index = cls()
+        pairs = []
+        for df in frames:
+            groups, days, values = index._rows(df)
+            index._add(groups, days, values)
+            pairs.append(np.unique(groups * DAY_SPAN + days))
+        if pairs:
+            index._refresh(np.unique(np.concatenate(pairs)))
+        return index
+
+    @classmethod
+    def from_dataset(cls, path, chunk_rows=SOURCE_CHUNK_ROWS):
+        return cls.from_frames(iter_dataset_chunks(path, chunk_rows, INDEX_COLUMNS))
+
+    # --- Пересчет рядов ---
+
+    def _refresh(self, pairs):
+        """Пересчет дат рядов, затронутых днями pairs (ключи группа * DAY_SPAN + день)"""
+        longest = max(ROLLING_WINDOWS)
+        for group in np.unique(pairs // DAY_SPAN):
+            days = pairs[pairs // DAY_SPAN == group] % DAY_SPAN - self.first_day
+            months = np.unique(_month_of(days + self.first_day)) - self.first_month
+            month_first = _month_start(months + self.first_month) - self.first_day
+            month_last = _month_start(months + self.first_month + 1) - 1 - self.first_day
+
+            # Дни, от которых зависят затронутые даты: окна назад от дня и вперед до конца окон
+            low = max(0, min(days.min() - longest + 1, month_first.min()))
+            high = min(self.n_days - 1, max(days.max() + longest - 1, month_last.max()))
+            first_key = (group * DAY_SPAN + self.first_day + low) * SKETCH_BINS
+            last_key = (group * DAY_SPAN + self.first_day + high + 1) * SKETCH_BINS
+            start, stop = np.searchsorted(self.entry_keys, [first_key, last_key])
+            keys, counts = self.entry_keys[start:stop], self.entry_counts[start:stop]
+            bins, bin_columns = np.unique(keys % SKETCH_BINS, return_inverse=True)
+            hist = np.zeros((high - low + 1, len(bins)), dtype=np.int64)
+            np.add.at(hist, (keys // SKETCH_BINS % DAY_SPAN - self.first_day - low, bin_columns.reshape(-1)), counts)
+
+            # Нарастающие итоги по дням: окно [a, b] = cumulative[b + 1] - cumulative[a]
+            cumulative = np.vstack([np.zeros((1, len(bins)), dtype=np.int64), np.cumsum(hist, axis=0)])
+            sums = np.r_[0.0, np.cumsum(self.day_sum[group, low:high + 1])]
+
+            def window_stats(first, last):
+                first, last = first - low, last - low
+                return _histogram_stats(cumulative[last + 1] - cumulative[first], bins, sums[last + 1] - sums[first])
+
+            self.series['day'][group, days] = window_stats(days, days)
+            for window in ROLLING_WINDOWS:
+                ends = np.unique((days[:, None] + np.arange(window)).reshape(-1))
+                ends = ends[ends < self.n_days]
+                self.series[f"rolling_{window}"][group, ends] = window_stats(np.maximum(ends - window + 1, 0), ends)
+            self.series['month'][group, months] = window_stats(np.maximum(month_first, 0),
+                                                               np.minimum(month_last, self.n_days - 1))
+
+    # --- Запросы ---
+
+    def _dates(self, name):
+        if name == 'month':
+            months = self.first_month + np.arange(self.series['month'].shape[1])
+            return pd.DatetimeIndex(months.astype('datetime64[M]').astype('datetime64[ns]'))
+        return pd.DatetimeIndex((self.first_day + np.arange(self.n_days)).astype('datetime64[D]').astype('datetime64[ns]'))
+
+    def series_frame(self, district, property_type, name='day'):
+        """Ряд группы: индекс - дата (для окон - день окончания), колонки SERIES_STATS"""
+        if name not in SERIES:
+            raise ValueError(f"Нет ряда {name}, доступны: {', '.join(SERIES)}")
+        row = self.group_index.get((district, property_type))
+        if row is None:
+            raise KeyError(f"Нет группы {district} x {property_type}")
+        frame = pd.DataFrame(self.series[name][row], index=self._dates(name), columns=list(SERIES_STATS))
+        frame['count'] = frame['count'].fillna(0).astype(np.int64)
+        return frame[frame['count'] > 0]
+
+    def to_frame(self, names=SERIES):
+        """Все ряды в длинном формате (строки с данными): group-колонки, series, date, SERIES_STATS"""
+        frames = []
+        for name in names:
+            values = self.series[name]
+            groups, positions = np.nonzero(values[:, :, 0] > 0)
+            labels = np.array(self.groups, dtype=object).reshape(-1, 2)[groups] if len(groups) else np.empty((0, 2))
+            frame = pd.DataFrame({
+                GROUP_COLUMNS[0]: labels[:, 0],
+                GROUP_COLUMNS[1]: labels[:, 1],
+                'series': name,
+                'date': self._dates(name)[positions]
+            })
+            for position, stat in enumerate(SERIES_STATS):
+                frame[stat] = values[groups, positions, position]
+            frames.append(frame)
+        frame = pd.concat(frames, ignore_index=True)
+        frame['count'] = frame['count'].astype(np.int64)
+        return frame
+
+    # --- Хранение ---
+
+    def save(self, path=PRICE_INDEX_FILE):
+        """Атомарная запись индекса в сжатый npz"""
+        meta = {'groups': self.groups, 'first_day': self.first_day, 'first_month': self.first_month}
+        arrays = {
+            'meta': np.array(json.dumps(meta, ensure_ascii=False)),
+            'entry_keys': self.entry_keys, 'entry_counts': self.entry_counts,
+            'day_count': self.day_count, 'day_sum': self.day_sum
+        }
+        for name in SERIES:
+            arrays[f"series_{name}"] = self.series[name]
+        tmp_file = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_file, **arrays)
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path=PRICE_INDEX_FILE):
+        index = cls()
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            index.groups = [tuple(group) for group in meta['groups']]
+            index.group_index = {group: row for row, group in enumerate(index.groups)}
+            index.first_day, index.first_month = meta['first_day'], meta['first_month']
+            for name in ('entry_keys', 'entry_counts', 'day_count', 'day_sum'):
+                setattr(index, name, data[name])
+            for name in SERIES:
+                index.series[name] = data[f"series_{name}"]
+        return index
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Индекс цен за м² по районам и типам недвижимости")
+    parser.add_argument('--source', default='comprehensive_real_estate_dataset.csv',
+                        help="CSV-файл или parquet-каталог датасета для построения индекса")
+    parser.add_argument('--from-db', action='store_true',
+                        help="построить индекс по таблице фактов (COPY TO STDOUT, см. db_extract)")
+    parser.add_argument('--index', default=PRICE_INDEX_FILE, help="файл индекса")
+    parser.add_argument('--rebuild', action='store_true', help="построить индекс заново")
+    parser.add_argument('--district', default=None, help="район для вывода ряда")
+    parser.add_argument('--property-type', default=None, help="тип недвижимости для вывода ряда")
+    parser.add_argument('--series', choices=SERIES, default='rolling_30', help="ряд для вывода")
+    parser.add_argument('--export', default=None, help="выгрузить все ряды в CSV (длинный формат)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    if args.rebuild or args.from_db or not os.path.exists(args.index):
+        started = time.perf_counter()
+        if args.from_db:
+            from db_extract import iter_extract
+            index = PriceIndex.from_frames(iter_extract(INDEX_COLUMNS))
+        else:
+            index = PriceIndex.from_dataset(args.source)
+        index.save(args.index)
+        print(f"Индекс цен построен: {len(index)} групп, {index.n_days} дней "
+              f"за {time.perf_counter() - started:.2f} с ({args.index})")
+    else:
+        index = PriceIndex.load(args.index)
+        print(f"Индекс цен загружен: {len(index)} групп, {index.n_days} дней")
+
+    if args.district and args.property_type:
+        frame = index.series_frame(args.district, args.property_type, args.series)
+        print(f"\n{args.district} x {args.property_type}, ряд {args.series}:")
+        print(frame.to_string(float_format=lambda value: f"{value:,.0f}"))
+    if args.export:
+        index.to_frame().to_csv(args.export, index=False, encoding='utf-8')
+        print(f"Ряды выгружены в {args.export}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+# Счетчик поколений данных: db_loader увеличивает его в транзакции каждой
+# успешной загрузки, записи кэша прежних поколений считаются устаревшими
+GENERATION_TABLE = 'etl_load_generation'
+
+# Каталог дискового уровня кэша (по файлу на запрос)
+QUERY_CACHE_DIR = 'query_cache'
+
+# Границы кэша: записей и байт в памяти, байт на диске (вытесняются давно не читанные)
+CACHE_MAX_ENTRIES = 128
+CACHE_MAX_BYTES = 64 << 20
+DISK_CACHE_MAX_BYTES = 512 << 20
+
+# Поколение перечитывается из БД не чаще раза в интервал (секунд). 0 - при
+# каждом запросе: результат не отстает от зафиксированной загрузки. Дашборд
+# может задать интервал, чтобы отрисовка из нескольких запросов обходилась
+# одним обращением к БД, ценой отставания до интервала после загрузки
+GENERATION_CHECK_SECONDS = 0.0
+
+# Аналитические запросы ноутбука analysis_visualization.ipynb и представлений vw_*
+ANALYTICAL_QUERIES = {
+    'top_residential': """
+        SELECT
+            d.district_name,
+            ROUND(SUM(a.price_sum) / SUM(a.offers_count), 0) AS avg_price
+        FROM agg_real_estate_daily a
+        JOIN dim_property_types p
+            ON a.property_type_id = p.property_type_id
+        JOIN dim_districts d
+            ON a.district_id = d.district_id
+        WHERE p.property_category = 'жилая'
+        GROUP BY d.district_name
+        ORDER BY avg_price DESC
+        LIMIT 3;
+    """,
+    'top_commercial': """
+        SELECT
+            d.district_name,
+            ROUND(SUM(a.price_sum) / SUM(a.offers_count), 0) AS avg_price
+        FROM agg_real_estate_daily a
+        JOIN dim_property_types p
+            ON a.property_type_id = p.property_type_id
+        JOIN dim_districts d
+            ON a.district_id = d.district_id
+        WHERE p.property_category = 'коммерческая'
+        GROUP BY d.district_name
+        ORDER BY avg_price DESC
+        LIMIT 3;
+    """,
+    'market_structure': """
+        SELECT
+            p.property_category,
+            SUM(a.offers_count) AS object_count,
+            ROUND(
+                SUM(a.offers_count) * 100.0 / SUM(SUM(a.offers_count)) OVER (),
+                2
+            ) AS share_percent
+        FROM agg_real_estate_daily a
+        JOIN dim_property_types p
+            ON a.property_type_id = p.property_type_id
+        GROUP BY p.property_category
+        ORDER BY object_count DESC;
+    """,
+    'price_per_sqm': """
+        SELECT
+            d.district_name,
+            ROUND(SUM(a.price_per_sqm_positive_sum) / SUM(a.price_per_sqm_positive_count), 0) AS avg_price_per_sqm
+        FROM agg_real_estate_daily a
+        JOIN dim_property_types p
+            ON a.property_type_id = p.property_type_id
+        JOIN dim_districts d
+            ON a.district_id = d.district_id
+        WHERE p.property_category = 'жилая'
+            AND a.price_per_sqm_positive_count > 0
+        GROUP BY d.district_name
+        ORDER BY avg_price_per_sqm DESC;
+    """,
+    'district_type_structure': """
+        SELECT
+            d.district_name,
+            p.property_type_name,
+            SUM(a.offers_count) AS object_count
+        FROM agg_real_estate_daily a
+        JOIN dim_property_types p
+            ON a.property_type_id = p.property_type_id
+        JOIN dim_districts d
+            ON a.district_id = d.district_id
+        GROUP BY d.district_name, p.property_type_name
+        ORDER BY d.district_name, object_count DESC;
+    """,
+    'market_overview': "SELECT * FROM vw_market_overview",
+    'residential_analysis': "SELECT * FROM vw_residential_analysis",
+    'commercial_analysis': "SELECT * FROM vw_commercial_analysis"
+}
+
+# Лексемы SQL для нормализации: строки в кавычках не меняются, комментарии
+# убираются, пробельные символы схлопываются
+SQL_TOKENS = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|(?:--[^\n]*|/\*.*?\*/|\s+)+", re.DOTALL)
+
+def ensure_generation_objects(cursor):
+    """Таблица счетчика поколений (для баз, созданных до ее появления в скрипте восстановления)"""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {GENERATION_TABLE} (
+            generation_id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (generation_id = 1),
+            generation BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute(f"INSERT INTO {GENERATION_TABLE} (generation_id) VALUES (1) ON CONFLICT DO NOTHING")
+
+def bump_load_generation(cursor):
+    """Новое поколение данных (в транзакции загрузки: становится видно вместе с ее данными)"""
+    ensure_generation_objects(cursor)
+    cursor.execute(f"""
+        UPDATE {GENERATION_TABLE}
+        SET generation = generation + 1, updated_at = CURRENT_TIMESTAMP
+        RETURNING generation
+    """)
+    return cursor.fetchone()[0]
+
+def _is_dbapi(con):
+    """Соединение psycopg2 (иначе - engine или connection SQLAlchemy, как в ноутбуке)"""
+    return hasattr(con, 'cursor')
+
+def _scalar(con, query, params=None):
+    if _is_dbapi(con):
+        cursor = con.cursor()
+        try:
+            cursor.execute(query, params)
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+    if hasattr(con, 'exec_driver_sql'):
+        return con.exec_driver_sql(query, params or ()).scalar()
+    with con.connect() as connection:
+        return connection.exec_driver_sql(query, params or ()).scalar()
+
+def _read_frame(con, query, params=None):
+    if not _is_dbapi(con):
+        return pd.read_sql(query, con, params=params)
+    cursor = con.cursor()
+    try:
+        cursor.execute(query, params)
+        return pd.DataFrame(cursor.fetchall(), columns=[column[0] for column in cursor.description])
+    finally:
+        cursor.close()
+
+def read_load_generation(con):
+    """Текущее поколение данных (0 - в базе еще не было загрузок со счетчиком)"""
+    if not _scalar(con, "SELECT to_regclass(%s) IS NOT NULL", (GENERATION_TABLE,)):
+        return 0
+    return _scalar(con, f"SELECT generation FROM {GENERATION_TABLE}") or 0
+
+def database_key(con):
+    """Хост, порт и база соединения: записи разных баз в кэше не смешиваются"""
+    url = getattr(con, 'url', None) or getattr(getattr(con, 'engine', None), 'url', None)
+    if url is not None:
+        return f"{url.host}:{url.port}/{url.database}"
+    params = con.get_dsn_parameters()
+    return f"{params.get('host')}:{params.get('port')}/{params.get('dbname')}"
+
+def normalize_sql(query):
+    """Запрос без комментариев, лишних пробелов и завершающей точки с запятой"""
+    normalized = SQL_TOKENS.sub(lambda match: match.group(1) or ' ', query).strip()
+    return normalized.rstrip(';').strip()
+
+def cache_key(query, params=None, database=''):
+    """Ключ записи: хэш нормализованного запроса, параметров и базы"""
+    payload = json.dumps([database, normalize_sql(query), params], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+class QueryCache:
+    """Кэш результатов аналитических запросов с инвалидацией по загрузкам.
+
+    Ключ записи - нормализованный SQL, параметры и база данных; запись
+    действительна, пока поколение данных (GENERATION_TABLE) не изменилось.
+    Уровень в памяти ограничен числом записей и байтами (LRU), дисковый
+    уровень cache_dir переживает перезапуск ноутбука и общий для процессов;
+    при переполнении с диска удаляются давно не читанные файлы.
+    check_interval > 0 разрешает брать поколение из памяти процесса:
+    результат может отставать от загрузки не дольше check_interval секунд.
+    """
+
+    def __init__(self, cache_dir=QUERY_CACHE_DIR, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES,
+                 disk_max_bytes=DISK_CACHE_MAX_BYTES, check_interval=GENERATION_CHECK_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.check_interval = check_interval
+        # ключ -> (база, поколение, результат, байт)
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        # база -> (поколение, время проверки)
+        self.generations = {}
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self.last_source = None
+        self._lock = threading.Lock()
+
+    def generation(self, con, database=None):
+        """Поколение данных базы (из БД не чаще раза в check_interval секунд)"""
+        database = database or database_key(con)
+        checked = self.generations.get(database)
+        now = time.monotonic()
+        if checked is not None and now - checked[1] < self.check_interval:
+            return checked[0]
+        generation = read_load_generation(con)
+        self.generations[database] = (generation, now)
+        if checked is not None and checked[0] != generation:
+            self._drop_stale(database, generation)
+        return generation
+
+    def read_sql(self, query, con, params=None):
+        """Результат запроса (DataFrame) из кэша или из БД.
+
+        con - соединение psycopg2 или engine SQLAlchemy (как у pd.read_sql).
+        Поколение читается до запроса: если загрузка завершится между ними,
+        запись получит прежнее поколение и будет пересчитана при следующем
+        чтении. Результат прежнего поколения возвращается не позже чем через
+        check_interval секунд после фиксации загрузки (при 0 - не возвращается).
+        """
+        database = database_key(con)
+        key = cache_key(query, params, database)
+        generation = self.generation(con, database)
+
+        frame = self._get_memory(key, generation)
+        if frame is not None:
+            self.hits['memory'] += 1
+            self.last_source = 'memory'
+            return frame.copy()
+
+        frame = self._get_disk(key, generation)
+        if frame is not None:
+            self.hits['disk'] += 1
+            self.last_source = 'disk'
+        else:
+            self.misses += 1
+            self.last_source = 'db'
+            frame = _read_frame(con, query, params)
+            self._put_disk(key, generation, query, params, frame)
+        self._put_memory(key, database, generation, frame)
+        return frame.copy()
+
+    def analytical_query(self, name, con):
+        """Запрос из ANALYTICAL_QUERIES по имени"""
+        return self.read_sql(ANALYTICAL_QUERIES[name], con)
+
+    # --- Уровень в памяти ---
+
+    def _get_memory(self, key, generation):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] != generation:
+                self._pop(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[2]
+
+    def _put_memory(self, key, database, generation, frame):
+        nbytes = int(frame.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.entries:
+                self._pop(key)
+            self.entries[key] = (database, generation, frame, nbytes)
+            self.nbytes += nbytes
+            while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+                self._pop(next(iter(self.entries)))
+
+    def _pop(self, key):
+        self.nbytes -= self.entries.pop(key)[3]
+
+    def _drop_stale(self, database, generation):
+        """Записи прежних поколений базы освобождают память сразу после смены поколения"""
+        with self._lock:
+            for key in [key for key, entry in self.entries.items() if entry[0] == database and entry[1] != generation]:
+                self._pop(key)
+
+    # --- Дисковый уровень ---
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def _get_disk(self, key, generation):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (EOFError, pickle.UnpicklingError):
+            entry = None
+        if entry is None or entry['generation'] != generation:
+            _remove(path)
+            return None
+        # Время изменения файла - время последнего чтения для вытеснения
+        os.utime(path)
+        return entry['frame']
+
+    def _put_disk(self, key, generation, query, params, frame):
+        """Атомарная запись результата на диск и вытеснение при переполнении"""
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({'generation': generation, 'query': normalize_sql(query), 'params': params, 'frame': frame},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, path)
+        self._prune_disk()
+
+    def _prune_disk(self):
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+    def clear(self):
+        """Очистка обоих уровней"""
+        with self._lock:
+            self.entries.clear()
+            self.nbytes = 0
+        self.generations.clear()
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.pkl'):
+                    _remove(entry.path)
+
+    def print_stats(self):
+        requests = self.misses + sum(self.hits.values())
+        print(f"Кэш запросов: {requests} обращений, из памяти {self.hits['memory']}, с диска {self.hits['disk']}, "
+              f"из БД {self.misses}; в памяти {len(self.entries)} записей ({self.nbytes / 1024:,.0f} КБ)")
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Аналитические запросы через кэш с инвалидацией по загрузкам")
+    parser.add_argument('--query', nargs='*', choices=list(ANALYTICAL_QUERIES), default=None,
+                        help="запросы (по умолчанию все)")
+    parser.add_argument('--repeat', type=int, default=2, help="число повторов каждого запроса")
+    parser.add_argument('--cache-dir', default=QUERY_CACHE_DIR, help="каталог дискового уровня кэша")
+    parser.add_argument('--check-interval', type=float, default=GENERATION_CHECK_SECONDS,
+                        help="перечитывать поколение данных не чаще раза в столько секунд (0 - при каждом запросе)")
+    parser.add_argument('--clear', action='store_true', help="очистить кэш перед запросами")
+    parser.add_argument('--show', action='store_true', help="вывести результаты запросов")
+    return parser.parse_args()
+
+def main():
+    from db_loader import pooled_connection
+
+    args = parse_args()
+    cache = QueryCache(cache_dir=args.cache_dir, check_interval=args.check_interval)
+    if args.clear:
+        cache.clear()
+        print(f"Кэш {args.cache_dir} очищен")
+
+    with pooled_connection() as conn:
+        print(f"Поколение данных: {cache.generation(conn)}")
+        for name in args.query or ANALYTICAL_QUERIES:
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                frame = cache.analytical_query(name, conn)
+                elapsed = (time.perf_counter() - started) * 1000
+                print(f"  {name:<24} {len(frame):>5} строк {elapsed:9.2f} мс ({cache.last_source})")
+            if args.show:
+                print(frame.to_string(index=False))
+        conn.rollback()
+    cache.print_stats()
+
+if __name__ == "__main__":
+    main()
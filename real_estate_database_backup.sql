@@ -8,6 +8,14 @@
 SET session_replication_role = 'replica';
 
 -- 1. УДАЛЕНИЕ СУЩЕСТВУЮЩИХ ТАБЛИЦ (если есть)
+DROP TABLE IF EXISTS etl_load_generation CASCADE;
+DROP TABLE IF EXISTS etl_moved_fact_groups CASCADE;
+DROP TABLE IF EXISTS fact_external_keys CASCADE;
+DROP TABLE IF EXISTS etl_load_journal CASCADE;
+DROP TABLE IF EXISTS fact_duplicate_links CASCADE;
+DROP TABLE IF EXISTS etl_quarantine CASCADE;
+DROP TABLE IF EXISTS etl_integrity_counters CASCADE;
+DROP TABLE IF EXISTS agg_real_estate_daily CASCADE;
 DROP TABLE IF EXISTS fact_real_estate CASCADE;
 DROP TABLE IF EXISTS dim_time CASCADE;
 DROP TABLE IF EXISTS dim_commercial_purpose CASCADE;
@@ -67,9 +75,12 @@ CREATE TABLE dim_time (
 );
 
 -- 3. СОЗДАНИЕ ТАБЛИЦЫ ФАКТОВ (FACT TABLE)
+-- Таблица секционирована по месяцам created_date (секции fact_real_estate_yYYYYmMM),
+-- поэтому ключ партиционирования входит в первичный ключ и уникальный индекс external_id;
+-- уникальность самого external_id держит таблица ключей fact_external_keys
 
 CREATE TABLE fact_real_estate (
-    fact_id BIGSERIAL PRIMARY KEY,
+    fact_id BIGSERIAL,
     district_id INTEGER NOT NULL,
     date_id INTEGER NOT NULL,
     property_type_id INTEGER NOT NULL,
@@ -107,12 +118,175 @@ CREATE TABLE fact_real_estate (
     created_date DATE NOT NULL,
     updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     
+    CONSTRAINT pk_fact_real_estate PRIMARY KEY (fact_id, created_date),
+    
     -- Внешние ключи
     CONSTRAINT fk_district FOREIGN KEY (district_id) REFERENCES dim_districts(district_id),
     CONSTRAINT fk_date FOREIGN KEY (date_id) REFERENCES dim_time(date_id),
     CONSTRAINT fk_property_type FOREIGN KEY (property_type_id) REFERENCES dim_property_types(property_type_id),
     CONSTRAINT fk_house_type FOREIGN KEY (house_type_id) REFERENCES dim_house_types(house_type_id),
     CONSTRAINT fk_commercial_purpose FOREIGN KEY (commercial_purpose_id) REFERENCES dim_commercial_purpose(purpose_id)
+) PARTITION BY RANGE (created_date);
+
+-- 3.0. Секции по месяцам
+-- Имя секции строится так же, как в db_loader.partition_table_name
+CREATE OR REPLACE FUNCTION fact_partition_name(p_date DATE)
+RETURNS TEXT AS $$
+    SELECT 'fact_real_estate_' || TO_CHAR(p_date, '"y"YYYY"m"MM');
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Создает секцию месяца, если ее еще нет; возвращает имя секции
+CREATE OR REPLACE FUNCTION ensure_fact_partition(p_date DATE)
+RETURNS TEXT AS $$
+DECLARE
+    month_start DATE := date_trunc('month', p_date)::DATE;
+    partition_name TEXT := fact_partition_name(p_date);
+BEGIN
+    IF to_regclass(partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF fact_real_estate FOR VALUES FROM (%L) TO (%L)',
+            partition_name, month_start, (month_start + INTERVAL '1 month')::DATE
+        );
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Отсоединяет секции месяцев раньше p_before. С p_archive_schema секции
+-- переносятся в архивную схему, иначе остаются отдельными таблицами.
+-- Агрегаты отсоединенных месяцев удаляются из agg_real_estate_daily.
+CREATE OR REPLACE FUNCTION detach_fact_partitions(
+    p_before DATE,
+    p_archive_schema TEXT DEFAULT NULL
+)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    partition_name TEXT;
+BEGIN
+    IF p_archive_schema IS NOT NULL THEN
+        EXECUTE format('CREATE SCHEMA IF NOT EXISTS %I', p_archive_schema);
+    END IF;
+    
+    FOR partition_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'fact_real_estate'::regclass
+          AND c.relname ~ '^fact_real_estate_y[0-9]{4}m[0-9]{2}$'
+          AND to_date(right(c.relname, 7), 'YYYY"m"MM') < date_trunc('month', p_before)
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE fact_real_estate DETACH PARTITION %I', partition_name);
+        IF p_archive_schema IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE %I SET SCHEMA %I', partition_name, p_archive_schema);
+        END IF;
+        RETURN NEXT partition_name;
+    END LOOP;
+    
+    IF to_regclass('agg_real_estate_daily') IS NOT NULL THEN
+        DELETE FROM agg_real_estate_daily a
+        USING dim_time t
+        WHERE a.date_id = t.date_id AND t.full_date < date_trunc('month', p_before);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 3.1. Материализованные агрегаты для аналитических представлений
+-- Ключ: район x тип недвижимости x дата (+ комнаты и назначение для vw_residential/commercial).
+-- Хранятся суммы и счетчики, из которых собираются AVG/MIN/MAX на любом уровне.
+CREATE TABLE agg_real_estate_daily (
+    district_id INTEGER NOT NULL,
+    property_type_id INTEGER NOT NULL,
+    date_id INTEGER NOT NULL,
+    rooms INTEGER,
+    commercial_purpose_id INTEGER,
+    
+    offers_count BIGINT NOT NULL,
+    price_sum DECIMAL(20,2) NOT NULL,
+    price_per_sqm_sum DECIMAL(20,2) NOT NULL,
+    price_per_sqm_min DECIMAL(12,2),
+    price_per_sqm_max DECIMAL(12,2),
+    price_per_sqm_positive_sum DECIMAL(20,2) NOT NULL,
+    price_per_sqm_positive_count BIGINT NOT NULL,
+    area_sum DECIMAL(18,2) NOT NULL,
+    metro_time_sum BIGINT,
+    metro_time_count BIGINT NOT NULL,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 3.2. Контроль качества загрузки (заполняет db_loader по ходу загрузки)
+-- Накопительные счетчики проверок целостности по всем загрузкам
+CREATE TABLE etl_integrity_counters (
+    check_name VARCHAR(50) PRIMARY KEY,
+    severity VARCHAR(10) NOT NULL,
+    description TEXT,
+    checked_rows BIGINT NOT NULL DEFAULT 0,
+    failed_rows BIGINT NOT NULL DEFAULT 0,
+    last_failed_rows BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Строки, не прошедшие проверки (исходные значения в row_data)
+CREATE TABLE etl_quarantine (
+    quarantine_id BIGSERIAL PRIMARY KEY,
+    check_name VARCHAR(50) NOT NULL,
+    external_id VARCHAR(100),
+    row_data JSONB NOT NULL,
+    quarantined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Повторные публикации объекта: дубликат -> каноническое объявление
+-- (в fact_real_estate загружается только каноническое)
+CREATE TABLE fact_duplicate_links (
+    external_id VARCHAR(100) PRIMARY KEY,
+    canonical_external_id VARCHAR(100) NOT NULL,
+    similarity DECIMAL(4,3) NOT NULL,
+    linked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Журнал загрузок с контрольными точками (db_loader --checkpoint): committed_rows -
+-- позиция последней зафиксированной пачки, с нее продолжается прерванная загрузка
+-- того же файла (source_fingerprint) с теми же параметрами
+CREATE TABLE etl_load_journal (
+    load_id BIGSERIAL PRIMARY KEY,
+    source_path TEXT NOT NULL,
+    source_fingerprint VARCHAR(64) NOT NULL,
+    load_options VARCHAR(200) NOT NULL,
+    total_rows BIGINT NOT NULL,
+    batch_rows INTEGER NOT NULL,
+    committed_rows BIGINT NOT NULL DEFAULT 0,
+    committed_batches INTEGER NOT NULL DEFAULT 0,
+    retries INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    last_error TEXT,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Счетчик поколений данных: db_loader увеличивает его в транзакции каждой успешной
+-- загрузки, кэш аналитических запросов (query_cache.py) сбрасывает записи прежних поколений
+CREATE TABLE etl_load_generation (
+    generation_id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (generation_id = 1),
+    generation BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO etl_load_generation (generation_id) VALUES (1);
+
+-- Текущая дата публикации каждого объявления (один external_id - одна строка фактов).
+-- Загрузчик блокирует ключи пачки и удаляет прежнюю строку объявления, вернувшегося
+-- с другой датой; ее группа (район, тип, дата) ждет пересчета агрегатов в
+-- etl_moved_fact_groups до конца загрузки
+CREATE TABLE fact_external_keys (
+    external_id VARCHAR(100) PRIMARY KEY,
+    created_date DATE NOT NULL
+);
+
+CREATE TABLE etl_moved_fact_groups (
+    district_id INTEGER NOT NULL,
+    property_type_id INTEGER NOT NULL,
+    date_id INTEGER NOT NULL,
+    created_date DATE NOT NULL
 );
 
 -- 4. СОЗДАНИЕ ИНДЕКСОВ
@@ -125,6 +299,13 @@ CREATE INDEX idx_fact_property_type ON fact_real_estate(property_type_id);
 CREATE INDEX idx_fact_price_sqm ON fact_real_estate(price_per_sqm);
 CREATE INDEX idx_fact_rooms_district ON fact_real_estate(rooms, district_id);
 CREATE INDEX idx_fact_date_category ON fact_real_estate(created_date, property_type_id);
+CREATE UNIQUE INDEX idx_fact_external_id ON fact_real_estate(external_id, created_date);
+-- Ключ агрегата уникален (NULL комнат и назначения считается одним значением)
+CREATE UNIQUE INDEX idx_agg_group ON agg_real_estate_daily(
+    district_id, property_type_id, date_id, COALESCE(rooms, -1), COALESCE(commercial_purpose_id, -1)
+);
+CREATE UNIQUE INDEX idx_quarantine_check_external_id ON etl_quarantine(check_name, external_id);
+CREATE INDEX idx_load_journal_fingerprint ON etl_load_journal(source_fingerprint, status);
 
 -- Включаем проверку внешних ключей
 SET session_replication_role = 'origin';
@@ -195,21 +376,79 @@ FROM generate_series(
     '1 day'::interval
 ) as date;
 
+-- 5.6. Секции таблицы фактов на период dim_time
+SELECT ensure_fact_partition(month::date)
+FROM generate_series(
+    date_trunc('month', CURRENT_DATE - INTERVAL '90 days'),
+    CURRENT_DATE,
+    '1 month'::interval
+) as month;
+
 -- 6. СОЗДАНИЕ ПРЕДСТАВЛЕНИЙ ДЛЯ АНАЛИЗА
 
+-- 6.0. Обновление агрегатов: пересчитываются только переданные группы
+-- (район, тип, дата); без аргументов - полная перестройка
+-- (для уже заполненной базы: SELECT refresh_real_estate_aggregates();)
+CREATE OR REPLACE FUNCTION refresh_real_estate_aggregates(
+    p_district_ids INTEGER[] DEFAULT NULL,
+    p_property_type_ids INTEGER[] DEFAULT NULL,
+    p_date_ids INTEGER[] DEFAULT NULL
+)
+RETURNS INTEGER AS $$
+DECLARE
+    refreshed INTEGER;
+BEGIN
+    -- Пересчеты идут по очереди (блокировка до конца транзакции): иначе две
+    -- загрузки одной новой группы обе ничего не удалили бы и вставили ее дважды
+    PERFORM pg_advisory_xact_lock(hashtext('refresh_real_estate_aggregates'));
+    
+    IF p_district_ids IS NULL THEN
+        TRUNCATE agg_real_estate_daily;
+    ELSE
+        DELETE FROM agg_real_estate_daily a
+        USING unnest(p_district_ids, p_property_type_ids, p_date_ids) AS g(district_id, property_type_id, date_id)
+        WHERE a.district_id = g.district_id
+          AND a.property_type_id = g.property_type_id
+          AND a.date_id = g.date_id;
+    END IF;
+    
+    INSERT INTO agg_real_estate_daily (
+        district_id, property_type_id, date_id, rooms, commercial_purpose_id,
+        offers_count, price_sum, price_per_sqm_sum, price_per_sqm_min, price_per_sqm_max,
+        price_per_sqm_positive_sum, price_per_sqm_positive_count,
+        area_sum, metro_time_sum, metro_time_count
+    )
+    SELECT
+        f.district_id, f.property_type_id, f.date_id, f.rooms, f.commercial_purpose_id,
+        COUNT(*), SUM(f.price), SUM(f.price_per_sqm), MIN(f.price_per_sqm), MAX(f.price_per_sqm),
+        COALESCE(SUM(f.price_per_sqm) FILTER (WHERE f.price_per_sqm > 0), 0),
+        COUNT(*) FILTER (WHERE f.price_per_sqm > 0),
+        SUM(f.area), SUM(f.metro_time), COUNT(f.metro_time)
+    FROM fact_real_estate f
+    WHERE p_district_ids IS NULL
+       OR (f.district_id, f.property_type_id, f.date_id) IN (
+            SELECT * FROM unnest(p_district_ids, p_property_type_ids, p_date_ids)
+       )
+    GROUP BY f.district_id, f.property_type_id, f.date_id, f.rooms, f.commercial_purpose_id;
+    
+    GET DIAGNOSTICS refreshed = ROW_COUNT;
+    RETURN refreshed;
+END;
+$$ LANGUAGE plpgsql;
+
 -- 6.1. Обзор рынка по районам
 CREATE OR REPLACE VIEW vw_market_overview AS
 SELECT 
     d.district_name,
     d.district_type,
-    COUNT(*) as total_offers,
-    AVG(f.price) as avg_price,
-    AVG(f.price_per_sqm) as avg_price_sqm,
-    MIN(f.price_per_sqm) as min_price_sqm,
-    MAX(f.price_per_sqm) as max_price_sqm,
-    COUNT(DISTINCT f.property_type_id) as property_types_available
-FROM fact_real_estate f
-JOIN dim_districts d ON f.district_id = d.district_id
+    SUM(a.offers_count)::BIGINT as total_offers,
+    SUM(a.price_sum) / SUM(a.offers_count) as avg_price,
+    SUM(a.price_per_sqm_sum) / SUM(a.offers_count) as avg_price_sqm,
+    MIN(a.price_per_sqm_min) as min_price_sqm,
+    MAX(a.price_per_sqm_max) as max_price_sqm,
+    COUNT(DISTINCT a.property_type_id) as property_types_available
+FROM agg_real_estate_daily a
+JOIN dim_districts d ON a.district_id = d.district_id
 GROUP BY d.district_name, d.district_type
 ORDER BY avg_price_sqm DESC;
 
@@ -218,18 +457,18 @@ CREATE OR REPLACE VIEW vw_residential_analysis AS
 SELECT 
     d.district_name,
     pt.property_type_name,
-    f.rooms,
-    COUNT(*) as offers_count,
-    AVG(f.price) as avg_price,
-    AVG(f.price_per_sqm) as avg_price_sqm,
-    AVG(f.area) as avg_area,
-    AVG(f.metro_time) as avg_metro_time
-FROM fact_real_estate f
-JOIN dim_districts d ON f.district_id = d.district_id
-JOIN dim_property_types pt ON f.property_type_id = pt.property_type_id
+    a.rooms,
+    SUM(a.offers_count)::BIGINT as offers_count,
+    SUM(a.price_sum) / SUM(a.offers_count) as avg_price,
+    SUM(a.price_per_sqm_sum) / SUM(a.offers_count) as avg_price_sqm,
+    SUM(a.area_sum) / SUM(a.offers_count) as avg_area,
+    SUM(a.metro_time_sum)::DECIMAL / NULLIF(SUM(a.metro_time_count), 0) as avg_metro_time
+FROM agg_real_estate_daily a
+JOIN dim_districts d ON a.district_id = d.district_id
+JOIN dim_property_types pt ON a.property_type_id = pt.property_type_id
 WHERE pt.property_category = 'жилая'
-GROUP BY d.district_name, pt.property_type_name, f.rooms
-ORDER BY d.district_name, pt.property_type_name, f.rooms;
+GROUP BY d.district_name, pt.property_type_name, a.rooms
+ORDER BY d.district_name, pt.property_type_name, a.rooms;
 
 -- 6.3. Анализ коммерческой недвижимости
 CREATE OR REPLACE VIEW vw_commercial_analysis AS
@@ -237,17 +476,20 @@ SELECT
     d.district_name,
     cp.purpose_name,
     cp.commercial_category,
-    COUNT(*) as offers_count,
-    AVG(f.price) as avg_price,
-    AVG(f.price_per_sqm) as avg_price_sqm,
-    AVG(f.area) as avg_area
-FROM fact_real_estate f
-JOIN dim_districts d ON f.district_id = d.district_id
-JOIN dim_commercial_purpose cp ON f.commercial_purpose_id = cp.purpose_id
+    SUM(a.offers_count)::BIGINT as offers_count,
+    SUM(a.price_sum) / SUM(a.offers_count) as avg_price,
+    SUM(a.price_per_sqm_sum) / SUM(a.offers_count) as avg_price_sqm,
+    SUM(a.area_sum) / SUM(a.offers_count) as avg_area
+FROM agg_real_estate_daily a
+JOIN dim_districts d ON a.district_id = d.district_id
+JOIN dim_commercial_purpose cp ON a.commercial_purpose_id = cp.purpose_id
 GROUP BY d.district_name, cp.purpose_name, cp.commercial_category
 ORDER BY avg_price_sqm DESC;
 
 -- 7. ФУНКЦИЯ ДЛЯ ПРОВЕРКИ ЦЕЛОСТНОСТИ ДАННЫХ
+-- Таблица фактов не сканируется: число записей берется из агрегатов,
+-- результаты проверок - из счетчиков загрузчика, уникальные external_id -
+-- из статистики планировщика (после ANALYZE)
 
 CREATE OR REPLACE FUNCTION check_data_integrity()
 RETURNS TABLE (
@@ -259,27 +501,27 @@ BEGIN
     RETURN QUERY
     SELECT 'Всего записей в fact_real_estate'::VARCHAR, 
            'OK'::VARCHAR, 
-           COUNT(*)::TEXT FROM fact_real_estate
-    UNION ALL
-    SELECT 'Записей без district_id', 
-           CASE WHEN COUNT(*) = 0 THEN 'OK' ELSE 'ERROR' END,
-           COUNT(*)::TEXT 
-    FROM fact_real_estate WHERE district_id IS NULL
+           COALESCE(SUM(a.offers_count), 0)::TEXT FROM agg_real_estate_daily a
     UNION ALL
-    SELECT 'Записей без property_type_id', 
-           CASE WHEN COUNT(*) = 0 THEN 'OK' ELSE 'ERROR' END,
-           COUNT(*)::TEXT 
-    FROM fact_real_estate WHERE property_type_id IS NULL
+    SELECT c.description::VARCHAR,
+           (CASE WHEN c.failed_rows = 0 THEN 'OK'
+                 WHEN c.severity = 'error' THEN 'ERROR'
+                 ELSE 'WARNING' END)::VARCHAR,
+           c.failed_rows || ' из ' || c.checked_rows || ' (последняя загрузка: ' || c.last_failed_rows || ')'
+    FROM etl_integrity_counters c
     UNION ALL
-    SELECT 'Записей с нулевой ценой', 
-           CASE WHEN COUNT(*) = 0 THEN 'OK' ELSE 'WARNING' END,
-           COUNT(*)::TEXT 
-    FROM fact_real_estate WHERE price <= 0
+    SELECT 'Строк в карантине'::VARCHAR,
+           (CASE WHEN COUNT(*) = 0 THEN 'OK' ELSE 'WARNING' END)::VARCHAR,
+           COUNT(*)::TEXT
+    FROM etl_quarantine
     UNION ALL
-    SELECT 'Уникальных external_id', 
-           'INFO',
-           COUNT(DISTINCT external_id)::TEXT 
-    FROM fact_real_estate;
+    SELECT 'Уникальных external_id (оценка)'::VARCHAR, 
+           'INFO'::VARCHAR,
+           COALESCE(MAX(CASE WHEN s.n_distinct < 0 THEN -s.n_distinct * c.reltuples ELSE s.n_distinct END)::BIGINT::TEXT,
+                    'нет статистики, выполните ANALYZE fact_real_estate')
+    FROM pg_stats s
+    JOIN pg_class c ON c.relname = s.tablename
+    WHERE s.tablename = 'fact_real_estate' AND s.attname = 'external_id';
 END;
 $$ LANGUAGE plpgsql;
 
@@ -290,7 +532,15 @@ COMMENT ON TABLE dim_property_types IS 'Классификация типов н
 COMMENT ON TABLE dim_house_types IS 'Типы домов по материалу строительства';
 COMMENT ON TABLE dim_commercial_purpose IS 'Назначение коммерческой недвижимости';
 COMMENT ON TABLE dim_time IS 'Временная dimension таблица';
-COMMENT ON TABLE fact_real_estate IS 'Основная таблица фактов с данными о недвижимости';
+COMMENT ON TABLE fact_real_estate IS 'Основная таблица фактов с данными о недвижимости (секции по месяцам created_date)';
+COMMENT ON TABLE agg_real_estate_daily IS 'Агрегаты фактов по району, типу и дате для аналитических представлений';
+COMMENT ON TABLE etl_integrity_counters IS 'Накопительные счетчики проверок целостности при загрузке';
+COMMENT ON TABLE etl_quarantine IS 'Строки, отбракованные проверками целостности при загрузке';
+COMMENT ON TABLE fact_duplicate_links IS 'Связи дубликатов объявлений с каноническим объявлением';
+COMMENT ON TABLE etl_load_journal IS 'Журнал загрузок: отпечаток источника и последняя зафиксированная пачка';
+COMMENT ON TABLE etl_load_generation IS 'Поколение данных для инвалидации кэша аналитических запросов';
+COMMENT ON TABLE fact_external_keys IS 'Текущая дата публикации объявления: уникальность external_id в fact_real_estate';
+COMMENT ON TABLE etl_moved_fact_groups IS 'Группы агрегатов, из которых загрузка перенесла объявления';
 
 COMMENT ON COLUMN fact_real_estate.price IS 'Цена объекта в рублях';
 COMMENT ON COLUMN fact_real_estate.area IS 'Площадь объекта в м²';
@@ -306,9 +556,9 @@ BEGIN
     RAISE NOTICE 'БАЗА ДАННЫХ "real_estate_moscow" УСПЕШНО СОЗДАНА';
     RAISE NOTICE 'Дата создания: %', CURRENT_TIMESTAMP;
     RAISE NOTICE '============================================';
-    RAISE NOTICE 'Создано таблиц: 6';
+    RAISE NOTICE 'Создано таблиц: 14';
     RAISE NOTICE 'Создано представлений: 3';
-    RAISE NOTICE 'Создано индексов: 8';
+    RAISE NOTICE 'Создано индексов: 12';
     RAISE NOTICE '============================================';
 END $$;
 
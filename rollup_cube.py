@@ -0,0 +1,322 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from sketches import SKETCH_BINS, histogram_quantiles, sketch_bins
+
+# Файл предрасчитанного куба (сжатый npz)
+ROLLUP_CUBE_FILE = 'real_estate_rollup_cube.npz'
+
+# Измерения куба; month - месяц publish_date в виде 'ГГГГ-ММ'
+ROLLUP_DIMENSIONS = ('district', 'property_category', 'property_type', 'rooms', 'month')
+ROLLUP_MEASURES = ('price', 'price_per_sqm', 'area')
+SKETCH_MEASURES = ('price', 'price_per_sqm')
+
+# Метка промежуточного итога ("все значения измерения"), ее код всегда 0
+ALL = '*'
+
+# Коды измерений упаковываются в один int64 ключ ячейки по CODE_BITS бит на измерение
+CODE_BITS = 12
+
+def _group_reduce(inverse, n_groups, values, ufunc, initial):
+    result = np.full(n_groups, initial)
+    ufunc.at(result, inverse, values)
+    return result
+
+class RollupCube:
+    """Предрасчитанный куб со всеми промежуточными итогами (2^5 уровней).
+
+    Ячейка - комбинация значений измерений ROLLUP_DIMENSIONS, где любое
+    измерение может быть ALL. В ячейке хранятся слагаемые статистики по мерам
+    (count, sum, sum of squares, min, max) и скетч квантилей цены, поэтому
+    кубы разных кусков генерации или запусков загрузки складываются через
+    merge. Ячейка находится по словарю ключей за O(1), корзины скетча ячейки
+    лежат подряд (CSR по indptr).
+    """
+
+    def __init__(self):
+        self.labels = {dimension: [ALL] for dimension in ROLLUP_DIMENSIONS}
+        self.codes = {dimension: {ALL: 0} for dimension in ROLLUP_DIMENSIONS}
+        self.index = {}
+        n_measures = len(ROLLUP_MEASURES)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.count = np.empty(0, dtype=np.int64)
+        self.n = np.empty((0, n_measures), dtype=np.int64)
+        self.sum = np.empty((0, n_measures))
+        self.sumsq = np.empty((0, n_measures))
+        self.min = np.empty((0, n_measures))
+        self.max = np.empty((0, n_measures))
+        self.sketch_keys = {measure: np.empty(0, dtype=np.int64) for measure in SKETCH_MEASURES}
+        self.sketch_counts = {measure: np.empty(0, dtype=np.int64) for measure in SKETCH_MEASURES}
+        self.sketch_indptr = {measure: np.zeros(1, dtype=np.int64) for measure in SKETCH_MEASURES}
+
+    # --- Коды измерений и ключи ячеек ---
+
+    def _code(self, dimension, label):
+        code = self.codes[dimension].get(label)
+        if code is None:
+            code = len(self.labels[dimension])
+            if code >= 1 << CODE_BITS:
+                raise ValueError(f"Слишком много значений измерения {dimension} (больше {(1 << CODE_BITS) - 1})")
+            self.labels[dimension].append(label)
+            self.codes[dimension][label] = code
+        return code
+
+    @staticmethod
+    def _dimension_labels(dimension, uniques):
+        """Метки измерения для уникальных значений колонки (типы Python, пропуск - None)"""
+        if dimension == 'month':
+            return list(pd.to_datetime(uniques).strftime('%Y-%m'))
+        if dimension == 'rooms':
+            return [int(value) for value in uniques]
+        return [str(value) for value in uniques]
+
+    def _leaf_codes(self, df):
+        codes = np.empty((len(df), len(ROLLUP_DIMENSIONS)), dtype=np.int64)
+        for position, dimension in enumerate(ROLLUP_DIMENSIONS):
+            if dimension == 'month':
+                column = df['publish_date']
+            elif dimension == 'rooms':
+                column = pd.to_numeric(df['rooms'], errors='coerce').round().astype('Int64')
+            else:
+                column = df[dimension]
+            local_codes, uniques = pd.factorize(column)
+            labels = self._dimension_labels(dimension, uniques) + [None]
+            # Код -1 (пропуск) берет последний элемент - метку None
+            lookup = np.array([self._code(dimension, label) for label in labels], dtype=np.int64)
+            codes[:, position] = lookup[local_codes]
+        return codes
+
+    @staticmethod
+    def _pack(codes):
+        keys = np.zeros(len(codes), dtype=np.int64)
+        for position in range(codes.shape[1]):
+            keys |= codes[:, position] << (CODE_BITS * position)
+        return keys
+
+    @staticmethod
+    def _unpack(keys):
+        mask = (1 << CODE_BITS) - 1
+        return np.stack([(keys >> (CODE_BITS * position)) & mask
+                         for position in range(len(ROLLUP_DIMENSIONS))], axis=1)
+
+    def _rows_for(self, keys):
+        """Номера строк ячеек (новые ячейки добавляются с нулевой статистикой)"""
+        rows = np.fromiter((self.index.get(key, -1) for key in keys.tolist()), dtype=np.int64, count=len(keys))
+        new = rows == -1
+        if new.any():
+            first = len(self.keys)
+            new_keys = keys[new]
+            rows[new] = np.arange(first, first + len(new_keys))
+            self.index.update(zip(new_keys.tolist(), rows[new].tolist()))
+            n_new, n_measures = len(new_keys), len(ROLLUP_MEASURES)
+            self.keys = np.concatenate([self.keys, new_keys])
+            self.count = np.concatenate([self.count, np.zeros(n_new, dtype=np.int64)])
+            self.n = np.concatenate([self.n, np.zeros((n_new, n_measures), dtype=np.int64)])
+            self.sum = np.concatenate([self.sum, np.zeros((n_new, n_measures))])
+            self.sumsq = np.concatenate([self.sumsq, np.zeros((n_new, n_measures))])
+            self.min = np.concatenate([self.min, np.full((n_new, n_measures), np.inf)])
+            self.max = np.concatenate([self.max, np.full((n_new, n_measures), -np.inf)])
+        return rows
+
+    # --- Накопление ---
+
+    def _accumulate(self, keys, count, n, sums, sumsq, mins, maxs, sketches):
+        """Добавляет статистику уникальных ячеек keys; sketches - {мера: (номер ячейки в keys, корзина, счетчик)}"""
+        rows = self._rows_for(keys)
+        self.count[rows] += count
+        self.n[rows] += n
+        self.sum[rows] += sums
+        self.sumsq[rows] += sumsq
+        self.min[rows] = np.minimum(self.min[rows], mins)
+        self.max[rows] = np.maximum(self.max[rows], maxs)
+        return [(measure, rows[cells] * SKETCH_BINS + bins, counts)
+                for measure, (cells, bins, counts) in sketches.items()]
+
+    def _compact_sketches(self, pending):
+        """Слияние новых корзин скетчей с накопленными и пересборка indptr"""
+        for measure in SKETCH_MEASURES:
+            parts = [(keys, counts) for name, keys, counts in pending if name == measure]
+            keys = np.concatenate([self.sketch_keys[measure]] + [keys for keys, _ in parts])
+            counts = np.concatenate([self.sketch_counts[measure]] + [counts for _, counts in parts])
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            self.sketch_keys[measure] = unique_keys
+            self.sketch_counts[measure] = np.bincount(inverse, weights=counts, minlength=len(unique_keys)).astype(np.int64)
+            self.sketch_indptr[measure] = np.searchsorted(unique_keys, np.arange(len(self.keys) + 1) * SKETCH_BINS)
+
+    def update(self, df):
+        """Добавляет кусок датасета: статистика считается по листовым ячейкам,
+        затем листья сворачиваются во все 2^5 уровней промежуточных итогов"""
+        if not len(df):
+            return self
+        leaf_keys, inverse = np.unique(self._pack(self._leaf_codes(df)), return_inverse=True)
+        n_leaves, n_measures = len(leaf_keys), len(ROLLUP_MEASURES)
+
+        # Листовые агрегаты
+        leaf_count = np.bincount(inverse, minlength=n_leaves)
+        leaf_n = np.zeros((n_leaves, n_measures), dtype=np.int64)
+        leaf_sum, leaf_sumsq = np.zeros((n_leaves, n_measures)), np.zeros((n_leaves, n_measures))
+        leaf_min, leaf_max = np.zeros((n_leaves, n_measures)), np.zeros((n_leaves, n_measures))
+        leaf_sketches = {}
+        for position, measure in enumerate(ROLLUP_MEASURES):
+            values = pd.to_numeric(df[measure], errors='coerce').to_numpy(dtype=float)
+            present = ~np.isnan(values)
+            groups, values = inverse[present], values[present]
+            leaf_n[:, position] = np.bincount(groups, minlength=n_leaves)
+            leaf_sum[:, position] = np.bincount(groups, weights=values, minlength=n_leaves)
+            leaf_sumsq[:, position] = np.bincount(groups, weights=values * values, minlength=n_leaves)
+            leaf_min[:, position] = _group_reduce(groups, n_leaves, values, np.minimum, np.inf)
+            leaf_max[:, position] = _group_reduce(groups, n_leaves, values, np.maximum, -np.inf)
+            if measure in SKETCH_MEASURES:
+                entries, counts = np.unique(groups * SKETCH_BINS + sketch_bins(values), return_counts=True)
+                leaf_sketches[measure] = (entries // SKETCH_BINS, entries % SKETCH_BINS, counts)
+
+        # Свертка листьев в уровни: бит уровня = измерение заменено на ALL
+        leaf_codes = self._unpack(leaf_keys)
+        pending = []
+        for level in range(1 << len(ROLLUP_DIMENSIONS)):
+            codes = leaf_codes.copy()
+            for position in range(len(ROLLUP_DIMENSIONS)):
+                if level >> position & 1:
+                    codes[:, position] = 0
+            keys, to_cell = np.unique(self._pack(codes), return_inverse=True)
+            n_cells = len(keys)
+            sketches = {}
+            for measure, (leaves, bins, counts) in leaf_sketches.items():
+                entries, entry_inverse = np.unique(to_cell[leaves] * SKETCH_BINS + bins, return_inverse=True)
+                sketches[measure] = (entries // SKETCH_BINS, entries % SKETCH_BINS,
+                                     np.bincount(entry_inverse, weights=counts).astype(np.int64))
+            pending += self._accumulate(
+                keys,
+                np.bincount(to_cell, weights=leaf_count, minlength=n_cells).astype(np.int64),
+                np.stack([np.bincount(to_cell, weights=leaf_n[:, i], minlength=n_cells) for i in range(n_measures)], axis=1).astype(np.int64),
+                np.stack([np.bincount(to_cell, weights=leaf_sum[:, i], minlength=n_cells) for i in range(n_measures)], axis=1),
+                np.stack([np.bincount(to_cell, weights=leaf_sumsq[:, i], minlength=n_cells) for i in range(n_measures)], axis=1),
+                np.stack([_group_reduce(to_cell, n_cells, leaf_min[:, i], np.minimum, np.inf) for i in range(n_measures)], axis=1),
+                np.stack([_group_reduce(to_cell, n_cells, leaf_max[:, i], np.maximum, -np.inf) for i in range(n_measures)], axis=1),
+                sketches
+            )
+        self._compact_sketches(pending)
+        return self
+
+    def merge(self, other):
+        """Добавляет куб другого куска или запуска (коды измерений перекодируются)"""
+        if not len(other.keys):
+            return self
+        codes = other._unpack(other.keys)
+        for position, dimension in enumerate(ROLLUP_DIMENSIONS):
+            lookup = np.array([self._code(dimension, label) for label in other.labels[dimension]], dtype=np.int64)
+            codes[:, position] = lookup[codes[:, position]]
+        sketches = {}
+        for measure in SKETCH_MEASURES:
+            entries = other.sketch_keys[measure]
+            sketches[measure] = (entries // SKETCH_BINS, entries % SKETCH_BINS, other.sketch_counts[measure])
+        pending = self._accumulate(self._pack(codes), other.count, other.n, other.sum, other.sumsq,
+                                   other.min, other.max, sketches)
+        self._compact_sketches(pending)
+        return self
+
+    # --- Срезы ---
+
+    def _row(self, slice_values):
+        codes = np.zeros((1, len(ROLLUP_DIMENSIONS)), dtype=np.int64)
+        for dimension, value in slice_values.items():
+            if dimension not in self.codes:
+                raise KeyError(f"Нет измерения {dimension}, доступны: {', '.join(ROLLUP_DIMENSIONS)}")
+            code = self.codes[dimension].get(value)
+            if code is None:
+                return None
+            codes[0, ROLLUP_DIMENSIONS.index(dimension)] = code
+        return self.index.get(int(self._pack(codes)[0]))
+
+    def _sketch_quantiles(self, measure, row, quantiles):
+        start, end = self.sketch_indptr[measure][row], self.sketch_indptr[measure][row + 1]
+        counts = self.sketch_counts[measure][start:end]
+        return histogram_quantiles(self.sketch_keys[measure][start:end] % SKETCH_BINS, counts, quantiles)
+
+    def _row_stats(self, row, quantiles):
+        stats = {'count': int(self.count[row])}
+        for position, measure in enumerate(ROLLUP_MEASURES):
+            n = self.n[row, position]
+            mean = self.sum[row, position] / n if n else np.nan
+            stats[f"{measure}_count"] = int(n)
+            stats[f"{measure}_mean"] = mean
+            stats[f"{measure}_std"] = np.sqrt(max(self.sumsq[row, position] / n - mean * mean, 0.0)) if n else np.nan
+            stats[f"{measure}_min"] = self.min[row, position] if n else np.nan
+            stats[f"{measure}_max"] = self.max[row, position] if n else np.nan
+            if measure in SKETCH_MEASURES:
+                for q, value in zip(quantiles, self._sketch_quantiles(measure, row, quantiles)):
+                    stats[f"{measure}_median" if q == 0.5 else f"{measure}_p{q * 100:g}"] = value
+        return stats
+
+    def cell(self, quantiles=(0.5,), **slice_values):
+        """Статистика одной ячейки: не указанные измерения - промежуточный итог (ALL).
+        Например cell(district='ЦАО', property_category='жилая'). Нет ячейки - None"""
+        row = self._row(slice_values)
+        return None if row is None else self._row_stats(row, quantiles)
+
+    def quantile(self, q, measure='price', **slice_values):
+        """Приближенный квантиль (или список квантилей) меры в ячейке"""
+        quantiles = np.atleast_1d(q).astype(float)
+        row = self._row(slice_values)
+        values = np.full(len(quantiles), np.nan) if row is None else self._sketch_quantiles(measure, row, quantiles)
+        return values if np.ndim(q) else float(values[0])
+
+    def breakdown(self, by, quantiles=(0.5,), **slice_values):
+        """Таблица ячеек по значениям измерений by при фиксированных slice_values
+        (остальные измерения - промежуточный итог)"""
+        by = (by,) if isinstance(by, str) else tuple(by)
+        codes = self._unpack(self.keys)
+        selected = np.ones(len(self.keys), dtype=bool)
+        for position, dimension in enumerate(ROLLUP_DIMENSIONS):
+            if dimension in by:
+                selected &= codes[:, position] != 0
+            elif dimension in slice_values:
+                selected &= codes[:, position] == self.codes[dimension].get(slice_values[dimension], -1)
+            else:
+                selected &= codes[:, position] == 0
+        positions = [ROLLUP_DIMENSIONS.index(dimension) for dimension in by]
+        cells = [(tuple(self.labels[dimension][code] for dimension, code in zip(by, codes[row, positions])), row)
+                 for row in np.flatnonzero(selected)]
+        # Пропуск (None) - в конце, остальные метки по возрастанию
+        cells.sort(key=lambda cell: tuple((label is None, label) for label in cell[0]))
+        frame = pd.DataFrame([self._row_stats(row, quantiles) for _, row in cells],
+                             index=pd.MultiIndex.from_tuples([labels for labels, _ in cells], names=list(by)))
+        if len(by) == 1:
+            frame.index = frame.index.get_level_values(0)
+        return frame
+
+    # --- Хранение ---
+
+    def save(self, path=ROLLUP_CUBE_FILE):
+        """Атомарная запись куба в сжатый npz"""
+        arrays = {
+            'labels': np.array(json.dumps(self.labels, ensure_ascii=False)),
+            'keys': self.keys, 'count': self.count, 'n': self.n,
+            'sum': self.sum, 'sumsq': self.sumsq, 'min': self.min, 'max': self.max
+        }
+        for measure in SKETCH_MEASURES:
+            arrays[f"sketch_keys_{measure}"] = self.sketch_keys[measure]
+            arrays[f"sketch_counts_{measure}"] = self.sketch_counts[measure]
+        tmp_file = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_file, **arrays)
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path=ROLLUP_CUBE_FILE):
+        cube = cls()
+        with np.load(path, allow_pickle=False) as data:
+            cube.labels = json.loads(str(data['labels']))
+            cube.codes = {dimension: {label: code for code, label in enumerate(labels)}
+                          for dimension, labels in cube.labels.items()}
+            for name in ('keys', 'count', 'n', 'sum', 'sumsq', 'min', 'max'):
+                setattr(cube, name, data[name])
+            for measure in SKETCH_MEASURES:
+                cube.sketch_keys[measure] = data[f"sketch_keys_{measure}"]
+                cube.sketch_counts[measure] = data[f"sketch_counts_{measure}"]
+                cube.sketch_indptr[measure] = np.searchsorted(cube.sketch_keys[measure],
+                                                              np.arange(len(cube.keys) + 1) * SKETCH_BINS)
+        cube.index = dict(zip(cube.keys.tolist(), range(len(cube.keys))))
+        return cube
@@ -0,0 +1,233 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Скетч квантилей: логарифмические корзины с шагом SKETCH_GAMMA (погрешность ~1%),
+# корзина 0 - значения <= 0, последняя покрывает цены до ~1.5e11
+SKETCH_GAMMA = 1.02
+SKETCH_BINS = 1300
+
+# HyperLogLog: 2^HLL_PRECISION регистров, стандартная ошибка 1.04 / sqrt(2^p) (~0.8% при p=14)
+HLL_PRECISION = 14
+
+def sketch_bins(values):
+    """Номер логарифмической корзины для каждого значения"""
+    values = np.asarray(values, dtype=float)
+    bins = np.zeros(len(values), dtype=np.int64)
+    positive = values > 0
+    bins[positive] = np.clip(np.ceil(np.log(values[positive]) / np.log(SKETCH_GAMMA)), 1, SKETCH_BINS - 1)
+    return bins
+
+def bin_values(bins):
+    """Представитель корзины (gamma^(i-1), gamma^i] с относительной погрешностью (gamma-1)/(gamma+1)"""
+    return np.where(bins > 0, 2 * SKETCH_GAMMA ** np.asarray(bins, dtype=float) / (SKETCH_GAMMA + 1), 0.0)
+
+def histogram_quantiles(bins, counts, quantiles):
+    """Квантили по непустым корзинам (bins по возрастанию) и их счетчикам"""
+    quantiles = np.atleast_1d(quantiles).astype(float)
+    if not len(counts) or counts.sum() == 0:
+        return np.full(len(quantiles), np.nan)
+    ranks = quantiles * (counts.sum() - 1)
+    return bin_values(bins[np.searchsorted(np.cumsum(counts), ranks, side='right')])
+
+def hash_values(values):
+    """Стабильный между запусками 64-битный хэш значений (пропуски не хэшируются)"""
+    values = pd.Series(values).dropna()
+    return pd.util.hash_pandas_object(values.astype(str), index=False).to_numpy()
+
+def hll_positions(hashes, precision=HLL_PRECISION):
+    """Номер регистра (старшие precision бит) и ранг - позиция первой единицы в остальных битах"""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    registers = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rest = hashes << np.uint64(precision)
+    # Ведущие нули считаем по половинам: 32-битные числа float64 представляет точно
+    high = (rest >> np.uint64(32)).astype(np.float64)
+    low = (rest & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    with np.errstate(divide='ignore'):
+        leading = np.where(high > 0, 31 - np.floor(np.log2(high)), 63 - np.floor(np.log2(low)))
+    leading = np.where(rest == 0, 64 - precision, np.minimum(leading, 64 - precision))
+    return registers, (leading + 1).astype(np.uint8)
+
+def hll_estimate(registers):
+    """Оценка числа различных значений по регистрам (с поправкой линейного счета на малых числах)"""
+    m = registers.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.exp2(-registers.astype(float)), axis=-1)
+    zeros = np.sum(registers == 0, axis=-1)
+    with np.errstate(divide='ignore'):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+class QuantileSketch:
+    """Скетч квантилей с постоянной памятью (SKETCH_BINS счетчиков) и относительной
+    погрешностью ~1%; скетчи складываются без потери точности"""
+
+    def __init__(self, counts=None):
+        self.counts = np.zeros(SKETCH_BINS, dtype=np.int64) if counts is None else counts
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        self.counts += np.bincount(sketch_bins(values[~np.isnan(values)]), minlength=SKETCH_BINS)
+        return self
+
+    def merge(self, other):
+        self.counts += other.counts
+        return self
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def quantile(self, q):
+        bins = np.flatnonzero(self.counts)
+        values = histogram_quantiles(bins, self.counts[bins], q)
+        return values if np.ndim(q) else float(values[0])
+
+class HyperLogLog:
+    """Приближенный счетчик различных значений (HyperLogLog, 2^precision байт)"""
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    def update(self, values):
+        positions, ranks = hll_positions(hash_values(values), self.precision)
+        np.maximum.at(self.registers, positions, ranks)
+        return self
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Нельзя объединить HyperLogLog разной точности")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        return int(round(float(hll_estimate(self.registers))))
+
+class GroupSketches:
+    """Скетчи квантилей и счетчики различных значений по группам.
+
+    Кормится кусками датасета или пачками загрузчика (update), группы
+    складываются между запусками (merge, save/load). Память на группу
+    постоянная: SKETCH_BINS счетчиков на колонку квантилей и 2^precision
+    байт на колонку различных значений.
+    """
+
+    def __init__(self, quantile_columns=('price', 'price_per_sqm'), distinct_columns=('external_id', 'address'),
+                 precision=HLL_PRECISION):
+        self.quantile_columns = tuple(quantile_columns)
+        self.distinct_columns = tuple(distinct_columns)
+        self.precision = precision
+        self.groups = []
+        self.group_index = {}
+        self.histograms = {column: np.zeros((0, SKETCH_BINS), dtype=np.int64) for column in self.quantile_columns}
+        self.registers = {column: np.zeros((0, 1 << precision), dtype=np.uint8) for column in self.distinct_columns}
+
+    def _group_rows(self, labels):
+        """Номера строк групп (новые группы добавляются пустыми)"""
+        rows = []
+        for label in labels:
+            label = label.item() if isinstance(label, np.generic) else label
+            if label not in self.group_index:
+                self.group_index[label] = len(self.groups)
+                self.groups.append(label)
+            rows.append(self.group_index[label])
+        added = len(self.groups) - len(next(iter(self.histograms.values()), np.zeros((len(self.groups), 0))))
+        if added > 0:
+            for column in self.quantile_columns:
+                self.histograms[column] = np.vstack([self.histograms[column], np.zeros((added, SKETCH_BINS), dtype=np.int64)])
+            for column in self.distinct_columns:
+                self.registers[column] = np.vstack([self.registers[column],
+                                                    np.zeros((added, 1 << self.precision), dtype=np.uint8)])
+        return np.array(rows, dtype=np.int64)
+
+    def update(self, df, by=None):
+        """Добавляет строки df; by - колонка группы (None - одна группа 'all')"""
+        if not len(df):
+            return self
+        if by is None:
+            local_codes, labels = np.zeros(len(df), dtype=np.int64), ['all']
+        else:
+            local_codes, labels = pd.factorize(df[by])
+        present = local_codes >= 0
+        rows = self._group_rows(list(labels))[local_codes[present]]
+        df = df[present]
+
+        for column in self.quantile_columns:
+            values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+            valid = ~np.isnan(values)
+            keys = rows[valid] * SKETCH_BINS + sketch_bins(values[valid])
+            counts = np.bincount(keys, minlength=len(self.groups) * SKETCH_BINS)
+            self.histograms[column] += counts.reshape(len(self.groups), SKETCH_BINS)
+
+        m = 1 << self.precision
+        for column in self.distinct_columns:
+            valid = df[column].notna().to_numpy()
+            positions, ranks = hll_positions(hash_values(df[column]), self.precision)
+            flat = self.registers[column].reshape(-1)
+            np.maximum.at(flat, rows[valid] * m + positions, ranks)
+        return self
+
+    def merge(self, other):
+        """Складывает скетчи другого запуска (группы сопоставляются по меткам)"""
+        if other.precision != self.precision:
+            raise ValueError("Нельзя объединить HyperLogLog разной точности")
+        rows = self._group_rows(other.groups)
+        for column in self.quantile_columns:
+            self.histograms[column][rows] += other.histograms[column]
+        for column in self.distinct_columns:
+            self.registers[column][rows] = np.maximum(self.registers[column][rows], other.registers[column])
+        return self
+
+    def _selected(self, group):
+        if group is None:
+            return slice(None)
+        row = self.group_index.get(group)
+        if row is None:
+            raise KeyError(f"Нет группы {group}")
+        return [row]
+
+    def quantile(self, column, q, group=None):
+        """Квантиль колонки в группе (None - по всем группам)"""
+        return QuantileSketch(self.histograms[column][self._selected(group)].sum(axis=0)).quantile(q)
+
+    def count(self, column, group=None):
+        return int(self.histograms[column][self._selected(group)].sum())
+
+    def distinct(self, column, group=None):
+        """Оценка числа различных значений колонки в группе (None - по всем группам)"""
+        registers = self.registers[column][self._selected(group)].max(axis=0)
+        return HyperLogLog(self.precision, registers).estimate()
+
+    def save(self, path):
+        """Атомарная запись скетчей в сжатый npz"""
+        meta = {
+            'groups': self.groups,
+            'quantile_columns': self.quantile_columns,
+            'distinct_columns': self.distinct_columns,
+            'precision': self.precision
+        }
+        arrays = {'meta': np.array(json.dumps(meta, ensure_ascii=False))}
+        for column in self.quantile_columns:
+            arrays[f"histogram_{column}"] = self.histograms[column]
+        for column in self.distinct_columns:
+            arrays[f"registers_{column}"] = self.registers[column]
+        tmp_file = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_file, **arrays)
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            sketches = cls(meta['quantile_columns'], meta['distinct_columns'], meta['precision'])
+            # Ключи групп из JSON: списки обратно в кортежи
+            sketches.groups = [tuple(group) if isinstance(group, list) else group for group in meta['groups']]
+            sketches.group_index = {group: row for row, group in enumerate(sketches.groups)}
+            for column in sketches.quantile_columns:
+                sketches.histograms[column] = data[f"histogram_{column}"]
+            for column in sketches.distinct_columns:
+                sketches.registers[column] = data[f"registers_{column}"]
+        return sketches
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from price_index import PriceIndex
+
+def _frame(rows):
+    return pd.DataFrame(rows, columns=['district', 'property_type', 'publish_date', 'price_per_sqm'])
+
+def _random_frame(rng, n, first_day, n_days):
+    return pd.DataFrame({
+        'district': rng.choice(['ЦАО', 'ЗАО', 'САО', 'ЮАО'], n),
+        'property_type': rng.choice(['квартира', 'офис', 'склад'], n),
+        'publish_date': pd.Timestamp(first_day) + pd.to_timedelta(rng.integers(0, n_days, n), unit='D'),
+        'price_per_sqm': rng.lognormal(12, 0.5, n)
+    })
+
+def _sorted(index):
+    frame = index.to_frame()
+    return frame.sort_values(['district', 'property_type', 'series', 'date']).reset_index(drop=True)
+
+def assert_same_index(updated, rebuilt):
+    pd.testing.assert_frame_equal(_sorted(updated), _sorted(rebuilt))
+
+def test_update_extends_windows_of_untouched_groups():
+    d1 = _frame([('ЦАО', 'офис', '2026-01-01', 100.0), ('ЗАО', 'офис', '2026-01-01', 200.0)])
+    d2 = _frame([('ЗАО', 'офис', '2026-01-03', 300.0)])
+    updated = PriceIndex.from_frames([d1]).update(d2)
+    assert_same_index(updated, PriceIndex.from_frames([d1, d2]))
+    assert len(updated.series_frame('ЦАО', 'офис', 'rolling_7')) == 3
+
+def test_update_matches_rebuild_on_combined_data():
+    rng = np.random.default_rng(7)
+    history = _random_frame(rng, 3000, '2025-06-01', 240)
+    # Новые дни после конца истории, до ее начала и повторная загрузка части дней
+    later = _random_frame(rng, 400, '2026-02-01', 60)
+    earlier = _random_frame(rng, 200, '2025-04-01', 30)
+    days = history['publish_date'].isin(history['publish_date'].drop_duplicates().sample(20, random_state=1))
+    reloaded = history[days].assign(price_per_sqm=lambda df: df['price_per_sqm'] * 1.1)
+
+    updated = PriceIndex.from_frames([history])
+    for df in (later, earlier, reloaded):
+        updated.update(df)
+    combined = pd.concat([history[~days], reloaded, later, earlier], ignore_index=True)
+    assert_same_index(updated, PriceIndex.from_frames([combined]))
+
+def test_update_survives_save_and_load(tmp_path):
+    rng = np.random.default_rng(3)
+    history, later = _random_frame(rng, 500, '2025-10-01', 60), _random_frame(rng, 100, '2025-12-05', 20)
+    PriceIndex.from_frames([history]).save(tmp_path / 'index.npz')
+    updated = PriceIndex.load(tmp_path / 'index.npz').update(later)
+    assert_same_index(updated, PriceIndex.from_frames([history, later]))